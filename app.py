@@ -1,7 +1,10 @@
 from folium import Map
-from dash import html, Dash, Input, Output
+from dash import html, dcc, Dash, Input, Output, State, no_update
+from dash.exceptions import PreventUpdate
+from flask import jsonify
 from folium.plugins import MousePosition, Draw, LocateControl, MiniMap
 import dash_bootstrap_components as dbc
+from modules.jobs import JobQueue
 import os
 
 LOGO = 'https://timur.es/wp-content/uploads/2019/10/Space-Apps-NASA.png'
@@ -35,6 +38,9 @@ if __name__ == "__main__":
 
     create_map()
 
+    # Warm worker processes that run the orders (EMIT_WORKERS at a time)
+    jobs = JobQueue(workers=int(os.environ.get('EMIT_WORKERS', 2)))
+
     # Initialize the Dash app
     app = Dash(__name__,  external_stylesheets=[dbc.themes.BOOTSTRAP])
     
@@ -75,7 +81,10 @@ if __name__ == "__main__":
                     dbc.Col(dbc.Button('Send Order', id='login-button', n_clicks=0, color='primary', className='ml-0',size="sm"), width=2),  # Añadir margen inferior al botón
                 ], className='mt-1', align="center"),
                 
-                html.Div(id='output-message')
+                html.Div(id='output-message'),
+                html.Div(id='job-status'),
+                dcc.Store(id='job-ids', data=[]),
+                dcc.Interval(id='job-poll', interval=3000),
             ], className='mb-1'),
         
 
@@ -85,27 +94,70 @@ if __name__ == "__main__":
     # Callback para manejar el clic del botón y enviar coords
     @app.callback(
         Output('output-message', 'children'),
+        Output('job-ids', 'data'),
         Input('login-button', 'n_clicks'),
-        Input('username-input', 'value'),
-        Input('password-input', 'value'),
-        Input('box-input', 'value'),
-        Input('year-input', 'value'),
-        Input('month-input', 'value'),
+        State('username-input', 'value'),
+        State('password-input', 'value'),
+        State('box-input', 'value'),
+        State('year-input', 'value'),
+        State('month-input', 'value'),
+        State('job-ids', 'data'),
     )
 
     
-    def check_credentials(n_clicks, username, password, box, year, month):
-        if n_clicks == 1:
+    def check_credentials(n_clicks, username, password, box, year, month, job_ids):
+        if not n_clicks:
+            raise PreventUpdate
+
+        # Incomplete forms never reach the queue
+        try:
+            lat, lon = (v.strip() for v in (box or '').split(','))
+            float(lat), float(lon)
+        except ValueError:
+            return 'Enter the coordinates as two numbers separated by a comma', no_update
+        if not (username and password and year and month):
+            return 'Enter your EarthData user and password, the year and the month', no_update
+
+        bx = (lat, lon, lat, lon)
 
-            lat, lon = box.split(',')
+        date = (f'{year}-{month}-01', f'{year}-{month}-30')
 
-            bx = f'{lat},{lon},{lat},{lon}'
+        # Queue the order and return right away; the status is polled below
+        job_id = jobs.submit(username, password, date, bx)
 
-            date = f'{year}-{month}-01,{year}-{month}-30'
+        return f'Order {job_id} queued', job_ids + [job_id]
 
-            os.system('python main.py --u ' + username + ' --p ' + password + ' --d ' + date  + ' --bx ' + '"'+"'"+bx+"'"+'"')
+    # Callback para consultar el estado de las ordenes
+    @app.callback(
+        Output('job-status', 'children'),
+        Input('job-poll', 'n_intervals'),
+        State('job-ids', 'data'),
+    )
+
+    def job_status(n_intervals, job_ids):
+        if not job_ids:
+            raise PreventUpdate
+
+        lines = []
+        for job_id in job_ids:
+            job = jobs.status(job_id)
+            if job is None:
+                continue
+            text = f"Order {job_id}: {job['status']}"
+            if job['status'] == 'done':
+                text += f" - {job['result']['report']}"
+            elif job['status'] == 'failed':
+                text += f" - {job['error']}"
+            lines.append(html.Div(text))
+
+        return lines
 
     
 
+    # Metrics for sizing the workers: throughput, queue depth and stage latency histograms
+    @app.server.route('/metrics')
+    def metrics():
+        return jsonify(jobs.metrics())
+
     # Run the Dash app
     app.run_server(debug=False)
\ No newline at end of file
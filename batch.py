@@ -0,0 +1,153 @@
+import os
+import json
+import service
+import multiprocessing
+from modules import emit_tools, indices, render, sites, tracing
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import warnings
+warnings.filterwarnings("ignore")
+
+# Batch mode: many sites from a CSV/GeoJSON file. Sites are grouped by the L2A granule covering them, so every
+# granule is searched, downloaded and analysed once; each site then gets its own crop and report
+# ('./data/<out>/<site id>/<granule>.pdf'), rendered and written across a pool of worker processes.
+
+
+
+def site_report(crop, site, name_image, date_image, out, figsize=(12,12), dpi=None, fast=False):
+
+    # Runs in a worker process: render the crop in memory and write the site report
+    jobs = service.product_jobs(crop, fast=fast)
+    rendered = render.render(jobs, workers=1, figsize=figsize, dpi=dpi)
+    products = {spec['name']: product for spec, product in zip(indices.INDICES, rendered)}
+
+    folder = os.path.join(out, site['id'].replace(os.sep, '_'))
+    os.makedirs('./data/' + folder, exist_ok=True)
+
+    service.create_pdf(products['rgb'],
+                       products['ndvi'],
+                       products['iron_oxide'],
+                       products['alunite'],
+                       products['FEOOH'],
+                       products['AAI'],
+                       products['AIS'],
+                       products['DOS'],
+                       name_image,
+                       folder,
+                       site['bbox'],
+                       date_image)
+
+    return os.path.join('./data', folder, name_image.replace('.nc', '.pdf'))
+
+
+
+def run_batch(user, password, sites_file, date=None, out='batch', window=100, workers=None, dpi=None, fast=False, figsize=(12,12), job_id=None):
+
+    trace = tracing.Trace(job_id, sites=sites_file)
+    result = {'folder': './data/' + out, 'granules': 0, 'sites': [], 'timings': trace.timings, 'trace': trace.path}
+
+    site_list = sites.read_sites(sites_file, date=date, window=window)
+    status = {site['id']: {'id': site['id'], 'lon': site['lon'], 'lat': site['lat'], 'granule': None,
+                           'acquired': None, 'report': None, 'error': None} for site in site_list}
+
+    ctx = multiprocessing.get_context('spawn')
+    workers = workers or os.cpu_count() or 1
+
+    with trace.activate(), trace.span('total'), ThreadPoolExecutor(max_workers=1) as downloads, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+
+        # Only sites no selected granule covers trigger a lookup: the cached footprints first, then the catalogue
+        with tracing.span('search', sites=len(site_list)):
+            groups, missing = sites.group_sites(site_list, lambda site: service.find_granule(user, password, site['bbox'], site['date'], 'EMITL2ARFL'))
+        for site in missing:
+            status[site['id']]['error'] = f"No EMITL2ARFL granule found for {site['bbox']} up to {site['date'][1]}"
+        result['granules'] = len(groups)
+        print(f'\n{len(site_list)} sites, {len(groups)} granules\n')
+
+        # The next granule downloads while the current one is analysed
+        def fetch(group):
+            return trace.traced('download L2A', service.download_granule, user, password, group['granule'], out, group['acquired'])
+
+        pending = downloads.submit(fetch, groups[0]) if groups else None
+        reports = []
+
+        for i, group in enumerate(groups):
+            try:
+                name_image = pending.result()
+            except Exception as e:
+                for site in group['sites']:
+                    status[site['id']]['error'] = str(e) or type(e).__name__
+                continue
+            finally:
+                pending = downloads.submit(fetch, groups[i + 1]) if i + 1 < len(groups) else None
+
+            nc_file = os.path.join('./data', out, name_image)
+
+            for site in group['sites']:
+                status[site['id']].update(granule=name_image, acquired=group['acquired'])
+
+            # Indices and spatial index once per granule, crops per site
+            try:
+                with tracing.span('analysis', granule=name_image, sites=len(group['sites'])):
+                    products = service.compute_indices(nc_file)
+                    index = emit_tools.spatial_index(nc_file)
+
+                    for site in group['sites']:
+                        try:
+                            crop = sites.crop(products, index, site['lon'], site['lat'], window)
+                        except ValueError as e:
+                            status[site['id']]['error'] = str(e)
+                            continue
+                        # Copies: the queued crops must not keep the whole granule products alive
+                        crop = {name: array.copy() for name, array in crop.items()}
+                        reports.append((site, pool.submit(site_report, crop, site, name_image, group['acquired'], out, figsize, dpi, fast)))
+                    del products
+            except Exception as e:
+                # A failed granule fails its own sites only
+                for site in group['sites']:
+                    if status[site['id']]['error'] is None:
+                        status[site['id']]['error'] = str(e) or type(e).__name__
+
+        with tracing.span('reports', sites=len(reports)):
+            for site, future in reports:
+                try:
+                    status[site['id']]['report'] = future.result()
+                except Exception as e:
+                    status[site['id']]['error'] = str(e) or type(e).__name__
+
+    result['sites'] = list(status.values())
+    result['stages'] = [(span['span'], span['seconds']) for span in trace.spans]
+
+    os.makedirs(result['folder'], exist_ok=True)
+    with open(os.path.join(result['folder'], 'batch.json'), 'w') as f:
+        json.dump(result, f, indent=1, default=str)
+
+    done = sum(s['report'] is not None for s in result['sites'])
+    print(f'\n --- {done}/{len(site_list)} site reports from {len(groups)} granules --- \n')
+
+    return result
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports for many sites, one download and analysis per granule')
+    parser.add_argument('--u', type=str, required=True, help='')
+    parser.add_argument('--p', type=str, required=True, help='')
+    parser.add_argument('--sites', type=str, required=True, help='CSV (id, lon, lat[, start, end]) or GeoJSON points')
+    parser.add_argument('--d', type=str, default=None, help='Default date range "start,end" for sites without one')
+    parser.add_argument('--out', type=str, default='batch', help='Output folder under ./data')
+    parser.add_argument('--window', type=int, default=100, help='Half size of each site crop, in pixels (~60 m)')
+    parser.add_argument('--workers', type=int, default=None, help='Report processes (default: the number of cores)')
+    parser.add_argument('--dpi', type=int, default=None, help='Output DPI of the rendered images')
+    parser.add_argument('--fast', action='store_true', help='Write plain rasters through a colormap lookup table instead of Matplotlib figures')
+
+    args = parser.parse_args()
+
+    date = tuple(args.d.split(',')) if args.d else None
+
+    print('\nInitializing...\n')
+
+    run_batch(args.u, args.p, args.sites, date=date, out=args.out, window=args.window, workers=args.workers, dpi=args.dpi, fast=args.fast)
+
+if __name__ == "__main__":
+    main()
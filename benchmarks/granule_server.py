@@ -0,0 +1,123 @@
+"""
+Local stand-in for the Earthdata file server, used to test and benchmark `modules/download.py` offline.
+
+It serves a fake granule of a given size with HTTP range support, optionally throttling every connection and adding
+a per-request latency to mimic a remote server, then downloads it with 1 and N parallel ranges and checks the
+SHA-512 checksum.
+
+Usage (from the repository root):
+    python -m benchmarks.granule_server --size-mb 256 --parts 8 --rate-mb 20 --latency 0.05
+"""
+
+# Packages used
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from modules import download
+
+
+def fake_granule(path, size, seed=0):
+    """
+    This function writes a deterministic pseudo-random file of `size` bytes and returns its SHA-512.
+    """
+    digest = hashlib.sha512()
+    block = hashlib.sha512(str(seed).encode()).digest() * (download.BLOCK_SIZE // 64)
+    with open(path, 'wb') as f:
+        for start in range(0, size, len(block)):
+            chunk = block[:min(len(block), size - start)]
+            f.write(chunk)
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_handler(path, rate=None, latency=0.0):
+    """
+    This function builds a request handler serving `path` with range support.
+
+    Parameters:
+    path: the file to serve under any URL.
+    rate: maximum bytes per second per connection, unlimited when None.
+    latency: seconds added before every response.
+    """
+    size = os.path.getsize(path)
+
+    class GranuleHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            start, end = 0, size - 1
+            ranged = self.headers.get('Range', '').startswith('bytes=')
+            if ranged:
+                first, last = self.headers['Range'][6:].split('-')
+                start, end = int(first), min(int(last) if last else size - 1, size - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(download.BLOCK_SIZE // 4, remaining))
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    if rate:
+                        time.sleep(len(chunk) / rate)
+
+    return GranuleHandler
+
+
+def serve(path, rate=None, latency=0.0, port=0):
+    """
+    This function starts the stand-in server on a background thread.
+
+    Returns:
+    server: the running ThreadingHTTPServer, call `shutdown()` when done.
+    url: the URL of the fake granule.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(path, rate, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/EMIT_L2A_RFL_001_FAKE.nc'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the parallel ranged downloader')
+    parser.add_argument('--size-mb', type=int, default=256, help='Size of the fake granule')
+    parser.add_argument('--parts', type=int, default=8, help='Parallel ranges')
+    parser.add_argument('--chunk-mb', type=int, default=16, help='Range size')
+    parser.add_argument('--rate-mb', type=float, default=None, help='Per-connection throttle (MB/s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Per-request latency (s)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'granule.nc')
+        checksum = fake_granule(source, args.size_mb * 1024 * 1024)
+        rate = args.rate_mb * 1024 * 1024 if args.rate_mb else None
+        server, url = serve(source, rate, args.latency)
+
+        try:
+            for parts in sorted({1, args.parts}):
+                dest = os.path.join(tmp, f'download_{parts}.nc')
+                start = time.perf_counter()
+                download.download(url, dest, parts=parts, chunk_size=args.chunk_mb * 1024 * 1024,
+                                  checksum=checksum, algorithm='SHA-512')
+                seconds = time.perf_counter() - start
+                print(f'parts={parts:<3} {seconds:8.2f} s  {args.size_mb / seconds:8.1f} MB/s')
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Offline benchmark suite for the processing pipeline, on synthetic EMIT granules (see benchmarks/synthetic.py).
+
+Every case runs in its own subprocess, so its peak RSS is measured in isolation: the process running the case
+('peak_rss_mb', setup included) and the largest of its child processes ('children_peak_rss_mb', e.g. render
+workers). Wall time covers the timed call only. Results are written as JSON and, given a baseline file from an
+earlier run, compared against it: a case regresses when its time or peak memory grows over the tolerance, and the
+exit status is then 1.
+
+Cases: emit_xarray, ortho_xr, apply_glt, write_envi, analysis, create_pdf, mineral_data.
+Sizes: small (128 x 128), medium (512 x 512), full (1280 x 1242, a real EMIT scene), all with 285 bands.
+
+Usage (from the repository root):
+    python -m benchmarks.pipeline --sizes small,medium --output bench.json
+    python -m benchmarks.pipeline --sizes small,medium --baseline bench.json --tolerance 0.2
+
+Reference baseline: benchmarks/baseline_small.json (small size, default options; the machine is recorded in the
+file). Timings only compare on similar hardware: regenerate it with
+    python -m benchmarks.pipeline --sizes small --output benchmarks/baseline_small.json
+and commit it together with changes that knowingly move the numbers.
+"""
+
+# Packages used
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {'small': (128, 128), 'medium': (512, 512), 'full': (1280, 1242)}
+FOLDER = 'bench'
+PRODUCTS = ['rgb', 'ndvi', 'iron_oxide', 'alunite', 'FEOOH', 'AAI', 'AIS', 'DOS']
+
+
+def _context(rows, cols, options):
+    # Paths are relative to the working directory, as service.py expects ('./data/<folder>')
+    from benchmarks import synthetic
+    folder = os.path.join('./data', FOLDER)
+    return {'folder': folder,
+            'l2a': os.path.join(folder, synthetic.granule_name('L2A_RFL')),
+            'l2b': os.path.join(folder, synthetic.granule_name('L2B_MIN')),
+            'bbox': synthetic.bbox(rows, cols),
+            'options': options}
+
+
+# ==== Cases: setup (not timed), then return the call to time ====
+
+def case_emit_xarray(ctx):
+    from modules import emit_tools
+    return lambda: emit_tools.emit_xarray(ctx['l2a'])
+
+
+def case_ortho_xr(ctx):
+    from modules import emit_tools
+    ds = emit_tools.emit_xarray(ctx['l2a'])
+    return lambda: emit_tools.ortho_xr(ds)
+
+
+def case_apply_glt(ctx):
+    import numpy as np
+    from modules import emit_tools
+    ds = emit_tools.emit_xarray(ctx['l2a'])
+    data = ds['reflectance'].data
+    glt = np.nan_to_num(np.stack([ds['glt_x'].data, ds['glt_y'].data], axis=-1), nan=0).astype(int)
+    return lambda: emit_tools.apply_glt(data, glt)
+
+
+def case_write_envi(ctx):
+    from modules import emit_tools
+    out = os.path.join(ctx['folder'], 'envi')
+    os.makedirs(out, exist_ok=True)
+    ds = emit_tools.emit_xarray(ctx['l2a'], lazy=True)
+    return lambda: emit_tools.write_envi(ds, out, overwrite=True, glt_file=True)
+
+
+def case_analysis(ctx):
+    import service
+    return lambda: service.analysis(ctx['l2a'], ctx['folder'], **ctx['options'])
+
+
+def case_create_pdf(ctx):
+    import service
+    pngs = [os.path.join(ctx['folder'], p + '.png') for p in PRODUCTS]
+    name = os.path.basename(ctx['l2a'])
+    return lambda: service.create_pdf(*pngs, name, FOLDER, ctx['bbox'], '2023-06-01')
+
+
+def case_mineral_data(ctx):
+    import netCDF4 as nc
+    import service
+    ds = nc.Dataset(ctx['l2b'])
+    layers = [ds.variables[v][:] for v in ['group_1_band_depth', 'group_1_mineral_id', 'group_2_band_depth', 'group_2_mineral_id']]
+    name = os.path.basename(ctx['l2b'])[:-3]
+    return lambda: service.mineral_data(*layers, FOLDER, name, **ctx['options'])
+
+
+CASES = {
+    'emit_xarray': case_emit_xarray,
+    'ortho_xr': case_ortho_xr,
+    'apply_glt': case_apply_glt,
+    'write_envi': case_write_envi,
+    'analysis': case_analysis,
+    'create_pdf': case_create_pdf,
+    'mineral_data': case_mineral_data,
+}
+
+# Cases that need the outputs of another case first (run untimed in its own subprocess)
+PREPARE = {'create_pdf': 'analysis'}
+
+
+def _peak_mb(who):
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def child(case, rows, cols, options, result):
+    """
+    This function runs one case in the current process (the working directory holds ./data/bench) and writes its
+    measurements to `result`.
+    """
+    import resource
+    ctx = _context(rows, cols, options)
+    call = CASES[case](ctx)
+
+    start = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - start
+
+    with open(result, 'w') as f:
+        json.dump({'seconds': seconds,
+                   'peak_rss_mb': _peak_mb(resource.RUSAGE_SELF),
+                   'children_peak_rss_mb': _peak_mb(resource.RUSAGE_CHILDREN)}, f)
+
+
+def run_case(case, size, workdir, options, verbose=False):
+    """
+    This function runs one case in a fresh subprocess and returns its measurements, None if it failed.
+    """
+    rows, cols = SIZES[size]
+    result = os.path.join(workdir, f'{case}.json')
+    env = {**os.environ,
+           'PYTHONPATH': os.pathsep.join([ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]),
+           'EMIT_GEOCODER_ONLINE': '0',
+           'MPLBACKEND': 'Agg'}
+    cmd = [sys.executable, '-m', 'benchmarks.pipeline', '--child', case, '--rows', str(rows), '--cols', str(cols),
+           '--options', json.dumps(options), '--result', result]
+
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.run(cmd, cwd=workdir, env=env, stdout=out, stderr=None if verbose else subprocess.PIPE)
+    if proc.returncode != 0:
+        print(f'{case} [{size}] failed:\n{proc.stderr.decode(errors="replace")[-2000:] if proc.stderr else ""}')
+        return None
+    with open(result) as f:
+        return json.load(f)
+
+
+def run_suite(cases, sizes, options, repeat=1, keep=None, verbose=False):
+    """
+    This function generates the synthetic granules of every size and runs every case on them.
+
+    Returns:
+    results: a list of {'case', 'size', 'rows', 'cols', 'seconds', 'peak_rss_mb', 'children_peak_rss_mb'}, the
+             fastest of `repeat` runs for each.
+    """
+    from benchmarks import synthetic
+    results = []
+
+    for size in sizes:
+        rows, cols = SIZES[size]
+        workdir = keep and os.path.join(keep, size) or tempfile.mkdtemp(prefix=f'emit_bench_{size}_')
+        folder = os.path.join(workdir, 'data', FOLDER)
+        print(f'\n --- {size}: {rows} x {cols} x 285 --- ')
+        synthetic.make_pair(folder, rows, cols)
+        # The report reads its assets relative to the working directory
+        for asset in ['Logo.png']:
+            if not os.path.exists(os.path.join(workdir, asset)):
+                shutil.copyfile(os.path.join(ROOT, asset), os.path.join(workdir, asset))
+
+        try:
+            for case in cases:
+                runs = []
+                for _ in range(repeat):
+                    # e.g. create_pdf consumes (and deletes) the analysis images: prepare them before every run
+                    if case in PREPARE:
+                        run_case(PREPARE[case], size, workdir, options, verbose)
+                    runs.append(run_case(case, size, workdir, options, verbose))
+
+                runs = [r for r in runs if r]
+                if not runs:
+                    continue
+                best = min(runs, key=lambda r: r['seconds'])
+                results.append({'case': case, 'size': size, 'rows': rows, 'cols': cols, **best})
+                print(f"{case:<14} {best['seconds']:9.2f} s {best['peak_rss_mb']:9.0f} MB {best['children_peak_rss_mb']:9.0f} MB (children)")
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    This function compares results against a baseline run.
+
+    Returns:
+    regressions: a list of (case, size, metric, baseline value, current value).
+    """
+    base = {(r['case'], r['size']): r for r in baseline['results']}
+    regressions = []
+
+    print('\n --- Against baseline --- ')
+    for r in results:
+        b = base.get((r['case'], r['size']))
+        if b is None:
+            print(f"{r['case']:<14} {r['size']:<7} (not in baseline)")
+            continue
+        line = f"{r['case']:<14} {r['size']:<7}"
+        for metric in ('seconds', 'peak_rss_mb'):
+            change = r[metric] / b[metric] - 1 if b[metric] else 0.0
+            line += f'  {metric} {change:+7.1%}'
+            if change > tolerance:
+                regressions.append((r['case'], r['size'], metric, b[metric], r[metric]))
+                line += ' REGRESSION'
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the EMIT processing pipeline')
+    parser.add_argument('--cases', type=str, default=','.join(CASES), help='Comma separated cases')
+    parser.add_argument('--sizes', type=str, default='small,medium', help=f'Comma separated sizes {list(SIZES)}')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the fastest is kept')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (analysis, mineral_data)')
+    parser.add_argument('--dpi', type=int, default=None, help='Output DPI of the rendered images')
+    parser.add_argument('--fast', action='store_true', help='Fast rasters instead of Matplotlib figures')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare against this JSON results file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed growth over the baseline (0.2 = 20%%)')
+    parser.add_argument('--keep', type=str, default=None, help='Keep the synthetic granules and outputs here')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of every case')
+    # Internal: run one case in this process
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--cols', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--options', type=str, default='{}', help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.rows, args.cols, json.loads(args.options), args.result)
+        return
+
+    cases = [c for c in args.cases.split(',') if c]
+    sizes = [s for s in args.sizes.split(',') if s]
+    unknown = [c for c in cases if c not in CASES] + [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f'unknown cases/sizes: {unknown}')
+
+    options = {'workers': args.workers, 'dpi': args.dpi, 'fast': args.fast}
+    results = run_suite(cases, sizes, options, args.repeat, args.keep, args.verbose)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.platform(), 'cpus': os.cpu_count(), 'options': options, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'\nResults written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) over {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Synthetic EMIT granules, written with the real group layout so the pipeline runs on them offline:
+
+    L2A RFL  root 'reflectance' (downtrack, crosstrack, bands), 'location' (glt_x, glt_y, lat, lon, elev) and
+             'sensor_band_parameters' (wavelengths, fwhm, good_wavelengths).
+    L2B MIN  root 'group_{1,2}_band_depth' / 'group_{1,2}_mineral_id', 'location' and 'mineral_metadata' (name).
+
+The GLT maps the raw scene onto a sheared ortho grid (rows drift east as in a real EMIT swath), so orthorectification
+does real work, and reflectance is a smooth per-pixel spectrum with absorption features so every index is defined.
+
+Usage (from the repository root):
+    python -m benchmarks.synthetic --rows 1280 --cols 1242 --out ./data/synthetic
+"""
+
+# Packages used
+import os
+import argparse
+import numpy as np
+import netCDF4 as nc
+
+FILL = -9999
+PIXEL = 0.000542          # ~60 m, as EMIT
+ORIGIN = (-69.2, -22.9)   # upper left (lon, lat) of the ortho grid
+SHEAR = 8                 # raw rows per ortho column of eastward drift
+MINERALS = ['Hematite', 'Goethite', 'Jarosite', 'Kaolinite', 'Alunite', 'Muscovite', 'Montmorillonite', 'Calcite',
+            'Dolomite', 'Chlorite', 'Epidote', 'Gypsum']
+
+
+def granule_name(product, index=0):
+    """
+    This function returns an EMIT-like file name, so the product detection in emit_xarray works.
+    """
+    return f'EMIT_{product}_001_20230601T150000_2315210_{index:03d}.nc'
+
+
+def _glt(rows, cols):
+    # Raw pixel (r, c) lands on ortho cell (r + 5, c + r // SHEAR + 5)
+    r, c = np.indices((rows, cols))
+    o_r, o_c = r + 5, c + r // SHEAR + 5
+    oy, ox = rows + 10, cols + rows // SHEAR + 10
+    glt_x = np.zeros((oy, ox), dtype=np.int32)
+    glt_y = np.zeros((oy, ox), dtype=np.int32)
+    glt_x[o_r, o_c] = c + 1
+    glt_y[o_r, o_c] = r + 1
+    lon = ORIGIN[0] + PIXEL * (o_c + 0.5)
+    lat = ORIGIN[1] - PIXEL * (o_r + 0.5)
+    return glt_x, glt_y, lat, lon
+
+
+def _common(ds, rows, cols, rng):
+    glt_x, glt_y, lat, lon = _glt(rows, cols)
+    ds.createDimension('downtrack', rows)
+    ds.createDimension('crosstrack', cols)
+    ds.createDimension('ortho_y', glt_x.shape[0])
+    ds.createDimension('ortho_x', glt_x.shape[1])
+    ds.geotransform = np.array([ORIGIN[0], PIXEL, 0.0, ORIGIN[1], 0.0, -PIXEL])
+    ds.spatial_ref = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'
+    ds.summary = 'Synthetic EMIT granule for offline benchmarks'
+
+    loc = ds.createGroup('location')
+    for name, data in [('glt_x', glt_x), ('glt_y', glt_y)]:
+        loc.createVariable(name, 'i4', ('ortho_y', 'ortho_x'), zlib=True)[:] = data
+    for name, data in [('lat', lat), ('lon', lon), ('elev', rng.uniform(2000, 4500, (rows, cols)))]:
+        loc.createVariable(name, 'f8', ('downtrack', 'crosstrack'), zlib=True)[:] = data
+
+
+def make_l2a(path, rows=1280, cols=1242, nbands=285, seed=0, rows_per_block=64):
+    """
+    This function writes a synthetic EMIT L2A reflectance granule, a block of rows at a time.
+    """
+    rng = np.random.default_rng(seed)
+    wavelengths = np.linspace(381.0, 2493.0, nbands).astype(np.float32)
+
+    with nc.Dataset(path, 'w') as ds:
+        _common(ds, rows, cols, rng)
+        ds.createDimension('bands', nbands)
+
+        # Chunked like the distributed files: blocks of rows with every band
+        rfl = ds.createVariable('reflectance', 'f4', ('downtrack', 'crosstrack', 'bands'), fill_value=FILL,
+                                chunksizes=(min(rows, 64), min(cols, 64), nbands))
+
+        # Smooth spectra: a linear continuum plus iron (900 nm) and clay (2200 nm) absorptions of random depth
+        w = (wavelengths - 381.0) / 2112.0
+        iron = np.exp(-((wavelengths - 900.0) / 120.0) ** 2)
+        clay = np.exp(-((wavelengths - 2200.0) / 30.0) ** 2)
+        red_edge = 1 / (1 + np.exp(-(wavelengths - 720.0) / 15.0))
+        for r0 in range(0, rows, rows_per_block):
+            n = min(rows_per_block, rows - r0)
+            shape = (n, cols, 1)
+            block = (rng.uniform(0.05, 0.25, shape) + rng.uniform(0.0, 0.2, shape) * w
+                     - rng.uniform(0.0, 0.05, shape) * iron - rng.uniform(0.0, 0.08, shape) * clay
+                     + rng.uniform(0.0, 0.3, shape) * red_edge).astype(np.float32)
+            block += rng.normal(0, 0.002, block.shape).astype(np.float32)
+            if r0 == 0:
+                block[0, :8] = FILL
+            rfl[r0:r0 + n] = block
+
+        sbp = ds.createGroup('sensor_band_parameters')
+        sbp.createVariable('wavelengths', 'f4', ('bands',))[:] = wavelengths
+        sbp.createVariable('fwhm', 'f4', ('bands',))[:] = np.full(nbands, 8.5, np.float32)
+        good = np.ones(nbands, np.float32)
+        good[(wavelengths > 1340) & (wavelengths < 1450) | (wavelengths > 1800) & (wavelengths < 1980)] = 0
+        sbp.createVariable('good_wavelengths', 'f4', ('bands',))[:] = good
+    return path
+
+
+def make_l2b(path, rows=1280, cols=1242, seed=0):
+    """
+    This function writes a synthetic EMIT L2B mineral granule (band depth and mineral ID of both groups).
+    """
+    rng = np.random.default_rng(seed + 1)
+
+    with nc.Dataset(path, 'w') as ds:
+        _common(ds, rows, cols, rng)
+        ds.createDimension('minerals', len(MINERALS))
+
+        for group in (1, 2):
+            ids = rng.integers(0, len(MINERALS), (rows, cols)).astype(np.float32)
+            depth = rng.uniform(0.0, 0.3, (rows, cols)).astype(np.float32)
+            empty = rng.random((rows, cols)) < 0.3
+            ids[empty], depth[empty] = 0, 0
+            ids[0, :8], depth[0, :8] = FILL, FILL
+            ds.createVariable(f'group_{group}_band_depth', 'f4', ('downtrack', 'crosstrack'), fill_value=FILL, zlib=True)[:] = depth
+            ds.createVariable(f'group_{group}_mineral_id', 'f4', ('downtrack', 'crosstrack'), fill_value=FILL, zlib=True)[:] = ids
+
+        meta = ds.createGroup('mineral_metadata')
+        names = meta.createVariable('name', str, ('minerals',))
+        for i, name in enumerate(MINERALS):
+            names[i] = name
+        meta.createVariable('group', 'i4', ('minerals',))[:] = np.arange(len(MINERALS)) % 2 + 1
+    return path
+
+
+def make_pair(folder, rows=1280, cols=1242, nbands=285, seed=0):
+    """
+    This function writes a matching L2A/L2B pair into `folder` and returns their paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    l2a = make_l2a(os.path.join(folder, granule_name('L2A_RFL')), rows, cols, nbands, seed)
+    l2b = make_l2b(os.path.join(folder, granule_name('L2B_MIN')), rows, cols, seed)
+    return l2a, l2b
+
+
+def bbox(rows, cols):
+    """
+    This function returns a bbox (lon_min, lat_min, lon_max, lat_max, as strings) inside the synthetic scene.
+    """
+    lon0, lat0 = ORIGIN[0] + PIXEL * (5 + cols // 4), ORIGIN[1] - PIXEL * (5 + 3 * rows // 4)
+    lon1, lat1 = ORIGIN[0] + PIXEL * (5 + 3 * cols // 4), ORIGIN[1] - PIXEL * (5 + rows // 4)
+    return tuple(str(round(x, 6)) for x in (lon0, lat0, lon1, lat1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic EMIT L2A/L2B granule pair')
+    parser.add_argument('--rows', type=int, default=1280, help='Downtrack lines')
+    parser.add_argument('--cols', type=int, default=1242, help='Crosstrack samples')
+    parser.add_argument('--bands', type=int, default=285, help='Spectral bands')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--out', type=str, default='./data/synthetic', help='Output folder')
+    args = parser.parse_args()
+
+    for path in make_pair(args.out, args.rows, args.cols, args.bands, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
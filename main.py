@@ -1,21 +1,111 @@
 import os
 import service
+from modules import tracing
 import netCDF4 as nc
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 warnings.filterwarnings("ignore")
 
 
 
+def print_timings(timings):
+    print('\n --- Stage timings --- ')
+    for name, seconds in timings.items():
+        print(f'{name:<16} {seconds:8.2f} s')
+
+
+def run(user, password, date, bx, workers=None, dpi=None, fast=False, job_id=None, keep_images=False):
+
+    # Spans of every stage, written as JSON lines to ./data/traces/<job_id>.jsonl
+    trace = tracing.Trace(job_id, bbox=list(bx), date=list(date))
+    timings = trace.timings
+    result = {'folder': None, 'report': None, 'error': None, 'timings': timings, 'trace': trace.path}
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    done = False
+
+    with trace.activate(), trace.span('total'):
+
+        # Search and download both products at once; the L2B download keeps going while L2A is analysed
+        l2a = pool.submit(trace.traced, 'download L2A', service.download_data_EMIT, user, password, bx, date, 'EMITL2ARFL')
+        l2b = pool.submit(trace.traced, 'download L2B', service.download_data_EMIT, user, password, bx, date, 'EMITL2BMIN')
+
+        try:
+            folder_name, name_image, date_image = l2a.result()
+
+            nc_file = os.path.join('./data/'+folder_name, name_image)
+            result['folder'] = './data/'+folder_name
+            result['report'] = os.path.join('./data/'+folder_name, name_image.replace('.nc','.pdf'))
+
+            # Rendered images go to the report in memory; written to the folder only with keep_images
+            with tracing.span('analysis', granule=name_image):
+                products = service.analysis(nc_file, './data/'+folder_name, workers=workers, dpi=dpi, fast=fast, persist=keep_images)
+
+            with tracing.span('report', granule=name_image):
+                service.create_pdf(products['rgb'],
+                                    products['ndvi'],
+                                    products['iron_oxide'],
+                                    products['alunite'],
+                                    products['FEOOH'],
+                                    products['AAI'],
+                                    products['AIS'],
+                                    products['DOS'],
+                                    name_image,
+                                    folder_name,
+                                    bx,
+                                    date_image)
+
+            _, name_image, date_image  = l2b.result()
+
+            nc_file = os.path.join('./data/'+folder_name, name_image)
+
+            name_img_mineral = os.path.basename(nc_file)
+            name_img_mineral = (name_img_mineral[:-3])
+
+            with tracing.span('minerals', granule=name_image):
+                ds = nc.Dataset(nc_file)
+
+                group_1_band_depth = ds.variables['group_1_band_depth'][:]
+                group_1_mineral_id = ds.variables['group_1_mineral_id'][:]
+                group_2_band_depth = ds.variables['group_2_band_depth'][:]
+                group_2_mineral_id = ds.variables['group_2_mineral_id'][:]
+
+                service.mineral_data(group_1_band_depth, group_1_mineral_id, group_2_band_depth, group_2_mineral_id, folder_name, name_img_mineral, workers=workers, dpi=dpi, fast=fast)
+
+            print('\n --- Finished processing --- \n')
+            done = True
+
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+            print("\n --- No data found --- \n")
+
+        finally:
+            # On a failure (e.g. the L2A download) the L2B download is not waited for: cancelled if it has not
+            # started, otherwise left to finish into the granule cache in the background
+            pool.shutdown(wait=done, cancel_futures=True)
+
+    # Every span (stages that run once per product, like search and download, appear twice)
+    result['stages'] = [(span['span'], span['seconds']) for span in trace.spans]
+
+    print_timings(timings)
+
+    return result
+
+
 def main():
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('--u', type=str, required=True, help='')
     parser.add_argument('--p', type=str, required=True, help='')
     parser.add_argument('--d', type=str, required=True, help='')
     parser.add_argument('--bx', type=str, required=True, help='')
-    
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: one per image, up to the number of cores)')
+    parser.add_argument('--dpi', type=int, default=None, help='Output DPI of the rendered images')
+    parser.add_argument('--fast', action='store_true', help='Write plain rasters through a colormap lookup table instead of Matplotlib figures')
+    parser.add_argument('--keep-images', action='store_true', help='Also write the report images (PNG) to the data folder')
+
     args = parser.parse_args()
-    
+
     user = args.u
     password = args.p
     date = args.d
@@ -30,46 +120,8 @@ def main():
     bx = (l1,l2,l3,l4)
 
     print('\nInitializing...\n')
-    
-    try: 
-        folder_name, name_image, date_image  = service.download_data_EMIT(user, password, bx, date, 'EMITL2ARFL')
-
-        nc_file = os.path.join('./data/'+folder_name, name_image)
-        service.analysis(nc_file, './data/'+folder_name)
-
-        service.create_pdf('./data/'+folder_name+'/rgb.png',
-                            './data/'+folder_name+'/ndvi.png',
-                            './data/'+folder_name+'/iron_oxide.png',
-                            './data/'+folder_name+'/alunite.png',
-                            './data/'+folder_name+'/FEOOH.png',
-                            './data/'+folder_name+'/AAI.png',
-                            './data/'+folder_name+'/AIS.png',
-                            './data/'+folder_name+'/DOS.png',
-                            name_image,
-                            folder_name,
-                            bx,
-                            date_image)
-
-        _, name_image, date_image  = service.download_data_EMIT(user,password, bx, date, 'EMITL2BMIN')
-
-        nc_file = os.path.join('./data/'+folder_name, name_image)
-
-        name_img_mineral = os.path.basename(nc_file)
-        name_img_mineral = (name_img_mineral[:-3])
-
-        ds = nc.Dataset(nc_file)
-
-        group_1_band_depth = ds.variables['group_1_band_depth'][:]
-        group_1_mineral_id = ds.variables['group_1_mineral_id'][:]
-        group_2_band_depth = ds.variables['group_2_band_depth'][:]
-        group_2_mineral_id = ds.variables['group_2_mineral_id'][:]
-
-        service.mineral_data(group_1_band_depth, group_1_mineral_id, group_2_band_depth, group_2_mineral_id, folder_name, name_img_mineral)
-
-        print('\n --- Finished processing --- \n')
 
-    except:
-        print("\n --- No data found --- \n")
+    run(user, password, date, bx, workers=args.workers, dpi=args.dpi, fast=args.fast, keep_images=args.keep_images)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,72 @@
+"""
+This Module has the functions related to reading a subset of bands from an EMIT L2A reflectance granule. Instead of
+opening the whole cube and resolving each wavelength again for every index, a band plan collects the unique
+wavelengths needed, resolves them once and reads only those slices in a single batched read. Scenes already exported
+with `emit_tools.write_envi` are read from the ENVI file instead, through a memory map: for BIL and BSQ exports only
+the pages holding the selected bands are read, while BIP exports keep the bands of a pixel together and are read whole.
+"""
+
+# Packages used
+import numpy as np
+from modules import emit_tools, zarr_store
+
+
+def band_plan(wavelengths, targets):
+    """
+    This function resolves a list of target wavelengths to the nearest sensor bands, once.
+
+    Parameters:
+    wavelengths: a 1D array with the center wavelength (nm) of every band in the granule.
+    targets: an iterable of wavelengths (nm) required by the indices.
+
+    Returns:
+    bands: a sorted list of the unique band indices to read from the file.
+    lookup: a dictionary mapping every target wavelength to its position in the band stack.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+
+    resolved = {t: int(np.nanargmin(abs(wavelengths - t))) for t in targets}
+
+    bands = sorted(set(resolved.values()))
+    slot = {b: i for i, b in enumerate(bands)}
+    lookup = {t: slot[b] for t, b in resolved.items()}
+
+    return bands, lookup
+
+
+def read_bands(filepath, targets, variable='reflectance', band_mask=None):
+    """
+    This function reads only the bands closest to the target wavelengths from an EMIT netCDF file.
+
+    Parameters:
+    filepath: a filepath to an EMIT L2A netCDF file, or to its ENVI export (emit_tools.write_envi, .img/.hdr), which
+    is read through a read-only memory map (only the pages holding the selected bands for BIL/BSQ, every page for BIP).
+    targets: an iterable of wavelengths (nm) required by the indices.
+    variable: the root variable to read, 'reflectance' by default (netCDF input only).
+    band_mask: optional band mask from `emit_tools.band_mask` (packed or unpacked); masked pixels are set to NaN,
+    one band at a time.
+
+    Returns:
+    stack: a numpy array (downtrack, crosstrack, n) holding only the requested bands.
+    lookup: a dictionary mapping every target wavelength to its position in the band stack.
+    """
+    if emit_tools.is_envi(filepath):
+        mm, metadata = emit_tools.open_envi(filepath)
+        bands, lookup = band_plan(np.array(metadata['wavelength'], dtype=float), targets)
+        stack = np.array(mm[:, :, bands], dtype=np.float32)
+    else:
+        wvl = zarr_store.open_dataset(filepath, group='sensor_band_parameters')
+        bands, lookup = band_plan(wvl['wavelengths'].values, targets)
+        wvl.close()
+
+        # Lazy open (band-major Zarr store when there is one), then a single orthogonal read of the selected bands
+        ds = zarr_store.open_dataset(filepath)
+        stack = ds[variable].isel(bands=bands).values
+        ds.close()
+
+    if band_mask is not None:
+        for i, b in enumerate(bands):
+            masked = band_mask.band(b) if hasattr(band_mask, 'band') else band_mask[:, :, b] == 1
+            stack[:, :, i][masked] = np.nan
+
+    return stack, lookup
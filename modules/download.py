@@ -0,0 +1,221 @@
+"""
+This Module has the functions related to downloading EMIT granules in-process. Files are fetched as byte ranges in
+parallel over a pooled HTTP session, partially downloaded files are resumed, and the size/checksum is verified
+before the file is handed to the analysis.
+
+While downloading, data is written to '<dest>.part' and the finished ranges are recorded in '<dest>.part.json',
+so an interrupted download only fetches the missing ranges when it is started again.
+"""
+
+# Packages used
+import os
+import json
+import hashlib
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CHUNK_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+class EarthdataSession(requests.Session):
+    """
+    A requests session that sends the Earthdata credentials only to the Earthdata login (URS) host: Basic auth is
+    added to the requests and redirects addressed to that host, so the credentials never reach the data or S3
+    endpoints. Every other redirect is handled by requests (headers dropped on a host change, .netrc).
+    """
+    AUTH_HOST = 'urs.earthdata.nasa.gov'
+
+    def __init__(self, user=None, password=None):
+        super().__init__()
+        self.credentials = (user, password) if user else None
+
+    def _login_auth(self, prepared_request):
+        if self.credentials and urlparse(prepared_request.url).hostname == self.AUTH_HOST:
+            prepared_request.prepare_auth(self.credentials)
+
+    def prepare_request(self, request):
+        prepared = super().prepare_request(request)
+        self._login_auth(prepared)
+        return prepared
+
+    def rebuild_auth(self, prepared_request, response):
+        super().rebuild_auth(prepared_request, response)
+        self._login_auth(prepared_request)
+
+
+def session(user=None, password=None, pool_size=8, retries=5):
+    """
+    This function builds a pooled HTTP session for the download engine.
+
+    Parameters:
+    user, password: Earthdata credentials, None for servers that do not need them.
+    pool_size: number of pooled connections per host, at least the number of parallel ranges.
+    retries: retries with backoff for connection errors and 5xx responses.
+
+    Returns:
+    sess: an EarthdataSession.
+    """
+    sess = EarthdataSession(user, password)
+
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    sess.mount('https://', adapter)
+    sess.mount('http://', adapter)
+    return sess
+
+
+def probe(sess, url):
+    """
+    This function asks the server for the size of a file and whether it serves byte ranges. It also completes the
+    login redirect once, so the parallel range requests reuse the session cookies.
+
+    Returns:
+    size: the file size in bytes, None if unknown.
+    ranged: True if the server answers range requests.
+    """
+    with sess.get(url, headers={'Range': 'bytes=0-0'}, stream=True, allow_redirects=True) as resp:
+        resp.raise_for_status()
+        if resp.status_code == 206 and '/' in resp.headers.get('Content-Range', ''):
+            return int(resp.headers['Content-Range'].rsplit('/', 1)[1]), True
+        length = resp.headers.get('Content-Length')
+        return (int(length) if length else None), False
+
+
+def file_checksum(path, algorithm='sha512'):
+    """
+    This function computes the hex digest of a file, reading it in blocks.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(8 * BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_name(algorithm):
+    """
+    This function maps a UMM checksum algorithm name ('SHA-512', 'MD5', ...) to a hashlib name.
+    """
+    return algorithm.lower().replace('-', '')
+
+
+def verify(path, size=None, checksum=None, algorithm='sha512'):
+    """
+    This function checks a downloaded file against its expected size and checksum, when they are known.
+    """
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    if checksum and file_checksum(path, hash_name(algorithm)) != checksum.lower():
+        return False
+    return True
+
+
+def _load_state(state_file, part, size):
+    # Ranges already on disk from an interrupted download of the same file
+    if os.path.isfile(state_file) and os.path.isfile(part):
+        with open(state_file) as f:
+            state = json.load(f)
+        if state.get('size') == size and os.path.getsize(part) == size:
+            return set(state['done'])
+    return set()
+
+
+def _save_state(state_file, size, done):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'size': size, 'done': sorted(done)}, f)
+    os.replace(tmp, state_file)
+
+
+def _fetch_range(sess, url, part, start, end):
+    with sess.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True) as resp:
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise IOError(f'Server ignored the range request {start}-{end}')
+        written = 0
+        with open(part, 'r+b') as f:
+            f.seek(start)
+            for block in resp.iter_content(BLOCK_SIZE):
+                f.write(block)
+                written += len(block)
+    if written != end - start + 1:
+        raise IOError(f'Incomplete range {start}-{end}: {written} bytes')
+    return written
+
+
+def _fetch_stream(sess, url, part):
+    written = 0
+    with sess.get(url, stream=True) as resp:
+        resp.raise_for_status()
+        with open(part, 'wb') as f:
+            for block in resp.iter_content(BLOCK_SIZE):
+                f.write(block)
+                written += len(block)
+    return written
+
+
+def download(url, dest, sess=None, parts=8, chunk_size=CHUNK_SIZE, size=None, checksum=None, algorithm='sha512'):
+    """
+    This function downloads a file as parallel byte ranges, resuming a previous partial download.
+
+    Parameters:
+    url: the file URL.
+    dest: the output file path.
+    sess: a session from `session`, an anonymous one is created when None.
+    parts: number of ranges fetched in parallel.
+    chunk_size: size of each range in bytes.
+    size: expected size in bytes (e.g. UMM SizeInBytes), checked before the file is released.
+    checksum: expected hex digest (e.g. UMM Checksum Value), checked before the file is released.
+    algorithm: checksum algorithm, hashlib or UMM name ('SHA-512', 'MD5', ...).
+
+    Returns:
+    fetched: the number of bytes transferred, 0 if `dest` was already complete.
+    """
+    if os.path.isfile(dest) and verify(dest, size, checksum, algorithm):
+        return 0
+
+    sess = sess or session(pool_size=parts)
+    part, state_file = dest + '.part', dest + '.part.json'
+
+    remote_size, ranged = probe(sess, url)
+    if size is not None and remote_size is not None and size != remote_size:
+        raise IOError(f'Size mismatch for {url}: expected {size}, server reports {remote_size}')
+    size = size if size is not None else remote_size
+
+    if ranged and size:
+        done = _load_state(state_file, part, size)
+        if not done:
+            with open(part, 'wb') as f:
+                f.truncate(size)
+
+        pending = [s for s in range(0, size, chunk_size) if s not in done]
+        lock = threading.Lock()
+
+        def fetch(start):
+            n = _fetch_range(sess, url, part, start, min(start + chunk_size, size) - 1)
+            with lock:
+                done.add(start)
+                _save_state(state_file, size, done)
+            return n
+
+        with ThreadPoolExecutor(max_workers=parts) as pool:
+            fetched = sum(pool.map(fetch, pending))
+    else:
+        fetched = _fetch_stream(sess, url, part)
+
+    if not verify(part, size, checksum, algorithm):
+        for f in (part, state_file):
+            if os.path.isfile(f):
+                os.remove(f)
+        raise IOError(f'Downloaded file failed size/checksum verification: {url}')
+
+    os.replace(part, dest)
+    if os.path.isfile(state_file):
+        os.remove(state_file)
+
+    return fetched
@@ -26,21 +26,29 @@ import xarray as xr
 import rasterio as rio
 import s3fs
 from fsspec.implementations.http import HTTPFile
+from concurrent.futures import ThreadPoolExecutor
+from modules import granule_cache, zarr_store
 
-def emit_xarray(filepath, ortho=False, qmask=None, unpacked_bmask=None): 
+def emit_xarray(filepath, ortho=False, qmask=None, unpacked_bmask=None, bbox=None, lazy=False): 
     """
         This function utilizes other functions in this module to streamline opening an EMIT dataset as an xarray.Dataset.
         
         Parameters:
         filepath: a filepath to an EMIT netCDF file
         ortho: True or False, whether to orthorectify the dataset or leave in crosstrack/downtrack coordinates.
+        bbox: optional (lon_min, lat_min, lon_max, lat_max). With ortho=True only this window is read and orthorectified (see `ortho_window`).
         qmask: a numpy array output from the quality_mask function used to mask pixels based on quality flags selected in that function. Any non-orthorectified array with the proper crosstrack and downtrack dimensions can also be used.
-        unpacked_bmask: a numpy array from  the band_mask function that can be used to mask band-specific pixels that have been interpolated.
+        unpacked_bmask: a numpy array (or PackedBandMask) from  the band_mask function that can be used to mask band-specific pixels that have been interpolated.
+        lazy: with ortho=False, leave the variables unread and unmasked; pass qmask/unpacked_bmask to write_envi instead, which applies them (and the fill value) per row block.
                         
         Returns:
         out_xr: an xarray.Dataset constructed based on the parameters provided.
 
         """
+    # Windowed mode: read and orthorectify only the requested area
+    if ortho is True and bbox is not None:
+        return ortho_window(filepath, bbox, qmask=qmask, unpacked_bmask=unpacked_bmask)
+
     # Grab granule filename to check product
     
     if type(filepath) == s3fs.core.S3File:
@@ -50,23 +58,17 @@ def emit_xarray(filepath, ortho=False, qmask=None, unpacked_bmask=None):
     else:
         granule_id = os.path.splitext(os.path.basename(filepath))[0]    
                  
-    # Read in Data as Xarray Datasets  
-    engine, wvl_group = 'netcdf4', None
-    
-    ds = xr.open_dataset(filepath,engine = 'netcdf4')
-    loc = xr.open_dataset(filepath, engine = engine, group='location')  
+    # Read in Data as Xarray Datasets (from the granule's Zarr store when there is one)
+    ds = zarr_store.open_dataset(filepath)
+    loc = zarr_store.open_dataset(filepath, group='location')  
                  
     # Check if mineral dataset and read in groups (only ds/loc for minunc)
-    
-    if 'L2B_MIN_' in granule_id:
-        wvl_group = 'mineral_metadata'
-    elif 'L2B_MINUNC' not in granule_id:
-        wvl_group = 'sensor_band_parameters'
+    wvl_group, band = product_bands(granule_id)
     
     wvl = None
     
     if wvl_group:
-        wvl = xr.open_dataset(filepath, engine = engine, group=wvl_group) 
+        wvl = zarr_store.open_dataset(filepath, group=wvl_group) 
     
     # Building Flat Dataset from Components
     data_vars = {**ds.variables} 
@@ -78,35 +80,19 @@ def emit_xarray(filepath, ortho=False, qmask=None, unpacked_bmask=None):
         **loc.variables
     }
     
-    product_band_map = {
-        'L2B_MIN_': 'name', 'L2A_MASK_': 'mask_bands',
-        'L1B_OBS_': 'observation_bands', 'L2A_RFL_':'wavelengths', 
-        'L1B_RAD_':'wavelengths','L2A_RFLUNCERT_':'wavelengths'
-    }
-
-   # if band := product_band_map.get(next((k for k in product_band_map.keys() if k in granule_id), 'unknown'), None):
-        #coords['bands'] = wvl[band].data
-    
     if wvl:
-        coords = {**coords, **wvl.variables}
+        coords = {**coords, **wvl.load().variables}
+        wvl.close()
         
     out_xr = xr.Dataset(data_vars=data_vars, coords = coords, attrs= ds.attrs)
     out_xr.attrs['granule_id'] = granule_id
     
-    if band := product_band_map.get(next((k for k in product_band_map.keys() if k in granule_id), 'unknown'), None):
-        if 'minerals' in list(out_xr.dims):
-            out_xr = out_xr.swap_dims({'minerals':band})
-            out_xr = out_xr.rename({band: 'mineral_name'})
-        else:
-            out_xr = out_xr.swap_dims({'bands':band})
+    out_xr = index_bands(out_xr, band)
     
-    # Apply Quality and Band Masks, set fill values to NaN
-    for var in list(ds.data_vars):
-        if qmask is not None:
-            out_xr[var].data[qmask == 1] = np.nan
-        if unpacked_bmask is not None:
-            out_xr[var].data[unpacked_bmask == 1] = np.nan               
-        out_xr[var].data[out_xr[var].data == -9999] = np.nan
+    # Apply Quality and Band Masks, set fill values to NaN (one chunked pass per variable, in place)
+    if not lazy or ortho is True:
+        for var in list(ds.data_vars):
+            apply_masks(out_xr[var].data, qmask, unpacked_bmask)
 
     if ortho is True:
        out_xr = ortho_xr(out_xr)
@@ -114,6 +100,81 @@ def emit_xarray(filepath, ortho=False, qmask=None, unpacked_bmask=None):
               
     return out_xr
 
+# Coordinate indexing the band dimension of each product
+PRODUCT_BAND_MAP = {
+    'L2B_MIN_': 'name', 'L2A_MASK_': 'mask_bands',
+    'L1B_OBS_': 'observation_bands', 'L2A_RFL_':'wavelengths', 
+    'L1B_RAD_':'wavelengths','L2A_RFLUNCERT_':'wavelengths'
+}
+
+def product_bands(granule_id):
+    """
+    This function returns where the band coordinates of an EMIT product are and which one indexes its bands.
+
+    Parameters:
+    granule_id: the granule file name, e.g. 'EMIT_L2A_RFL_001_...'
+
+    Returns:
+    wvl_group: the group with the band coordinates ('mineral_metadata', 'sensor_band_parameters'), None for mineral uncertainty
+    band: the coordinate the band dimension is indexed by, None when unknown
+    """
+    wvl_group = None
+    if 'L2B_MIN_' in granule_id:
+        wvl_group = 'mineral_metadata'
+    elif 'L2B_MINUNC' not in granule_id:
+        wvl_group = 'sensor_band_parameters'
+
+    band = PRODUCT_BAND_MAP.get(next((k for k in PRODUCT_BAND_MAP.keys() if k in granule_id), 'unknown'), None)
+    return wvl_group, band
+
+def index_bands(out_xr, band):
+    """
+    This function indexes the band dimension of a dataset by its band coordinate (the wavelengths, or 'mineral_name' for L2B minerals).
+    """
+    if band and band in out_xr.variables:
+        if 'minerals' in list(out_xr.dims):
+            out_xr = out_xr.swap_dims({'minerals':band})
+            out_xr = out_xr.rename({band: 'mineral_name'})
+        elif 'bands' in list(out_xr.dims):
+            out_xr = out_xr.swap_dims({'bands':band})
+    return out_xr
+
+def _mask_rows(data, r0, r1, qmask, bmask, fill_value):
+    # Combined fill/quality/band mask for a block of rows, only block-sized temporaries
+    chunk = data[r0:r1]
+    masked = chunk == fill_value
+    if qmask is not None:
+        q = qmask[r0:r1] == 1
+        masked |= q.reshape(q.shape + (1,) * (chunk.ndim - q.ndim))
+    if bmask is not None and chunk.ndim == 3:
+        bm = bmask[r0:r1]
+        masked |= (bm.unpack() if isinstance(bm, PackedBandMask) else bm) == 1
+    chunk[masked] = np.nan
+
+def apply_masks(data, qmask=None, unpacked_bmask=None, fill_value=-9999, rows_per_chunk=64, workers=None):
+    """
+    This function sets fill values, and pixels flagged by the quality and band masks, to NaN in one pass over the
+    data, in place. Rows are processed in chunks across threads, so peak memory stays near one copy of the cube.
+
+    Parameters:
+    data: a numpy array (downtrack, crosstrack[, bands]), modified in place. Non float arrays are left untouched.
+    qmask: optional (downtrack, crosstrack) array from `quality_mask`, 1 where masked.
+    unpacked_bmask: optional (downtrack, crosstrack, bands) array or PackedBandMask from `band_mask`, 1 where masked.
+    fill_value: the fill value for EMIT datasets, -9999 by default
+    rows_per_chunk: number of downtrack rows per chunk
+    workers: number of threads, one per core by default
+
+    Returns:
+    data: the same array.
+    """
+    if not np.issubdtype(data.dtype, np.floating):
+        return data
+
+    starts = range(0, data.shape[0], rows_per_chunk)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(lambda r0: _mask_rows(data, r0, min(r0 + rows_per_chunk, data.shape[0]), qmask, unpacked_bmask, fill_value), starts))
+    return data
+
 # Function to Calculate the Lat and Lon Vectors/Coordinate Grid
 def coord_vects(ds):
     """
@@ -143,29 +204,108 @@ def coord_vects(ds):
         lat[y] = y_geo
     return lon,lat
 
+# Compiled GLT gather kernel (numba), numpy fallback when numba is not installed
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _glt_gather(src, dst, rows, cols, bands, out):
+        # One ortho pixel per iteration, spread across cores
+        for i in prange(dst.shape[0]):
+            d = dst[i]
+            r = rows[i]
+            c = cols[i]
+            for k in range(bands.shape[0]):
+                out[d, k] = src[r, c, bands[k]]
+else:
+    def _glt_gather(src, dst, rows, cols, bands, out, block=65536):
+        # Blocked so the fancy-indexing temporaries stay small
+        for s in range(0, dst.shape[0], block):
+            sl = slice(s, s + block)
+            out[dst[sl]] = src[rows[sl], cols[sl]][:, bands]
+
+# Function to precompute the GLT valid-pixel index
+def glt_index(glt_array, GLT_NODATA_VALUE=0):
+    """
+    This function precomputes, once per granule, the flat index of the valid orthorectified pixels and the raw
+    pixel each of them comes from. It does not modify `glt_array`.
+
+    Parameters:
+    glt_array: a GLT array (ortho_y, ortho_x, 2) with glt_x and glt_y, as built by `ortho_xr`.
+    GLT_NODATA_VALUE: no data value for the GLT tables, 0 by default
+
+    Returns:
+    index: a dictionary with the ortho grid 'shape', the flat ortho pixel indices 'dst', the 0-based raw
+           'rows' (downtrack) and 'cols' (crosstrack) they are read from, and their range 'extent'.
+    """
+    valid = np.all(glt_array != GLT_NODATA_VALUE, axis=-1)
+    dst = np.flatnonzero(valid)
+    flat = glt_array.reshape(-1, glt_array.shape[-1])
+
+    # Adjust for One based Index
+    rows = (flat[dst, 1] - 1).astype(np.int64)
+    cols = (flat[dst, 0] - 1).astype(np.int64)
+    return {
+        'shape': glt_array.shape[:2],
+        'dst': dst,
+        'rows': rows,
+        'cols': cols,
+        # Raw pixel range referenced, checked against the source before the (unchecked) gather
+        'extent': (int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max())) if len(dst) else None,
+    }
+
+def _check_glt(index, shape, bands):
+    # The compiled gather does no bounds checking: an out-of-range GLT entry must fail here, not read past the array
+    if 'extent' in index:
+        extent = index['extent']
+    else:
+        rows, cols = index['rows'], index['cols']
+        extent = (int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max())) if len(rows) else None
+    if extent is not None:
+        r0, r1, c0, c1 = extent
+        if r0 < 0 or c0 < 0 or r1 >= shape[0] or c1 >= shape[1]:
+            raise IndexError(f'GLT references raw pixels rows {r0}-{r1}, columns {c0}-{c1} outside the {shape[0]} x {shape[1]} source array')
+    if len(bands) and (bands.min() < 0 or bands.max() >= shape[2]):
+        raise IndexError(f'Band indices {bands.min()}-{bands.max()} outside the {shape[2]} bands of the source array')
+
 # Function to Apply the GLT to an array
-def apply_glt(ds_array,glt_array,fill_value=-9999,GLT_NODATA_VALUE=0):
+def apply_glt(ds_array,glt_array,fill_value=-9999,GLT_NODATA_VALUE=0,bands=None,out=None,index=None):
     """
     This function applies the GLT array to a numpy array of either 2 or 3 dimensions.
     
     Parameters:
     ds_array: numpy array of the desired variable
-    glt_array: a GLT array constructed from EMIT GLT data
+    glt_array: a GLT array constructed from EMIT GLT data, not modified. May be None when `index` is given.
+    fill_value: value for ortho pixels without data
+    bands: optional list of band indices to orthorectify, all bands by default
+    out: optional preallocated float32 array (ortho_y, ortho_x, nbands) to write into
+    index: optional output of `glt_index`, to avoid recomputing it for every variable of a granule
     
     Returns: 
     out_ds: a numpy array of orthorectified data.
     """
+    if index is None:
+        index = glt_index(glt_array, GLT_NODATA_VALUE)
 
     # Build Output Dataset
     if ds_array.ndim == 2:
         ds_array = ds_array[:,:,np.newaxis]
-    out_ds = np.full((glt_array.shape[0], glt_array.shape[1], ds_array.shape[-1]), fill_value, dtype=np.float32)
-    valid_glt = np.all(glt_array != GLT_NODATA_VALUE, axis=-1)
-    
-    # Adjust for One based Index
-    glt_array[valid_glt] -= 1 
-    out_ds[valid_glt, :] = ds_array[glt_array[valid_glt, 1], glt_array[valid_glt, 0], :]
-    return out_ds
+    bands = np.arange(ds_array.shape[-1]) if bands is None else np.asarray(bands, dtype=np.int64)
+    if out is None:
+        out = np.empty((index['shape'][0], index['shape'][1], len(bands)), dtype=np.float32)
+
+    # The gather writes through a flat view: a non-contiguous `out` (e.g. a slice) is filled from a temporary
+    target = out if out.flags.c_contiguous else np.empty(out.shape, dtype=out.dtype)
+    target.fill(fill_value)
+
+    _check_glt(index, ds_array.shape, bands)
+    _glt_gather(ds_array, index['dst'], index['rows'], index['cols'], bands, target.reshape(-1, len(bands)))
+    if target is not out:
+        out[...] = target
+    return out
 
 def ortho_xr(ds, GLT_NODATA_VALUE=0, fill_value = -9999):
     """
@@ -184,6 +324,8 @@ def ortho_xr(ds, GLT_NODATA_VALUE=0, fill_value = -9999):
 
     glt_ds = np.nan_to_num(np.stack([ds['glt_x'].data,ds['glt_y'].data],axis=-1),nan=GLT_NODATA_VALUE).astype(int)  
     
+    # Valid-pixel index, computed once and shared by every variable and the elevation
+    index = glt_index(glt_ds, GLT_NODATA_VALUE)
 
     # List Variables
     var_list = list(ds.data_vars)
@@ -200,7 +342,7 @@ def ortho_xr(ds, GLT_NODATA_VALUE=0, fill_value = -9999):
         raw_ds = ds[var].data
         var_dims = ds[var].dims
         # Apply GLT to dataset
-        out_ds = apply_glt(raw_ds,glt_ds, GLT_NODATA_VALUE=GLT_NODATA_VALUE)
+        out_ds = apply_glt(raw_ds,glt_ds, GLT_NODATA_VALUE=GLT_NODATA_VALUE, index=index)
         
         # Mask fill values
         out_ds[out_ds==fill_value] = np.nan
@@ -218,7 +360,7 @@ def ortho_xr(ds, GLT_NODATA_VALUE=0, fill_value = -9999):
     lon, lat = coord_vects(ds) # Reorder this function to make sense in case of multiple variables
 
     # Apply GLT to elevation
-    elev_ds = apply_glt(ds['elev'].data,glt_ds)
+    elev_ds = apply_glt(ds['elev'].data,glt_ds, index=index)
     elev_ds[elev_ds==fill_value] = np.nan
     
     # Delete glt_ds - no longer needed
@@ -250,16 +392,356 @@ def ortho_xr(ds, GLT_NODATA_VALUE=0, fill_value = -9999):
     
     return out_xr  
 
-def quality_mask(filepath, quality_bands):
+def raw_window(filepath, bbox, pad=1, GLT_NODATA_VALUE=0):
+    """
+    This function maps a lat/lon bounding box to the GLT sub-grid covering it and to the minimal raw
+    downtrack/crosstrack extent needed to orthorectify it. Only the GLT window is read from the file.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file
+    bbox: (lon_min, lat_min, lon_max, lat_max) in degrees, a single point is allowed
+    pad: extra ortho pixels added around the bbox
+    GLT_NODATA_VALUE: no data value for the GLT tables, 0 by default
+
+    Returns:
+    window: a dictionary with the ortho window 'ortho' (row0, row1, col0, col1), the raw window 'raw'
+            (downtrack0, downtrack1, crosstrack0, crosstrack1) as slice bounds, the window 'geotransform' and the
+            window 'glt' (ortho_y, ortho_x, 2) re-indexed to the raw window (1 based, GLT_NODATA_VALUE outside).
+    """
+    lon_min, lat_min, lon_max, lat_max = (float(x) for x in bbox)
+
+    ds = xr.open_dataset(filepath, engine='netcdf4')
+    loc = xr.open_dataset(filepath, engine='netcdf4', group='location')
+    GT = ds.geotransform
+    oy, ox = loc['glt_x'].shape
+
+    # Ortho rows/cols covering the bbox (latitude decreases with rows)
+    c0 = max(math.floor((lon_min - GT[0]) / GT[1]) - pad, 0)
+    c1 = min(math.floor((lon_max - GT[0]) / GT[1]) + 1 + pad, ox)
+    r0 = max(math.floor((lat_max - GT[3]) / GT[5]) - pad, 0)
+    r1 = min(math.floor((lat_min - GT[3]) / GT[5]) + 1 + pad, oy)
+    if c0 >= c1 or r0 >= r1:
+        raise ValueError(f'Bounding box {bbox} is outside the granule')
+
+    glt_x = np.nan_to_num(loc['glt_x'][r0:r1, c0:c1].values, nan=GLT_NODATA_VALUE).astype(int)
+    glt_y = np.nan_to_num(loc['glt_y'][r0:r1, c0:c1].values, nan=GLT_NODATA_VALUE).astype(int)
+    ds.close()
+    loc.close()
+
+    valid = (glt_x != GLT_NODATA_VALUE) & (glt_y != GLT_NODATA_VALUE)
+    if not valid.any():
+        raise ValueError(f'Bounding box {bbox} has no valid pixels in the granule')
+
+    # Minimal raw extent, -1 on min to account for 1 based index
+    dt0, dt1 = glt_y[valid].min() - 1, glt_y[valid].max()
+    ct0, ct1 = glt_x[valid].min() - 1, glt_x[valid].max()
+
+    # Re-index the GLT to the raw window
+    glt = np.full(glt_x.shape + (2,), GLT_NODATA_VALUE, dtype=int)
+    glt[valid, 0] = glt_x[valid] - ct0
+    glt[valid, 1] = glt_y[valid] - dt0
+
+    gt = np.array(GT, dtype=float)
+    gt[0] = GT[0] + c0 * GT[1]
+    gt[3] = GT[3] + r0 * GT[5]
+
+    return {'ortho': (r0, r1, c0, c1), 'raw': (int(dt0), int(dt1), int(ct0), int(ct1)), 'geotransform': gt, 'glt': glt}
+
+def ortho_window(filepath, bbox, variables=None, bands=None, qmask=None, unpacked_bmask=None, pad=1, GLT_NODATA_VALUE=0, fill_value=-9999):
+    """
+    This function orthorectifies only the part of an EMIT granule covering a lat/lon bounding box. Only the GLT
+    window and the raw rows/columns it references are read, so memory and time scale with the requested area.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file
+    bbox: (lon_min, lat_min, lon_max, lat_max) in degrees, a single point is allowed
+    variables: root variables to orthorectify, all data variables by default
+    bands: optional list of band indices to read for 3 dimensional variables
+    qmask: optional quality mask, either full raw size or already cropped to the raw window
+    unpacked_bmask: optional band mask (unpacked or PackedBandMask), either full raw size or already cropped to the raw window
+    pad: extra ortho pixels added around the bbox
+    GLT_NODATA_VALUE: no data value for the GLT tables, 0 by default
+    fill_value: the fill value for EMIT datasets, -9999 by default
+
+    Returns:
+    out_xr: an orthorectified xarray.Dataset of the window, with latitude/longitude coordinates.
+    """
+    window = raw_window(filepath, bbox, pad, GLT_NODATA_VALUE)
+    dt0, dt1, ct0, ct1 = window['raw']
+    r0, r1, c0, c1 = window['ortho']
+    index = glt_index(window['glt'], GLT_NODATA_VALUE)
+
+    granule_id = os.path.splitext(os.path.basename(filepath))[0]
+    wvl_group, band = product_bands(granule_id)
+
+    ds = zarr_store.open_dataset(filepath, prefer=('tiles', 'bands'))
+    loc = zarr_store.open_dataset(filepath, group='location', prefer=('tiles', 'bands'))
+    wvl = zarr_store.open_dataset(filepath, group=wvl_group, prefer=('tiles', 'bands')) if wvl_group else None
+
+    raw = {'downtrack': slice(dt0, dt1), 'crosstrack': slice(ct0, ct1)}
+    var_list = variables or [v for v in ds.data_vars if v != 'flat_field_update']
+
+    data_vars = {}
+    band_dim = None
+    for var in var_list:
+        sel = dict(raw)
+        if ds[var].ndim == 3:
+            band_dim = ds[var].dims[-1]
+            if bands is not None:
+                sel[band_dim] = list(bands)
+        # Only the raw window is read from the file
+        raw_ds = ds[var].isel(sel).values.astype(np.float32, copy=False)
+
+        qm, bm = qmask, None
+        if qmask is not None and qmask.shape[:2] == ds[var].shape[:2]:
+            qm = qmask[dt0:dt1, ct0:ct1]
+        if unpacked_bmask is not None and raw_ds.ndim == 3:
+            bm = unpacked_bmask[dt0:dt1, ct0:ct1] if unpacked_bmask.shape[:2] == ds[var].shape[:2] else unpacked_bmask
+            if bands is not None:
+                bm = bm[:, :, list(bands)]
+        apply_masks(raw_ds, qm, bm, fill_value)
+
+        out_ds = apply_glt(raw_ds, None, fill_value=np.nan, index=index)
+        if raw_ds.ndim == 2:
+            data_vars[var] = (['latitude','longitude'], out_ds[:, :, 0])
+        else:
+            data_vars[var] = (['latitude','longitude', band_dim], out_ds)
+
+    # Window Lat and Lon Vectors (pixel centers)
+    GT = window['geotransform']
+    lon = (GT[0] + 0.5 * GT[1]) + np.arange(c1 - c0) * GT[1]
+    lat = (GT[3] + 0.5 * GT[5]) + np.arange(r1 - r0) * GT[5]
+
+    elev = apply_glt(loc['elev'].isel(raw).values, None, fill_value=np.nan, index=index)[:, :, 0]
+    coords = {'latitude':(['latitude'],lat), 'longitude':(['longitude'],lon), 'elev':(['latitude','longitude'],elev)}
+
+    if wvl is not None and band_dim is not None:
+        sel = {band_dim: list(bands)} if bands is not None and band_dim in wvl.dims else {}
+        for name, v in wvl.isel(sel).variables.items():
+            coords[name] = ([band_dim], v.values)
+
+    out_xr = xr.Dataset(data_vars=data_vars, coords=coords, attrs=ds.attrs)
+    for var in var_list:
+        out_xr[var].attrs = ds[var].attrs
+    out_xr.coords['elev'].attrs = loc['elev'].attrs
+    out_xr.attrs['geotransform'] = GT
+    out_xr.attrs['granule_id'] = granule_id
+    out_xr.attrs['Orthorectified'] = 'True'
+
+    # Same band indexing as emit_xarray/ortho_xr
+    out_xr = index_bands(out_xr, band)
+
+    # Add Spatial Reference in recognizable format
+    out_xr.rio.write_crs(ds.spatial_ref,inplace=True)
+
+    ds.close()
+    loc.close()
+    if wvl is not None:
+        wvl.close()
+
+    return out_xr
+
+def spatial_index_path(filepath):
+    """
+    This function returns where the spatial index of a granule is persisted: next to its copy in the granule cache
+    when the file is linked from there (one index shared by every job folder, evicted with the granule), next to the
+    file otherwise.
+    """
+    filepath = os.path.realpath(filepath)
+    name = os.path.basename(filepath)
+    cached = granule_cache.cache_path(os.path.splitext(name)[0], name)
+    if cached != filepath and os.path.isfile(cached) and os.path.isfile(filepath) and os.path.samefile(cached, filepath):
+        filepath = cached
+    return filepath + '.gltidx.npz'
+
+def build_spatial_index(filepath, GLT_NODATA_VALUE=0):
+    """
+    This function builds the inverse GLT index of a granule: for every ortho grid cell, the raw (downtrack,
+    crosstrack) pixel it comes from. Only the location group is read.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file
+    GLT_NODATA_VALUE: no data value for the GLT tables, 0 by default
+
+    Returns:
+    index: a dictionary with the 'geotransform', the ortho 'lon'/'lat' vectors (pixel centers, from `coord_vects`)
+           and the int32 'rows'/'cols' (ortho_y, ortho_x) raw pixel arrays, -1 where the GLT has no data.
+    """
+    ds = xr.open_dataset(filepath, engine='netcdf4')
+    loc = xr.open_dataset(filepath, engine='netcdf4', group='location')
+    glt = xr.Dataset({'glt_x': loc['glt_x'], 'glt_y': loc['glt_y']}, attrs=ds.attrs)
+
+    lon, lat = coord_vects(glt)
+    glt_x = np.nan_to_num(loc['glt_x'].values, nan=GLT_NODATA_VALUE).astype(np.int32)
+    glt_y = np.nan_to_num(loc['glt_y'].values, nan=GLT_NODATA_VALUE).astype(np.int32)
+    valid = (glt_x != GLT_NODATA_VALUE) & (glt_y != GLT_NODATA_VALUE)
+    ds.close()
+    loc.close()
+
+    # Adjust for One based Index
+    return {
+        'geotransform': np.array(glt.attrs['geotransform'], dtype=float),
+        'lon': lon,
+        'lat': lat,
+        'rows': np.where(valid, glt_y - 1, -1).astype(np.int32),
+        'cols': np.where(valid, glt_x - 1, -1).astype(np.int32),
+    }
+
+def spatial_index(filepath, index_path=None, persist=True):
+    """
+    This function loads the persisted spatial index of a granule, building (and saving) it on first use.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file
+    index_path: where the index is persisted, `spatial_index_path(filepath)` by default
+    persist: save the index after building it
+
+    Returns:
+    index: the dictionary from `build_spatial_index`.
+    """
+    index_path = index_path or spatial_index_path(filepath)
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(filepath):
+        with np.load(index_path) as f:
+            return {k: f[k] for k in f.files}
+
+    index = build_spatial_index(filepath)
+    if persist:
+        # Atomic write, other jobs may be reading the same granule
+        tmp = index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp, index_path)
+    return index
+
+def lookup_pixels(index, points, window=0):
+    """
+    This function maps lat/lon points (and optionally a square window of ortho cells around them) to raw pixels.
+
+    Parameters:
+    index: the dictionary from `spatial_index`
+    points: an array-like (N, 2) of (lon, lat) in degrees
+    window: half size, in ortho pixels, of the square window around each point (0: the point only)
+
+    Returns:
+    rows, cols: int arrays (N, (2*window+1)**2) of raw downtrack/crosstrack pixels, -1 outside the granule or GLT.
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    GT = index['geotransform']
+    oy, ox = index['rows'].shape
+
+    col = np.floor((points[:, 0] - GT[0]) / GT[1]).astype(int)
+    row = np.floor((points[:, 1] - GT[3]) / GT[5]).astype(int)
+
+    offsets = np.arange(-window, window + 1)
+    dr, dc = np.meshgrid(offsets, offsets, indexing='ij')
+    row = row[:, None] + dr.ravel()[None, :]
+    col = col[:, None] + dc.ravel()[None, :]
+
+    inside = (row >= 0) & (row < oy) & (col >= 0) & (col < ox)
+    rows = np.full(row.shape, -1, dtype=int)
+    cols = np.full(col.shape, -1, dtype=int)
+    rows[inside] = index['rows'][row[inside], col[inside]]
+    cols[inside] = index['cols'][row[inside], col[inside]]
+    return rows, cols
+
+def _read_pixels(var, rows, cols, max_gap=64):
+    # Read only the touched raw pixels, one row span at a time when they are close together
+    out = np.full((len(rows), var.shape[-1]), np.nan, dtype=np.float32)
+    for row in np.unique(rows):
+        members = np.flatnonzero(rows == row)
+        cs = cols[members]
+        lo, hi = cs.min(), cs.max()
+        if hi - lo + 1 <= max(max_gap, 4 * len(members)):
+            block = var[row, lo:hi + 1, :]
+            out[members] = block[cs - lo]
+        else:
+            for i, c in zip(members, cs):
+                out[i] = var[row, c, :]
+    return out
+
+def extract_spectra(filepath, points, window=0, variable='reflectance', index=None, fill_value=-9999):
+    """
+    This function extracts the spectra at N lat/lon points, or small windows around them, reading only the raw
+    pixels they touch. No orthorectification of the granule is needed.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file, or an ENVI file exported with write_envi (.img/.hdr)
+    points: an array-like (N, 2) of (lon, lat) in degrees
+    window: half size, in ortho pixels, of the square window around each point (0: the point only)
+    variable: the root variable to extract, 'reflectance' by default (netCDF input only)
+    index: the spatial index from `spatial_index`, loaded (or built and persisted) when None. For a raw ENVI export
+           pass the index of its source netCDF file; orthorectified exports use their map info.
+    fill_value: the fill value for EMIT datasets, -9999 by default
+
+    Returns:
+    spectra: an xarray.DataArray (point, band) or (point, pixel, band) with NaN outside the granule or GLT.
+    """
+    # ENVI exports are read through a memory map; orthorectified ones carry their own grid in the map info
+    mm = None
+    if is_envi(filepath):
+        mm, metadata = open_envi(filepath)
+        if index is None and 'map info' not in metadata:
+            raise ValueError('A raw (non orthorectified) ENVI export needs the spatial index of its source granule: index=spatial_index(<netCDF file>)')
+        index = _envi_grid_index(metadata, mm.shape) if index is None else index
+
+    index = spatial_index(filepath) if index is None else index
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    rows, cols = lookup_pixels(index, points, window)
+
+    valid = rows >= 0
+    pixels = np.unique(np.stack([rows[valid], cols[valid]], axis=-1), axis=0)
+
+    # Pixel spectra from the tiled Zarr store when there is one (raw values, like set_auto_mask(False))
+    store = zarr_store.find(filepath, ('tiles', 'bands'))
+    if mm is not None:
+        nbands = mm.shape[-1]
+        values = _read_pixels(mm, pixels[:, 0], pixels[:, 1]) if len(pixels) else np.empty((0, nbands), np.float32)
+        wavelengths = np.array(metadata['wavelength'], dtype=float) if 'wavelength' in metadata else np.arange(nbands)
+    elif store:
+        import zarr
+        f = zarr.open_consolidated(store, mode='r')
+        var = f[variable]
+        nbands = var.shape[-1]
+        values = _read_pixels(var, pixels[:, 0], pixels[:, 1]) if len(pixels) else np.empty((0, nbands), np.float32)
+        wavelengths = f['sensor_band_parameters/wavelengths'][:] if 'sensor_band_parameters' in f else np.arange(nbands)
+    else:
+        with nc.Dataset(filepath) as f:
+            var = f[variable]
+            var.set_auto_mask(False)
+            nbands = var.shape[-1]
+            values = _read_pixels(var, pixels[:, 0], pixels[:, 1]) if len(pixels) else np.empty((0, nbands), np.float32)
+            wavelengths = f['sensor_band_parameters']['wavelengths'][:] if 'sensor_band_parameters' in f.groups else np.arange(nbands)
+    values[values == fill_value] = np.nan
+
+    # Scatter the unique pixel spectra back to every point/window cell
+    spectra = np.full(rows.shape + (nbands,), np.nan, dtype=np.float32)
+    if len(pixels):
+        flat = pixels[:, 0].astype(np.int64) * int(cols.max() + 1) + pixels[:, 1]
+        key = rows[valid].astype(np.int64) * int(cols.max() + 1) + cols[valid]
+        spectra[valid] = values[np.searchsorted(flat, key)]
+
+    coords = {'lon': ('point', points[:, 0]), 'lat': ('point', points[:, 1]), 'wavelengths': ('band', np.asarray(wavelengths))}
+    if window == 0:
+        return xr.DataArray(spectra[:, 0], dims=('point', 'band'), coords=coords, name=variable)
+    return xr.DataArray(spectra, dims=('point', 'pixel', 'band'), coords=coords, name=variable)
+
+def quality_mask(filepath, quality_bands, bbox=None, window=None, pad=1, rows_per_chunk=256):
     """
     This function builds a single layer mask to apply based on the bands selected from an EMIT L2A Mask file.
+    The flag bands are streamed one at a time in blocks of rows and OR-ed into a uint8 mask, so the selected bands
+    are never loaded (or summed) as a whole.
 
     Parameters:
     filepath: an EMIT L2A Mask netCDF file.
     quality_bands: a list of bands (quality flags only) from the mask file that should be used in creation of  mask.
+    bbox: optional (lon_min, lat_min, lon_max, lat_max); only the raw window covering it is read (see raw_window).
+    window: optional raw window (downtrack0, downtrack1, crosstrack0, crosstrack1), used instead of bbox.
+    pad: extra ortho pixels added around the bbox
+    rows_per_chunk: number of downtrack rows read per block
 
     Returns: 
-    qmask: a numpy array that can be used with the emit_xarray function to apply a quality mask.
+    qmask: a uint8 numpy array (1 where masked) that can be used with the emit_xarray function to apply a quality mask,
+           cropped to the window if one was given (ortho_window accepts it as is).
     """
     # Open Dataset
     mask_ds = xr.open_dataset(filepath,engine = 'h5netcdf')
@@ -268,30 +750,90 @@ def quality_mask(filepath, quality_bands):
     # Print Flags used
     flags_used = mask_parameters_ds['mask_bands'].data[quality_bands]
     print(f'Flags used: {flags_used}')
+    mask_parameters_ds.close()
     # Check for data bands and build mask
     if any(x in quality_bands for x in [5,6]):
+        mask_ds.close()
         err_str = f'Selected flags include a data band (5 or 6) not just flag bands'
         raise AttributeError(err_str)
-    else:
-        qmask = np.sum(mask_ds['mask'][:,:,quality_bands].values, axis=-1)
-        qmask[qmask > 1] = 1
+
+    if window is None and bbox is not None:
+        window = raw_window(filepath, bbox, pad=pad)['raw']
+    dt0, dt1, ct0, ct1 = window if window is not None else (0, mask_ds['mask'].shape[0], 0, mask_ds['mask'].shape[1])
+
+    mask = mask_ds['mask']
+    qmask = np.zeros((dt1 - dt0, ct1 - ct0), dtype=np.uint8)
+    for r0 in range(dt0, dt1, rows_per_chunk):
+        r1 = min(r0 + rows_per_chunk, dt1)
+        block = qmask[r0 - dt0:r1 - dt0]
+        for b in quality_bands:
+            block |= mask[r0:r1, ct0:ct1, b].values > 0
+    mask_ds.close()
     return(qmask)
 
-def band_mask(filepath):
+class PackedBandMask:
+    """
+    The EMIT band mask kept in its packed form (downtrack, crosstrack, 36 bytes), 8x smaller than the unpacked cube.
+    Bits are read on demand, for one band, a band subset or a block of rows, in the bit order of np.unpackbits.
+
+    Indexing with [rows, cols] or [rows, cols, bands] returns another PackedBandMask (a view on the packed bytes).
+
+    Parameters:
+    packed: the 'band_mask' array from the EMIT L2A Mask file.
+    bands: the bands (in the 285 band numbering) this mask represents, all of them by default.
+    """
+
+    def __init__(self, packed, bands=None):
+        self.packed = np.asarray(packed, dtype=np.uint8)
+        self.bands = np.arange(285) if bands is None else np.asarray(bands, dtype=np.intp)
+
+    @property
+    def shape(self):
+        return self.packed.shape[:2] + (len(self.bands),)
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        packed = self.packed[key[:2]]
+        bands = self.bands[key[2]] if len(key) > 2 else self.bands
+        return PackedBandMask(packed, np.atleast_1d(bands))
+
+    def band(self, b):
+        """
+        This function returns a boolean (downtrack, crosstrack) array, True where band `b` is masked.
+        """
+        byte, bit = divmod(int(b), 8)
+        return (self.packed[:, :, byte] >> (7 - bit)) & 1 == 1
+
+    def unpack(self):
+        """
+        This function unpacks the selected bands into a uint8 (downtrack, crosstrack, bands) array, 1 where masked.
+        Slice the rows first to unpack only a block, e.g. `mask[r0:r1].unpack()`.
+        """
+        byte, shift = np.divmod(self.bands, 8)
+        return (self.packed[:, :, byte] >> (7 - shift).astype(np.uint8)) & 1
+
+def band_mask(filepath, packed=False):
     """
     This function unpacks the packed band mask to apply to the dataset. Can be used manually or as an input in the emit_xarray() function.
 
     Parameters:
     filepath: an EMIT L2A Mask netCDF file.
-    packed_bands: the 'packed_bands' dataset from the EMIT L2A Mask file.
+    packed: if True, return a PackedBandMask instead of the unpacked uint8 cube.
 
     Returns: 
-    band_mask: a numpy array that can be used with the emit_xarray function to apply a band mask.
+    band_mask: a numpy array (or PackedBandMask) that can be used with the emit_xarray function to apply a band mask.
     """
     # Open Dataset
     mask_ds = xr.open_dataset(filepath,engine = 'h5netcdf')
     # Open band_mask and convert to uint8
     bmask = mask_ds.band_mask.data.astype('uint8')
+    mask_ds.close()
+    if packed:
+        return PackedBandMask(bmask)
     # Print Flags used
     unpacked_bmask = np.unpackbits(bmask,axis=-1)
     # Remove bands > 285
@@ -299,16 +841,37 @@ def band_mask(filepath):
     # Check for data bands and build mask
     return(unpacked_bmask)
 
-def write_envi(xr_ds, output_dir, overwrite=False, extension='.img', interleave='BIL', glt_file=False):
+def _envi_bip(mm, interleave):
+    # (lines, samples, bands) view on a memmap opened with interleave='source', no copy
+    return {'bip': mm, 'bil': mm.transpose(0, 2, 1), 'bsq': mm.transpose(1, 2, 0)}[interleave.lower()]
+
+def _write_envi_var(var, mm, interleave, qmask=None, unpacked_bmask=None, rows_per_block=64):
+    # Stream one variable into its ENVI memmap, a block of rows at a time
+    out = _envi_bip(mm, interleave)
+    for r0 in range(0, var.shape[0], rows_per_block):
+        r1 = min(r0 + rows_per_block, var.shape[0])
+        block = np.array(var[r0:r1].values)
+        apply_masks(block, None if qmask is None else qmask[r0:r1], None if unpacked_bmask is None else unpacked_bmask[r0:r1], workers=1)
+        out[r0:r1] = block.reshape(block.shape[:2] + (-1,))
+    mm.flush()
+
+def write_envi(xr_ds, output_dir, overwrite=False, extension='.img', interleave='BIL', glt_file=False, qmask=None, unpacked_bmask=None, rows_per_block=64, workers=1):
     """
     This function takes an EMIT dataset read into an xarray dataset using the emit_xarray function and then writes an ENVI file and header. Does not work for L2B MIN.
+    Each variable is streamed in blocks of rows into the declared interleave, so a dataset opened with
+    emit_xarray(lazy=True) is written without ever holding a full copy of the cube in memory.
 
     Parameters:
     xr_ds: an EMIT dataset read into xarray using the emit_xarray function.
     output_dir: output directory
     overwrite: overwrite existing file if True
     extension: the file extension for the envi formatted file, .img by default.
+    interleave: 'BIL', 'BIP' or 'BSQ'
     glt_file: also create a GLT ENVI file for later use to reproject
+    qmask: optional quality mask (see emit_xarray), applied per block; for datasets opened with lazy=True.
+    unpacked_bmask: optional band mask (see emit_xarray), applied per block; for datasets opened with lazy=True.
+    rows_per_block: number of lines read and written at a time
+    workers: number of variables written at the same time
 
     Returns:
     envi_ds: file in the output directory
@@ -344,24 +907,27 @@ def write_envi(xr_ds, output_dir, overwrite=False, extension='.img', interleave=
     # List data variables (typically reflectance/radiance)
     var_names = list(xr_ds.data_vars)
 
-    # Loop through variable names
+    # Loop through variable names, create every file (header + empty image) first
+    writes = []
     for var in var_names:
         # Define output filename
         output_name = os.path.join(output_dir, xr_ds.attrs['granule_id'] + '_' + var)
 
+        # Shape and dtype only: lazy variables are not read here
+        shape = xr_ds[var].shape
         nbands = 1
-        if len(xr_ds[var].data.shape) > 2:
-            nbands = xr_ds[var].data.shape[2]
+        if len(shape) > 2:
+            nbands = shape[2]
 
         # Start building metadata
         metadata = {
-                'lines': xr_ds[var].data.shape[0],
-                'samples': xr_ds[var].data.shape[1],
+                'lines': shape[0],
+                'samples': shape[1],
                 'bands': nbands,
                 'interleave': interleave,
                 'header offset' : 0,
                 'file type' : 'ENVI Standard',
-                'data type' : envi_typemap[str(xr_ds[var].data.dtype)],
+                'data type' : envi_typemap[str(xr_ds[var].dtype)],
                 'byte order' : 0
             }
     
@@ -400,16 +966,15 @@ def write_envi(xr_ds, output_dir, overwrite=False, extension='.img', interleave=
         # Replace NaN values in each layer with fill_value
         #np.nan_to_num(xr_ds[var].data, copy=False, nan=-9999)
         
-        # Write Variables as ENVI Output
+        # Create the ENVI file, mapped in its own (declared) interleave
         envi_ds = envi.create_image(envi_header(output_name), metadata, ext=extension, force=overwrite)
-        mm = envi_ds.open_memmap(interleave='bip', writable=True)   
-        
-        dat = xr_ds[var].data
-
-        if len(dat.shape) == 2:
-            dat = dat.reshape((dat.shape[0],dat.shape[1],1))
+        mm = envi_ds.open_memmap(interleave='source', writable=True)
+        writes.append((xr_ds[var], mm))
 
-        mm[...]= dat
+    # Write Variables as ENVI Output, row blocks, several variables at a time
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as pool:
+        list(pool.map(lambda w: _write_envi_var(w[0], w[1], interleave, qmask, unpacked_bmask, rows_per_block), writes))
+    del writes
 
     # Create GLT Metadata/File
     if glt_file == True:
@@ -424,19 +989,55 @@ def write_envi(xr_ds, output_dir, overwrite=False, extension='.img', interleave=
         glt_metadata.pop('fwhm', None)
         
         # Replace Metadata 
-        glt_metadata['lines'] = xr_ds['glt_x'].data.shape[0]
-        glt_metadata['samples'] = xr_ds['glt_x'].data.shape[1]
+        glt_metadata['lines'] = xr_ds['glt_x'].shape[0]
+        glt_metadata['samples'] = xr_ds['glt_x'].shape[1]
         glt_metadata['bands'] = 2
         glt_metadata['data type'] = envi_typemap['int32']
         glt_metadata['band names'] = ['glt_x', 'glt_y']
         glt_metadata['coordinate system string']= csstring
         glt_metadata['map info'] = mapinfo
         
-        # Write GLT Outputs as ENVI File
+        # Write GLT Outputs as ENVI File, one band at a time (no stacked copy)
         glt_ds = envi.create_image(envi_header(glt_output_name), glt_metadata, ext=extension, force=overwrite)
-        mmglt = glt_ds.open_memmap(interleave='bip', writable=True)
-        mmglt[...] = np.stack((xr_ds['glt_x'].values,xr_ds['glt_y'].values),axis=-1).astype('int32')
+        mmglt = glt_ds.open_memmap(interleave='source', writable=True)
+        glt_out = _envi_bip(mmglt, interleave)
+        for b, name in enumerate(['glt_x', 'glt_y']):
+            glt_out[:, :, b] = xr_ds[name].values
+        mmglt.flush()
     
+ENVI_EXTENSIONS = ('.img', '.hdr', '.dat', '.raw')
+
+def is_envi(filepath):
+    """
+    This function tells ENVI binary/header paths apart from netCDF granules.
+    """
+    return isinstance(filepath, str) and os.path.splitext(filepath)[-1].lower() in ENVI_EXTENSIONS
+
+def open_envi(filepath):
+    """
+    This function opens an ENVI file written by write_envi as a read-only memory map. Nothing is read until it is
+    indexed, and then only the pages touched are.
+
+    Parameters:
+    filepath: the ENVI binary or header path (resolved with envi_header).
+
+    Returns:
+    mm: a (lines, samples, bands) numpy memmap view, whatever the file interleave.
+    metadata: the header dictionary ('wavelength', 'map info', ...).
+    """
+    header = envi_header(filepath)
+    image = filepath if os.path.splitext(filepath)[-1].lower() != '.hdr' else None
+    envi_ds = envi.open(header, image)
+    return envi_ds.open_memmap(interleave='bip', writable=False), envi_ds.metadata
+
+def _envi_grid_index(metadata, shape):
+    # Spatial index of an orthorectified export: every cell maps to itself
+    px, py, x0, y0, dx, dy = (float(v) for v in metadata['map info'][1:7])
+    oy, ox = shape[:2]
+    return {'geotransform': np.array([x0 - (px - 1) * dx, dx, 0, y0 + (py - 1) * dy, 0, -dy]),
+            'rows': np.broadcast_to(np.arange(oy)[:, None], (oy, ox)),
+            'cols': np.broadcast_to(np.arange(ox)[None, :], (oy, ox))}
+
 def envi_header(inputpath):
     """
     Convert a envi binary/header path to a header, handling extensions
@@ -0,0 +1,266 @@
+"""
+This Module has the functions related to the local footprint index of cached EMIT granules. When a granule enters
+the cache its ground polygon (UMM GPolygons/bounding rectangles, or the outline of the 'location' lat/lon arrays)
+and acquisition date are recorded, with its UMM metadata as a sidecar ('<file>.umm.json', evicted with the file).
+Requests for a point and date range already covered by a cached granule are then answered locally, without the
+catalogue round trip.
+
+Repeated requests are answered exactly: the granule every catalogue search picked is recorded by search key
+(product, bbox, dates, in '<cache_dir>/searches.json'), and the same request is then answered with it while it is
+cached. Other requests take a cached granule covering the point acquired within EMIT_FOOTPRINT_TOLERANCE days of
+the start date (31 by default, so any cached granule of a month order) and inside the requested dates. The catalogue
+search would pick the granule closest to the start date, and the cache only knows the granules it holds, so with a
+tolerance a cached granule may be used where the catalogue has a closer one; EMIT_FOOTPRINT_TOLERANCE=0 only takes
+granules acquired on the start date, which the catalogue would also pick.
+
+The index ('<cache_dir>/footprints.json') is loaded into an R-tree of footprint bounding boxes (the optional
+'rtree' package, a numpy scan of the boxes otherwise) and reloaded only when another job changed it; candidates are
+confirmed with a point-in-polygon test.
+"""
+
+# Packages used
+import os
+import json
+import datetime
+import threading
+import numpy as np
+import netCDF4 as nc
+from modules import search, sites
+from modules.granule_cache import CACHE_DIR, _locked, cache_path
+
+try:
+    from rtree import index as rtree_index
+except ImportError:
+    rtree_index = None
+
+# Days after the requested start date a cached granule may be acquired and still answer the request
+TOLERANCE = int(os.environ.get('EMIT_FOOTPRINT_TOLERANCE', 31))
+
+# Search keys remembered, oldest dropped first
+SEARCHES = 10000
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def product_name(name_file):
+    """
+    This function returns the product short name of a granule file ('EMIT_L2A_RFL_...' -> 'EMITL2ARFL').
+    """
+    return ''.join(name_file.split('_')[:3])
+
+
+def file_footprint(filepath, step=32):
+    """
+    This function outlines the ground footprint of a granule from the edges of its 'location' lat/lon arrays.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file (only the array edges are read).
+    step: keep one edge pixel every `step`.
+
+    Returns:
+    rings: a list with one (N, 2) array of (lon, lat).
+    """
+    with nc.Dataset(filepath) as ds:
+        loc = ds.groups['location']
+        edges = []
+        for name in ('lon', 'lat'):
+            var = loc.variables[name]
+            rows, cols = var.shape
+            edges.append(np.concatenate([var[0, ::step], var[::step, cols - 1], var[rows - 1, ::-step], var[::-step, 0]]))
+
+    ring = np.stack([np.ma.filled(e.astype(float), np.nan) for e in edges], axis=-1)
+    ring = ring[np.isfinite(ring).all(axis=1) & (np.abs(ring) <= 180).all(axis=1)]
+    return [ring] if len(ring) >= 3 else []
+
+
+class FootprintIndex:
+    """
+    Footprints of the cached granules, queried by point through an R-tree (or a numpy scan) of their bounding boxes.
+
+    Parameters:
+    records: a list of {'granule_id', 'name', 'product', 'acquired', 'bounds', 'rings'}.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.bounds = np.array([r['bounds'] for r in records], dtype=float).reshape(-1, 4)
+        self.acquired = [search.parse_date(r['acquired']) for r in records]
+        self._tree = None
+        if rtree_index is not None and records:
+            self._tree = rtree_index.Index((i, tuple(b), None) for i, b in enumerate(self.bounds))
+
+    def query(self, lon, lat, start=None, end=None, product=None):
+        """
+        This function returns the records whose footprint covers (lon, lat), acquired within [start, end] (dates).
+        """
+        if self._tree is not None:
+            candidates = self._tree.intersection((lon, lat, lon, lat))
+        else:
+            b = self.bounds
+            candidates = np.flatnonzero((b[:, 0] <= lon) & (b[:, 2] >= lon) & (b[:, 1] <= lat) & (b[:, 3] >= lat))
+
+        found = []
+        for i in candidates:
+            record = self.records[i]
+            if product and record['product'] != product:
+                continue
+            acquired = self.acquired[i]
+            if (start and acquired < start) or (end and acquired > end):
+                continue
+            if sites.contains(record['rings'], lon, lat):
+                found.append(record)
+        return found
+
+
+def _index_path(cache_dir):
+    return os.path.join(cache_dir, 'footprints.json')
+
+
+def _read(cache_dir):
+    path = _index_path(cache_dir)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load(cache_dir=CACHE_DIR):
+    """
+    This function returns the footprint index of a cache, rebuilt only when the index file changed.
+    """
+    path = _index_path(cache_dir)
+    stamp = os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+
+    with _loaded_lock:
+        hit = _loaded.get(path)
+        if hit and hit[0] == stamp:
+            return hit[1]
+
+    index = FootprintIndex(list(_read(cache_dir).values()))
+    with _loaded_lock:
+        _loaded[path] = (stamp, index)
+    return index
+
+
+def record(filepath, granule, granule_id, name_file, acquired=None, cache_dir=CACHE_DIR):
+    """
+    This function records the footprint, acquisition date and UMM metadata of a cached granule file, once.
+
+    Parameters:
+    filepath: the cached file path.
+    granule: the granule from the catalogue search ({'umm': ...}).
+    granule_id, name_file: the cache key of the file.
+    acquired: the acquisition date ('YYYY-MM-DD'), from the UMM temporal extent when None.
+    cache_dir: the cache directory.
+
+    Returns:
+    entry: the recorded footprint, None when the granule has no usable footprint or date.
+    """
+    key = granule_id + '/' + name_file
+    umm_path = filepath + '.umm.json'
+    if any(r['granule_id'] + '/' + r['name'] == key for r in load(cache_dir).records) and os.path.isfile(umm_path):
+        return None
+
+    try:
+        acquired = acquired or search.granule_time(granule).isoformat()
+    except (KeyError, AttributeError, ValueError):
+        return None
+    rings = sites.footprint(granule) or file_footprint(filepath)
+    if not rings:
+        return None
+
+    points = np.concatenate(rings)
+    entry = {'granule_id': granule_id, 'name': name_file, 'product': product_name(name_file), 'acquired': acquired,
+             'bounds': [float(points[:, 0].min()), float(points[:, 1].min()), float(points[:, 0].max()), float(points[:, 1].max())],
+             'rings': [ring.tolist() for ring in rings]}
+
+    tmp = f'{umm_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(dict(granule['umm']), f, default=str)
+    os.replace(tmp, umm_path)
+
+    # Same lock and atomic write as the cache index
+    with _locked(os.path.join(cache_dir, 'footprints.lock')):
+        # Evicted granules drop out of the index here
+        index = {k: r for k, r in _read(cache_dir).items() if os.path.isfile(cache_path(r['granule_id'], r['name'], cache_dir))}
+        index[key] = entry
+        tmp = _index_path(cache_dir) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, _index_path(cache_dir))
+    return entry
+
+
+def _search_key(short_nm, bx, date):
+    # Same request, same key: product, bbox as sent, dates as parsed by the search
+    return '|'.join([short_nm, ','.join(str(x) for x in bx)] + [search.parse_date(d).isoformat() for d in date])
+
+
+def remember(short_nm, bx, date, granule_id, name_file, acquired, cache_dir=CACHE_DIR):
+    """
+    This function records the granule file a catalogue search picked for a request, so the same request is answered
+    from the cache once the file is there.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'searches.json')
+    with _locked(os.path.join(cache_dir, 'footprints.lock')):
+        searches = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                searches = json.load(f)
+        key = _search_key(short_nm, bx, date)
+        searches.pop(key, None)
+        searches[key] = {'granule_id': granule_id, 'name': name_file, 'acquired': acquired}
+        for old in list(searches)[:max(0, len(searches) - SEARCHES)]:
+            del searches[old]
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(searches, f)
+        os.replace(tmp, path)
+
+
+def _cached_umm(granule_id, name_file, cache_dir):
+    # UMM metadata of a granule file still in the cache, None otherwise
+    path = cache_path(granule_id, name_file, cache_dir)
+    if os.path.isfile(path) and os.path.isfile(path + '.umm.json'):
+        with open(path + '.umm.json') as f:
+            return {'umm': json.load(f)}
+    return None
+
+
+def covering(short_nm, bx, date, cache_dir=CACHE_DIR, tolerance=TOLERANCE):
+    """
+    This function finds a cached granule for a request: the one an earlier catalogue search picked for the same
+    request, or one covering the center of the bbox acquired within the requested dates, up to `tolerance` days
+    after the start date (closest to it first).
+
+    Parameters:
+    short_nm: the product short name ('EMITL2ARFL', 'EMITL2BMIN').
+    bx: the bounding box (lon_min, lat_min, lon_max, lat_max).
+    date: the requested (start, end) dates as strings.
+    tolerance: days after the start date a cached granule may be acquired (0: on the start date only).
+
+    Returns:
+    granule: {'umm': ...} as from the catalogue, None if no cached granule covers the request.
+    acquired: its acquisition date ('YYYY-MM-DD').
+    """
+    # The same request as an earlier search: its pick
+    path = os.path.join(cache_dir, 'searches.json')
+    if os.path.isfile(path):
+        with open(path) as f:
+            picked = json.load(f).get(_search_key(short_nm, bx, date))
+        granule = picked and _cached_umm(picked['granule_id'], picked['name'], cache_dir)
+        if granule:
+            return granule, picked['acquired']
+
+    lon, lat = (float(bx[0]) + float(bx[2])) / 2, (float(bx[1]) + float(bx[3])) / 2
+    start, end = search.parse_date(date[0]), search.parse_date(date[1])
+
+    # Closest to the requested start first, as the catalogue search picks
+    found = load(cache_dir).query(lon, lat, start, min(end, start + datetime.timedelta(days=tolerance)), product=short_nm)
+    for r in sorted(found, key=lambda r: abs((search.parse_date(r['acquired']) - start).days)):
+        granule = _cached_umm(r['granule_id'], r['name'], cache_dir)
+        if granule:
+            return granule, r['acquired']
+    return None, None
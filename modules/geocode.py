@@ -0,0 +1,106 @@
+"""
+This Module has the functions related to reverse geocoding the report location. The place table shipped with
+reverse_geocoder (cities with 1000+ inhabitants) is loaded once per process into a KD-tree, so lookups are answered
+offline in microseconds and cached per rounded coordinate.
+
+The network geocoder (Nominatim) is only an optional, time-boxed enrichment step: a single request with a short
+timeout and no retries (EMIT_GEOCODER_ONLINE=0 disables it, EMIT_GEOCODER_TIMEOUT sets the timeout in seconds).
+"""
+
+# Packages used
+import os
+import csv
+import threading
+from functools import lru_cache
+import numpy as np
+from scipy.spatial import cKDTree
+import reverse_geocoder as rg
+from geopy.geocoders import Nominatim
+from geopy.exc import GeopyError
+
+PLACES = os.path.join(os.path.dirname(rg.__file__), 'rg_cities1000.csv')
+ONLINE = os.environ.get('EMIT_GEOCODER_ONLINE', '1') != '0'
+TIMEOUT = float(os.environ.get('EMIT_GEOCODER_TIMEOUT', 3))
+
+_tree = None
+_places = None
+_load_lock = threading.Lock()
+
+# Found Nominatim addresses by rounded coordinate, oldest dropped first
+ADDRESS_CACHE_SIZE = 4096
+_addresses = {}
+_addresses_lock = threading.Lock()
+
+
+def _xyz(lat, lon):
+    # Points on the unit sphere, so euclidean nearest neighbours are great-circle nearest neighbours
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def load(path=PLACES):
+    """
+    This function loads the place table into a KD-tree, once per process. Call it at worker start to keep the
+    load out of the first report.
+    """
+    global _tree, _places
+    with _load_lock:
+        if _tree is None:
+            with open(path, encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+            coords = np.array([(float(r['lat']), float(r['lon'])) for r in rows])
+            _places = [f"{r['name']} {r['admin1']} {r['cc']}" for r in rows]
+            _tree = cKDTree(_xyz(coords[:, 0], coords[:, 1]))
+    return _tree
+
+
+@lru_cache(maxsize=65536)
+def _nearest(lat, lon):
+    load()
+    _, i = _tree.query(_xyz(lat, lon))
+    return _places[i]
+
+
+def lookup(latitud, longitud, precision=3):
+    """
+    This function returns the nearest known place ('name admin1 cc') to a coordinate, offline.
+
+    Parameters:
+    latitud, longitud: the coordinate in degrees.
+    precision: decimals kept for the cache key (3 ~ 100 m).
+    """
+    return _nearest(round(float(latitud), precision), round(float(longitud), precision))
+
+
+def _enrich(lat, lon, timeout):
+    try:
+        ubicacion = Nominatim(user_agent="mi_app2", timeout=timeout).reverse((lat, lon), language="es")
+    except GeopyError as e:
+        print(f"Error en el servicio de geocodificación: {str(e)}")
+        return None
+    return ubicacion.address if ubicacion else None
+
+
+def enrich(latitud, longitud, timeout=TIMEOUT, precision=3):
+    """
+    This function asks Nominatim for the full address with a short timeout. Returns None if it fails; only found
+    addresses are cached, so a timeout or outage is retried on the next report.
+    """
+    key = (round(float(latitud), precision), round(float(longitud), precision))
+    address = _addresses.get(key)
+    if address is None:
+        address = _enrich(*key, timeout)
+        if address is not None:
+            with _addresses_lock:
+                if len(_addresses) >= ADDRESS_CACHE_SIZE:
+                    _addresses.pop(next(iter(_addresses)))
+                _addresses[key] = address
+    return address
+
+
+def describe(latitud, longitud, online=ONLINE, timeout=TIMEOUT):
+    """
+    This function returns the location text for the report: the Nominatim address when enabled and available in
+    time, the offline nearest place otherwise.
+    """
+    return (online and enrich(latitud, longitud, timeout)) or lookup(latitud, longitud)
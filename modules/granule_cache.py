@@ -0,0 +1,206 @@
+"""
+This Module has the functions related to the shared local cache of downloaded EMIT granules. Files are stored once
+under '<cache_dir>/<granule_id>/<file name>', keyed by the granule ID from the UMM metadata, so any job that needs a
+granule another job already fetched gets it without network I/O.
+
+The cache keeps an on-disk index ('index.json') with the size and last access time of every file. Index updates are
+atomic (write + rename) and serialized with a lock file, and when the cache grows over its byte budget the least
+recently used files are evicted, together with their sidecars ('<file>.*', e.g. indexes or Zarr stores; not the
+download lock or a '.part' download in progress). Access times are recorded to the minute, so repeated hits do not
+rewrite the index every time.
+
+Configuration: EMIT_CACHE_DIR (default './data/cache') and EMIT_CACHE_BYTES (default 100 GB).
+"""
+
+# Packages used
+import os
+import glob
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+CACHE_DIR = os.environ.get('EMIT_CACHE_DIR', './data/cache')
+CACHE_BYTES = int(os.environ.get('EMIT_CACHE_BYTES', 100 * 1024**3))
+
+# In-process locks, used when fcntl is not available
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+# Seconds between two recorded accesses of the same file (the resolution of the LRU order)
+ACCESS_RESOLUTION = 60
+
+# Files next to a cached file that belong to a download, not to the file: never evicted with it
+_IN_FLIGHT = ('.lock', '.part')
+
+
+@contextmanager
+def _locked(path):
+    # Exclusive lock across threads and processes on `path` (flock locks conflict between separate opens)
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(path, threading.Lock())
+        with lock:
+            yield
+        return
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_index(cache_dir):
+    path = os.path.join(cache_dir, 'index.json')
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_index(cache_dir, index):
+    path = os.path.join(cache_dir, 'index.json')
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _key(granule_id, name_file):
+    return granule_id + '/' + name_file
+
+
+def cache_path(granule_id, name_file, cache_dir=CACHE_DIR):
+    """
+    This function returns where a granule file lives in the cache.
+    """
+    return os.path.join(cache_dir, granule_id, name_file)
+
+
+def lookup(granule_id, name_file, cache_dir=CACHE_DIR):
+    """
+    This function looks a granule file up in the cache and marks it as recently used.
+
+    Returns:
+    path: the cached file path, None on a miss.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _key(granule_id, name_file)
+
+    with _locked(os.path.join(cache_dir, 'index.lock')):
+        index = _read_index(cache_dir)
+        entry = index.get(key)
+        path = cache_path(granule_id, name_file, cache_dir)
+        if entry is None or not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+            return None
+        if time.time() - entry['last_access'] >= ACCESS_RESOLUTION:
+            entry['last_access'] = time.time()
+            _write_index(cache_dir, index)
+    return path
+
+
+def add(granule_id, name_file, cache_dir=CACHE_DIR, budget=CACHE_BYTES):
+    """
+    This function records a file already written at `cache_path(...)` in the index, then evicts down to the budget.
+    """
+    path = cache_path(granule_id, name_file, cache_dir)
+    key = _key(granule_id, name_file)
+
+    with _locked(os.path.join(cache_dir, 'index.lock')):
+        index = _read_index(cache_dir)
+        index[key] = {'size': os.path.getsize(path), 'last_access': time.time()}
+        _evict(cache_dir, index, budget, keep=key)
+        _write_index(cache_dir, index)
+    return path
+
+
+def _remove(cache_dir, key):
+    granule_id, name_file = key.split('/', 1)
+    path = cache_path(granule_id, name_file, cache_dir)
+    for p in [path] + glob.glob(glob.escape(path) + '.*'):
+        if p[len(path):].startswith(_IN_FLIGHT):
+            continue
+        if os.path.isdir(p):
+            shutil.rmtree(p, ignore_errors=True)
+        elif os.path.isfile(p):
+            os.remove(p)
+    if os.path.isdir(os.path.dirname(path)) and not os.listdir(os.path.dirname(path)):
+        os.rmdir(os.path.dirname(path))
+
+
+def _evict(cache_dir, index, budget, keep=None):
+    # Least recently used first, never the file that was just added
+    total = sum(entry['size'] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_access']):
+        if total <= budget:
+            break
+        if key == keep:
+            continue
+        _remove(cache_dir, key)
+        total -= index.pop(key)['size']
+
+
+def evict(cache_dir=CACHE_DIR, budget=CACHE_BYTES):
+    """
+    This function evicts least recently used files until the cache fits in `budget` bytes.
+    """
+    with _locked(os.path.join(cache_dir, 'index.lock')):
+        index = _read_index(cache_dir)
+        _evict(cache_dir, index, budget)
+        _write_index(cache_dir, index)
+
+
+def fetch(granule_id, name_file, fetch_func, cache_dir=CACHE_DIR, budget=CACHE_BYTES):
+    """
+    This function returns a granule file from the cache, calling `fetch_func` to download it only on a miss.
+
+    Parameters:
+    granule_id: the granule ID (UMM GranuleUR).
+    name_file: the file name within the granule.
+    fetch_func: a function fetch_func(path) that writes the file atomically at `path` (e.g. `download.download`).
+    cache_dir: the cache directory.
+    budget: the cache size limit in bytes.
+
+    Returns:
+    path: the cached file path.
+    hit: True if the file was already in the cache.
+    """
+    path = lookup(granule_id, name_file, cache_dir)
+    if path:
+        return path, True
+
+    path = cache_path(granule_id, name_file, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # One download per file, even across concurrent jobs: the next one waits and hits the cache
+    with _locked(path + '.lock'):
+        cached = lookup(granule_id, name_file, cache_dir)
+        if cached:
+            return cached, True
+        fetch_func(path)
+        add(granule_id, name_file, cache_dir, budget)
+
+    return path, False
+
+
+def link(path, dest):
+    """
+    This function makes a cached file available at `dest` without copying it (hard link, copy as fallback).
+    """
+    if os.path.abspath(path) == os.path.abspath(dest):
+        return dest
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copyfile(path, dest)
+    return dest
@@ -0,0 +1,155 @@
+"""
+This Module has the spectral index registry and the engine that evaluates it. Each index is described by the
+wavelengths it needs and its formula, so `service.analysis` reads the band stack once and every registered index is
+computed from it in a single float32 pass.
+
+Index kinds:
+- 'ratio': bands[0] / bands[1]
+- 'normalized_difference': (bands[0] - bands[1]) / (bands[0] + bands[1])
+- 'expression': a custom formula(band, out, scratch) writing its result into `out`
+- 'rgb': a contrast-stretched true color composite from bands (red, green, blue)
+"""
+
+# Packages used
+import numpy as np
+from skimage import exposure
+
+INDICES = [
+    {'name': 'rgb', 'label': 'RGB', 'kind': 'rgb', 'bands': (620, 550, 450),
+     'file': 'rgb.png', 'title': None, 'cmap': None, 'axis': 'off', 'colorbar': False},
+    {'name': 'ndvi', 'label': 'NDVI', 'kind': 'normalized_difference', 'bands': (850, 650),
+     'file': 'ndvi.png', 'title': 'NDVI: Normalized Difference Vegetation Index', 'cmap': 'brg', 'axis': 'off', 'colorbar': True},
+    {'name': 'iron_oxide', 'label': 'Iron Oxide', 'kind': 'ratio', 'bands': (850, 650),
+     'file': 'iron_oxide.png', 'title': 'Iron Oxide Index', 'cmap': 'rainbow', 'axis': 'off', 'colorbar': True},
+    {'name': 'alunite', 'label': 'AlOH', 'kind': 'ratio', 'bands': (2200, 1700),
+     'file': 'alunite.png', 'title': 'AlOH Index', 'cmap': 'rainbow', 'axis': 'off', 'colorbar': True},
+    {'name': 'FEOOH', 'label': 'FEOOH', 'kind': 'ratio', 'bands': (970, 900),
+     'file': 'FEOOH.png', 'title': 'Ferric Oxide-Oxyhydroxide Clay Index (FEOOH)', 'cmap': 'rainbow', 'axis': 'off', 'colorbar': True},
+    {'name': 'AAI', 'label': 'AAI', 'kind': 'ratio', 'bands': (2200, 2100),
+     'file': 'AAI.png', 'title': 'Argillic Alteration Index', 'cmap': 'rainbow', 'axis': 'off', 'colorbar': True},
+    {'name': 'AIS', 'label': 'AIS', 'kind': 'ratio', 'bands': (2200, 2300),
+     'file': 'AIS.png', 'title': 'Argillic and Sericitic Alteration Index', 'cmap': 'rainbow', 'axis': 'off', 'colorbar': True},
+    {'name': 'DOS', 'label': 'DOS-2', 'kind': 'normalized_difference', 'bands': (790, 720),
+     'file': 'DOS.png', 'title': 'Red Edge Position 3', 'cmap': 'rainbow', 'axis': 'on', 'colorbar': True},
+]
+
+
+def register_index(spec, indices=INDICES):
+    """
+    This function adds a new index to the registry, replacing any index with the same name.
+
+    Parameters:
+    spec: a dictionary with at least 'name', 'kind' and 'bands' (and 'formula' for the 'expression' kind).
+    indices: the registry to update, the module registry by default.
+
+    Returns:
+    spec: the registered index description.
+    """
+    if spec['kind'] not in KERNELS and spec['kind'] != 'rgb':
+        raise ValueError(f"Unknown index kind: {spec['kind']}")
+    if spec['kind'] == 'expression' and not callable(spec.get('formula')):
+        raise ValueError(f"Index {spec['name']} needs a callable 'formula'")
+
+    spec = {'label': spec['name'], 'file': spec['name'] + '.png', 'title': None,
+            'cmap': 'rainbow', 'axis': 'off', 'colorbar': True, **spec}
+
+    indices[:] = [s for s in indices if s['name'] != spec['name']]
+    indices.append(spec)
+    return spec
+
+
+def required_wavelengths(indices=INDICES):
+    """
+    This function lists the unique wavelengths (nm) needed by a set of indices, to build the band plan.
+    """
+    return sorted({w for spec in indices for w in spec['bands']})
+
+
+def _ratio(spec, band, out, scratch):
+    np.divide(band(spec['bands'][0]), band(spec['bands'][1]), out=out)
+
+
+def _normalized_difference(spec, band, out, scratch):
+    a, b = band(spec['bands'][0]), band(spec['bands'][1])
+    np.subtract(a, b, out=out)
+    np.add(a, b, out=scratch)
+    np.divide(out, scratch, out=out)
+
+
+def _expression(spec, band, out, scratch):
+    spec['formula'](band, out, scratch)
+
+
+KERNELS = {
+    'ratio': _ratio,
+    'normalized_difference': _normalized_difference,
+    'expression': _expression,
+}
+
+
+def rgb_composite(stack, lookup, bands=(620, 550, 450), clip_limit=0.02):
+    """
+    This function builds the contrast-stretched true color composite from the band stack.
+
+    Parameters:
+    stack: a numpy array (downtrack, crosstrack, n) from `bands.read_bands`.
+    lookup: a dictionary mapping wavelengths to positions in the stack.
+    bands: the red, green and blue wavelengths (nm).
+    clip_limit: the clip limit of the adaptive histogram equalization.
+
+    Returns:
+    rgb: a float array (downtrack, crosstrack, 3) in the 0-1 range.
+    """
+    rgb = np.empty(stack.shape[:2] + (3,), dtype=np.uint8)
+
+    # Scale each channel to the range of 0-255
+    for i, w in enumerate(bands):
+        channel = stack[:, :, lookup[w]]
+        rgb[:, :, i] = channel * 255 / np.max(channel)
+
+    # Contrast
+    return exposure.equalize_adapthist(rgb, clip_limit=clip_limit)
+
+
+def evaluate(stack, lookup, indices=INDICES, rows_per_block=256):
+    """
+    This function evaluates every registered index in one fused pass over the shared band stack.
+
+    Parameters:
+    stack: a numpy array (downtrack, crosstrack, n) from `bands.read_bands`.
+    lookup: a dictionary mapping wavelengths to positions in the stack.
+    indices: the index registry to evaluate, the module registry by default.
+    rows_per_block: number of downtrack rows processed at a time, keeping the working set in cache.
+
+    Returns:
+    products: a dictionary mapping index names to float32 arrays (downtrack, crosstrack), clipped to [0, inf).
+    """
+    stack = stack.astype(np.float32, copy=False)
+    rows, cols = stack.shape[:2]
+
+    scalar = [spec for spec in indices if spec['kind'] != 'rgb']
+
+    # Preallocated outputs and a single scratch block shared by all kernels
+    out = np.empty((len(scalar), rows, cols), dtype=np.float32)
+    scratch = np.empty((min(rows_per_block, rows), cols), dtype=np.float32)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for r0 in range(0, rows, rows_per_block):
+            r1 = min(r0 + rows_per_block, rows)
+            block = stack[r0:r1]
+
+            def band(w):
+                return block[:, :, lookup[w]]
+
+            for i, spec in enumerate(scalar):
+                o = out[i, r0:r1]
+                KERNELS[spec['kind']](spec, band, o, scratch[:r1 - r0])
+                np.maximum(o, 0, out=o)
+
+    products = {spec['name']: out[i] for i, spec in enumerate(scalar)}
+
+    for spec in indices:
+        if spec['kind'] == 'rgb':
+            products[spec['name']] = rgb_composite(stack, lookup, spec['bands'])
+
+    return products
@@ -0,0 +1,158 @@
+"""
+This Module has the job subsystem behind the Dash app. Orders are queued and run by a pool of pre-warmed worker
+processes that already hold the heavy imports (xarray, netCDF4, earthaccess, skimage, matplotlib, reportlab), so a
+job does not pay the interpreter start-up and import cost, and the web server never blocks on a job.
+
+Every order gets a job ID; its status ('queued', 'running', 'done', 'failed') and result can be polled with
+`JobQueue.status` until it expires (`ttl` seconds after it finished), and `JobQueue.metrics` aggregates finished
+orders for the server's metrics endpoint.
+"""
+
+# Packages used
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from modules import tracing
+
+# Set in every worker by `_warm`
+_events = None
+
+
+def _warm(events):
+    # Pay the heavy imports once per worker process
+    global _events
+    _events = events
+    import main  # noqa: F401  (imports service, xarray, netCDF4, earthaccess, skimage, matplotlib, reportlab)
+    from modules import geocode
+    geocode.load()
+
+
+def _noop():
+    return None
+
+
+def _run(job_id, user, password, date, bx, options):
+    import main
+    _events.put((job_id, 'running', time.time()))
+    return main.run(user, password, date, bx, job_id=job_id, **options)
+
+
+class JobQueue:
+    """
+    A queue of processing orders run by a pool of warm worker processes.
+
+    Parameters:
+    workers: number of worker processes, i.e. orders processed at the same time.
+    ttl: seconds a finished job stays available to `status` and `jobs`.
+    options: default keyword arguments for `main.run` (workers, dpi, fast).
+    """
+
+    def __init__(self, workers=2, ttl=24 * 3600, **options):
+        ctx = multiprocessing.get_context('spawn')
+        self._workers = workers
+        self._ttl = ttl
+        self._events = ctx.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_warm, initargs=(self._events,))
+        self._options = options
+        self._metrics = tracing.Metrics()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+        # Start (and warm) every worker now instead of on the first order
+        for _ in range(workers):
+            self._pool.submit(_noop)
+
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        # Worker -> server status events
+        while True:
+            job_id, status, at = self._events.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job and job['status'] == 'queued':
+                    job['status'], job['started'] = status, at
+
+    def _expire(self, now):
+        # Drop finished jobs older than the TTL (called with the lock held)
+        for job_id in [k for k, job in self._jobs.items() if job['finished'] and now - job['finished'] > self._ttl]:
+            del self._jobs[job_id]
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['finished'] = time.time()
+            if future.exception() is not None:
+                job['status'], job['error'] = 'failed', str(future.exception())
+            else:
+                result = future.result()
+                job['result'] = result
+                job['status'] = 'failed' if result.get('error') else 'done'
+                job['error'] = result.get('error')
+
+            # Stage latencies, plus the time waiting for a worker and the end-to-end latency of the order
+            stages = list((job['result'] or {}).get('stages') or [])
+            stages.append(('queue wait', (job['started'] or job['finished']) - job['submitted']))
+            stages.append(('job', job['finished'] - job['submitted']))
+            self._metrics.job(job['status'], job['finished'], stages)
+
+    def submit(self, user, password, date, bx, **options):
+        """
+        This function queues an order and returns its job ID right away.
+
+        Parameters:
+        user, password: Earthdata credentials.
+        date: (start, end) dates as strings.
+        bx: the bounding box (four strings, as `main.run` expects).
+        options: keyword arguments for `main.run`, overriding the queue defaults.
+
+        Returns:
+        job_id: the ID to poll with `status`.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._expire(time.time())
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'submitted': time.time(), 'started': None,
+                                  'finished': None, 'date': tuple(date), 'bbox': tuple(bx), 'result': None, 'error': None}
+
+        future = self._pool.submit(_run, job_id, user, password, tuple(date), tuple(bx), {**self._options, **options})
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def status(self, job_id):
+        """
+        This function returns a copy of the job record (status, timestamps, result or error), None if unknown or expired.
+        """
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def jobs(self):
+        """
+        This function returns a copy of every job record, oldest first.
+        """
+        with self._lock:
+            self._expire(time.time())
+            return [dict(job) for job in self._jobs.values()]
+
+    def depth(self):
+        """
+        This function returns the number of orders waiting for a worker.
+        """
+        with self._lock:
+            return sum(job['status'] == 'queued' for job in self._jobs.values())
+
+    def metrics(self):
+        """
+        This function returns the queue metrics: jobs by status, throughput, queue depth, running orders and the
+        latency histogram of every stage (see tracing.Metrics).
+        """
+        with self._lock:
+            running = sum(job['status'] == 'running' for job in self._jobs.values())
+        return self._metrics.snapshot(queue_depth=self.depth(), running=running, workers=self._workers)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,275 @@
+"""
+This Module has the functions related to rendering the finished index and mineral arrays as images. Figures are
+built with the object-oriented Agg backend, without the global pyplot state, so several of them can be drawn in
+parallel across a process pool.
+
+Plain rasters can skip the figure entirely ('fast' jobs): the array is normalized, mapped through a precomputed
+256-entry colormap lookup table and written straight to PNG. Colorbars and legends become small sidecar images
+next to it ('<name>_colorbar.png', '<name>_legend.png'). Class rasters (jobs with 'levels', e.g. mineral IDs) are
+drawn by class through the colormap resampled to one color per level, the table their legend is built from, in
+both renderers.
+
+Every image is encoded in memory first. Jobs with 'memory' set return it as a product dictionary (PNG bytes and
+pixel size, plus the colorbar/legend sidecars) that the report builder embeds directly; the files are only written
+when the job has a 'save' path.
+"""
+
+# Packages used
+import os
+import io
+import threading
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import Patch
+from matplotlib.colors import ListedColormap, Normalize
+from matplotlib.cm import ScalarMappable
+from PIL import Image
+
+# Colormap lookup tables, built once per process
+_LUTS = {}
+
+# Render process pools, by number of workers (see `render`)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def colormap_colors(name, n):
+    """
+    This function returns the (n, 4) RGBA colors of a matplotlib colormap resampled to n colors (as `get_cmap(name, n)`).
+    """
+    return matplotlib.colormaps[name](np.linspace(0, 1, n))
+
+
+def colormap_lut(name, n=256):
+    """
+    This function returns a precomputed (n, 3) uint8 RGB lookup table for a matplotlib colormap.
+    """
+    if (name, n) not in _LUTS:
+        _LUTS[(name, n)] = np.round(colormap_colors(name, n)[:, :3] * 255).astype(np.uint8)
+    return _LUTS[(name, n)]
+
+
+def write_png(array, save, cmap='rainbow', vmin=None, vmax=None, bad=(255, 255, 255), rows_per_block=512, n=256):
+    """
+    This function writes a 2D array as a PNG through a colormap lookup table, without building a figure.
+
+    Parameters:
+    array: a 2D numpy (or masked) array. NaN, inf and masked values are drawn with the `bad` color.
+    save: output PNG path or binary file object.
+    cmap: name of a matplotlib colormap ('rainbow', 'brg', 'inferno', 'tab20', ...).
+    vmin, vmax: normalization limits, the array min/max when None.
+    bad: RGB color for invalid pixels.
+    rows_per_block: number of rows normalized at a time, bounding the float temporaries.
+    n: number of colors the colormap is resampled to (e.g. one per class of a class raster).
+
+    Returns:
+    vmin, vmax: the normalization limits used, for the colorbar sidecar.
+    """
+    data = np.ma.masked_invalid(array, copy=False)
+    vmin = float(data.min()) if vmin is None else vmin
+    vmax = float(data.max()) if vmax is None else vmax
+    scale = n / (vmax - vmin) if vmax > vmin else 0
+
+    lut = colormap_lut(cmap, n)
+    rgb = np.empty(data.shape + (3,), dtype=np.uint8)
+
+    for r0 in range(0, data.shape[0], rows_per_block):
+        block = data[r0:r0 + rows_per_block]
+        idx = (block.filled(vmin).astype(np.float32) - vmin) * scale
+        np.clip(idx, 0, n - 1, out=idx)
+        rgb[r0:r0 + rows_per_block] = lut[idx.astype(np.intp)]
+        rgb[r0:r0 + rows_per_block][np.ma.getmaskarray(block)] = bad
+
+    Image.fromarray(rgb, 'RGB').save(save, format='PNG', compress_level=1)
+    return vmin, vmax
+
+
+def write_colorbar(save, cmap, vmin, vmax, size=(1.2, 6), dpi=100):
+    """
+    This function writes a small colorbar sidecar image (path or binary file object) for a raster written with
+    `write_png`.
+    """
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    cax = fig.add_axes([0.1, 0.05, 0.3, 0.9])
+    fig.colorbar(ScalarMappable(Normalize(vmin, vmax), cmap=cmap), cax=cax)
+    fig.savefig(save, format='png', bbox_inches='tight', dpi=dpi)
+    return save
+
+
+def write_legend(save, legend, dpi=100):
+    """
+    This function writes a small legend sidecar image (path or binary file object) from a list of (label, color).
+    """
+    fig = Figure(figsize=(2, 0.3 * len(legend) + 0.4))
+    FigureCanvasAgg(fig)
+    patches = [Patch(color=color, label=label) for label, color in legend]
+    fig.legend(handles=patches, loc='center')
+    fig.savefig(save, format='png', bbox_inches='tight', dpi=dpi)
+    return save
+
+
+def _encoded(write, *args, **kwargs):
+    # Run a writer into memory: PNG bytes and pixel size (read from the header, nothing is decoded)
+    buffer = io.BytesIO()
+    write(buffer, *args, **kwargs)
+    data = buffer.getvalue()
+    return {'image': data, 'size': Image.open(io.BytesIO(data)).size}
+
+
+def classes(array, levels):
+    """
+    This function maps a class raster to the position of every pixel's value in `levels` (float, NaN kept).
+    Masked values (and levels) become NaN.
+    """
+    array = np.ma.filled(np.ma.asarray(array, dtype=float), np.nan)
+    levels = np.ma.filled(np.ma.asarray(levels, dtype=float), np.nan)
+    return np.where(np.isfinite(array), np.searchsorted(levels, array), np.nan)
+
+
+def render_fast(job):
+    """
+    This function encodes a job as a plain raster through `write_png`, plus its colorbar or legend sidecar.
+
+    Parameters:
+    job: a job dictionary as accepted by `render_figure`. 'title', 'axis' and 'aspect' are not drawn.
+         3-band arrays (RGB composites in the 0-1 range) are written as they are.
+
+    Returns:
+    product: a dictionary with the PNG 'image' bytes, its 'size' (width, height) and the 'colorbar'/'legend' sidecars
+             (same form, None when absent).
+    """
+    product = {'colorbar': None, 'legend': None}
+
+    if np.ndim(job['array']) == 3:
+        rgb = np.clip(np.nan_to_num(job['array']) * 255, 0, 255).astype(np.uint8)
+        product.update(_encoded(lambda f: Image.fromarray(rgb, 'RGB').save(f, format='PNG', compress_level=1)))
+        return product
+
+    cmap = job.get('cmap') or 'viridis'
+    limits = []
+    if job.get('levels') is not None:
+        n = len(job['levels'])
+        ids = classes(job['array'], job['levels'])
+        product.update(_encoded(lambda f: write_png(ids, f, cmap=cmap, vmin=-0.5, vmax=n - 0.5, n=n)))
+    else:
+        product.update(_encoded(lambda f: limits.extend(write_png(job['array'], f, cmap=cmap))))
+
+    if job.get('colorbar'):
+        product['colorbar'] = _encoded(write_colorbar, cmap, *limits)
+    if job.get('legend'):
+        product['legend'] = _encoded(write_legend, job['legend'])
+
+    return product
+
+
+def render_figure(job, figsize=(35,35), dpi=None):
+    """
+    This function draws a single array to an image.
+
+    Parameters:
+    job: a dictionary with the 'array' to draw and the 'save' path, and optionally 'title', 'cmap', 'axis',
+         'colorbar' (True/False), 'legend' (list of (label, color)), 'levels' (the sorted class values of a class
+         raster, drawn with one color of `cmap` per level), 'aspect' and 'figsize'.
+    figsize: figure size in inches, used when the job does not set its own.
+    dpi: output resolution, the matplotlib default when None.
+
+    Returns:
+    product: a dictionary with the PNG 'image' bytes and its 'size' (width, height), as `render_fast`.
+    """
+    fig = Figure(figsize=job.get('figsize') or figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+
+    if job.get('levels') is not None:
+        n = len(job['levels'])
+        cmap = ListedColormap(colormap_colors(job.get('cmap') or 'viridis', n))
+        im = ax.imshow(classes(job['array'], job['levels']), cmap=cmap, vmin=-0.5, vmax=n - 0.5, aspect=job.get('aspect'))
+    else:
+        im = ax.imshow(job['array'], cmap=job.get('cmap'), aspect=job.get('aspect'))
+    if job.get('title'):
+        ax.set_title(job['title'])
+    ax.axis(job.get('axis', 'off'))
+    if job.get('colorbar'):
+        fig.colorbar(im, ax=ax, fraction=0.046, pad=0.01)
+    if job.get('legend'):
+        patches = [Patch(color=color, label=label) for label, color in job['legend']]
+        ax.legend(handles=patches, loc='upper left', bbox_to_anchor=(1, 1))
+
+    product = _encoded(fig.savefig, format='png', bbox_inches='tight', dpi=dpi or 'figure')
+    return {**product, 'colorbar': None, 'legend': None}
+
+
+def save_product(product, save):
+    """
+    This function writes an in-memory product to disk: the image at `save`, sidecars as '<name>_colorbar.png' and
+    '<name>_legend.png'.
+    """
+    stem = os.path.splitext(save)[0]
+    for path, part in [(save, product), (stem + '_colorbar.png', product.get('colorbar')), (stem + '_legend.png', product.get('legend'))]:
+        if part:
+            with open(path, 'wb') as f:
+                f.write(part['image'])
+    return save
+
+
+def render_job(job, figsize=(35,35), dpi=None):
+    """
+    This function renders one job, through the colormap fast path when the job sets 'fast', and writes it to
+    job['save'] when set.
+
+    Returns:
+    result: the product dictionary when the job sets 'memory' (with its 'path', None if not written), the path
+            otherwise.
+    """
+    product = render_fast(job) if job.get('fast') else render_figure(job, figsize, dpi)
+    product['path'] = save_product(product, job['save']) if job.get('save') else None
+    return product if job.get('memory') else product['path']
+
+
+def render(jobs, workers=None, figsize=(35,35), dpi=None):
+    """
+    This function renders a list of jobs in parallel across a process pool.
+
+    Parameters:
+    jobs: a list of job dictionaries accepted by `render_figure` ('fast': True for the colormap fast path,
+          'memory': True to get the encoded product back, 'save': None to skip the file).
+    workers: number of worker processes, the number of cores when None. 1 renders serially.
+             The pool is started on the first call and reused by the later ones with the same number of workers.
+    figsize: figure size in inches for jobs that do not set their own.
+    dpi: output resolution, the matplotlib default when None.
+
+    Returns:
+    results: the written image paths (or products for 'memory' jobs), in the order of `jobs`.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [render_job(job, figsize, dpi) for job in jobs]
+
+    pool = _pool(workers)
+    try:
+        return list(pool.map(render_job, jobs, repeat(figsize), repeat(dpi)))
+    except BrokenProcessPool:
+        # A worker died: the next call starts a fresh pool
+        with _pools_lock:
+            if _pools.get(workers) is pool:
+                del _pools[workers]
+        raise
+
+
+def _pool(workers):
+    # One pool per size, started on first use and kept for the life of the process: long-lived callers (the app's
+    # job workers) pay the worker start-up and imports once, not on every render
+    with _pools_lock:
+        if workers not in _pools:
+            # spawn: the caller may be running download threads alongside the renderer
+            ctx = multiprocessing.get_context('spawn')
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return _pools[workers]
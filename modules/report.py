@@ -0,0 +1,246 @@
+"""
+This Module has the functions related to building the PDF report. The pages are described by data (`PAGES`): the
+cover with the true color image, then one page per index with its title and description. Every product is resampled
+to the resolution it is drawn at on the page before it is embedded (LANCZOS, `EMIT_REPORT_DPI`, 150 by default), as
+JPEG or PNG (`EMIT_REPORT_FORMAT`, 'jpeg' by default, `EMIT_REPORT_QUALITY` 85). Images already at or below that
+resolution (e.g. small plain rasters from the fast renderer) are embedded as they are.
+
+Products are the in-memory images returned by `render.render` for 'memory' jobs (PNG bytes, size and sidecars) or
+PNG file paths, with their colorbar sidecar as '<name>_colorbar.png'.
+"""
+
+# Packages used
+import os
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+
+REPORT_DPI = int(os.environ.get('EMIT_REPORT_DPI', 150))
+REPORT_FORMAT = os.environ.get('EMIT_REPORT_FORMAT', 'jpeg').lower()
+REPORT_QUALITY = int(os.environ.get('EMIT_REPORT_QUALITY', 85))
+
+# Area (points) a product with a colorbar, or a small raster, is fitted to
+BOX = (480, 540)
+
+PAGES = [
+    {'product': 'rgb', 'scale': 0.21, 'cover': True},
+    {'product': 'ndvi', 'scale': 0.20, 'title': 'NDVI:', 'text': [
+        'NDVI, or Normalized Difference Vegetation Index, is an indicator used to assess the health and density',
+        'of vegetation in terrestrial areas from satellite and remote sensing data.',
+        'is commonly used in agriculture, ecology and environmental studies to monitor crop growth, forest health',
+        'and vegetation in general. It is especially useful in the early detection of drought, water stress and',
+        'changes in vegetation cover.']},
+    {'product': 'iron_oxide', 'scale': 0.20, 'title': 'Iron Oxide Index:', 'text': [
+        'Is a hyperspectral index used in the analysis of satellite or aerial imagery to identify the presence and',
+        "concentration of iron minerals on the earth's surface. These minerals include iron oxides such as hematite",
+        '(Fe2O3) and goethite (FeO(OH)), which are important in the mining industry because of their economic value.']},
+    {'product': 'alunite', 'scale': 0.20, 'title': 'AlOH:', 'text': [
+        'The aluminum hydroxylated (AlOH) absorption index is a hyperspectral index used in satellite or aerial image',
+        'analysis to detect the presence and concentration of minerals containing hydroxylated aluminum, such as ',
+        'kaolinite (a clay mineral) and alunite. These minerals are important in the mining industry and in geological',
+        'studies because of their relationship to geological processes and the formation of mineral deposits.']},
+    {'product': 'FEOOH', 'scale': 0.20, 'title': 'FEOOH:', 'text': [
+        'The Ferric Oxide-Oxyhydroxide Clay Index (FEOOH) is a hyperspectral index used in satellite or airborne image ',
+        'analysis to detect the presence and concentration of clay minerals containing ferric oxides and oxyhydroxides.',
+        'This index is particularly useful for identifying the presence of minerals such as goethite and hematite, which',
+        'are common iron minerals present in geological formations.']},
+    {'product': 'AAI', 'scale': 0.20, 'title': 'Clay Alteration Index:', 'text': [
+        'The Clay Alteration Index is a hyperspectral index used in satellite or airborne image analysis to identify',
+        'the presence and concentration of clay minerals in geological formations. Clay minerals are important indicators',
+        'of hydrothermal alteration and are often associated with mineral deposits and reservoirs.']},
+    {'product': 'AIS', 'scale': 0.20, 'title': 'Argillic and Sericitic Alteration Index:', 'text': [
+        'The Argillic and Sericite Alteration Index is a hyperspectral index used in satellite or aerial image analysis',
+        'to identify the presence and concentration of clay minerals and sericite in geological formations. Both clay',
+        'minerals and sericite are indicators of hydrothermal alteration processes and are often associated with mineral',
+        'deposits and reservoirs.']},
+    {'product': 'DOS', 'scale': 0.20, 'title': 'Deep Contour Iron Oxide Index:', 'text': [
+        'The Deep Contour Iron Oxide Index, is a hyperspectral index used in satellite or airborne image analysis to identify',
+        'the presence and concentration of iron oxides in geological formations. Iron oxides, such as hematite and goethite,',
+        'are important minerals for industry and can also be indicators of specific geological processes.']},
+]
+
+
+def _source(product, sidecar=None):
+    # (PNG bytes or path, size) of a product or of one of its sidecars, (None, None) when absent
+    if isinstance(product, dict):
+        part = product if sidecar is None else product.get(sidecar)
+        return (part['image'], part['size']) if part else (None, None)
+
+    path = product if sidecar is None else os.path.splitext(product)[0] + f'_{sidecar}.png'
+    if not os.path.isfile(path):
+        return None, None
+    with Image.open(path) as im:  # header only
+        return path, im.size
+
+
+def placement(size, colorbar_size, scale, box=BOX):
+    """
+    This function lays a product out on a letter page.
+
+    Parameters:
+    size: the product size in pixels (width, height).
+    colorbar_size: the colorbar sidecar size in pixels, None if there is none.
+    scale: points per pixel of a full size figure. Products with a colorbar, and rasters that would fill less than
+           half of the box, are fitted to the box instead.
+
+    Returns:
+    image, colorbar: the (x, y, width, height) rectangles in points, colorbar None when there is none.
+    """
+    width, height = letter
+    w, h = size
+
+    if colorbar_size:
+        scale = min(box[0] / w, box[1] / h)
+        cw, ch = colorbar_size
+        cscale = (h * scale) / ch
+        x = ((width-(w*scale)-(cw*cscale))//2)
+        y = ((height-(h*scale))//2)
+        return (x, y, w*scale, h*scale), (x+(w*scale)+5, y, cw*cscale, ch*cscale)
+
+    if w*scale < box[0]/2:
+        scale = min(box[0] / w, box[1] / h)
+    return (((width-(w*scale))//2), ((height-(h*scale))//2), w*scale, h*scale), None
+
+
+def resample(source, size, drawn, dpi=REPORT_DPI, fmt=REPORT_FORMAT, quality=REPORT_QUALITY):
+    """
+    This function prepares an image for embedding at the resolution it is drawn at.
+
+    Parameters:
+    source: PNG bytes or an image path.
+    size: the image size in pixels.
+    drawn: the drawn size in points (width, height).
+    dpi: target resolution on the page.
+    fmt: 'jpeg' or 'png'.
+    quality: JPEG quality.
+
+    Returns:
+    reader: a reportlab ImageReader.
+    """
+    if fmt not in ('jpeg', 'png'):
+        raise ValueError(f"Unknown report image format {fmt!r}, expected 'jpeg' or 'png'")
+
+    target = (max(1, round(drawn[0] * dpi / 72)), max(1, round(drawn[1] * dpi / 72)))
+    if size[0] <= target[0] and size[1] <= target[1]:
+        return ImageReader(BytesIO(source) if isinstance(source, bytes) else source)
+
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as im:
+        im = im.resize(target, Image.LANCZOS, reducing_gap=3.0)
+
+    # JPEG has no alpha: flatten on white, as the page behind
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGBA')
+        flat = Image.new('RGB', im.size, (255, 255, 255))
+        flat.paste(im, mask=im.getchannel('A'))
+        im = flat
+
+    # JPEG data is embedded as it is (DCT); reportlab deflates the pixels of anything else itself
+    if fmt == 'png':
+        return ImageReader(im)
+    buffer = BytesIO()
+    im.save(buffer, format='JPEG', quality=quality, optimize=True)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+
+def _page_images(product, page, dpi, fmt, quality):
+    # [(reader, rectangle)] of a page: the product, and its colorbar (always PNG, text and sharp edges)
+    source, size = _source(product)
+    colorbar, csize = _source(product, 'colorbar')
+    rect, crect = placement(size, csize, page['scale'])
+
+    images = [(resample(source, size, rect[2:], dpi, fmt, quality), rect)]
+    if colorbar is not None:
+        images.append((resample(colorbar, csize, crect[2:], dpi, 'png'), crect))
+    return images
+
+
+def _cover(can, name, bbox, image_date, zone, logo):
+
+    # Dibujar el rectángulo blanco de la cabecera
+    can.setStrokeColorRGB(1, 1, 1)
+    can.setFillColorRGB(1, 1, 1)
+    can.rect(-1, 720, 700, 150, fill=True, stroke=True)
+
+    can.setStrokeColorRGB(0, 0, 0)
+    can.setFillColorRGB(0, 0, 0)
+    can.line(0, 720, 600, 720)      # Horizontal
+    can.line(140, 790, 600, 790)    # Horizontal
+    can.line(140, 720, 140, 850)    # Vertical
+
+    can.setFont('Helvetica', 20)
+    can.drawString(150,810,"NASA SpaceApp Geology 2023")
+
+    can.setFont('Helvetica', 12)
+    p1,p2,p3,p4 = bbox
+    can.drawString(145,775,"Image Name:    " + name)
+    can.drawString(145,760,"Image Date Set: " + image_date)
+    can.drawString(145,745,f"Lat | Lon:  {p1} | {p2}")
+    can.setFont('Helvetica', 10)
+    can.drawString(145,730,"Zone: " + zone)
+    can.setFont('Helvetica', 12)
+
+    if logo is not None:
+        can.drawImage(logo, 20, 735, 100, 90)
+
+
+def _text(can, page):
+    can.setFont('Helvetica', 16)
+    can.drawString(40,770,page['title'])
+
+    can.setFont('Helvetica', 10)
+    text = can.beginText(40, 750)
+    for line in page['text']:
+        text.textLine(line)
+    can.drawText(text)
+
+
+def build(products, pdf_file, name, bbox, image_date, zone, pages=PAGES, logo='./Logo.png', dpi=None, fmt=None,
+          quality=None, workers=None):
+    """
+    This function writes the report.
+
+    Parameters:
+    products: a dictionary {product name: in-memory product or PNG path} with every product named in `pages`.
+    pdf_file: the output PDF path.
+    name, bbox, image_date, zone: the cover header (report name, bounding box, acquisition date, place name).
+    pages: the page spec, a list of {'product', 'scale', 'cover': True} or {'product', 'scale', 'title', 'text'}.
+    logo: the cover logo path, None for none.
+    dpi, fmt, quality: embedded image resolution, 'jpeg' or 'png' and JPEG quality (module defaults when None).
+    workers: resampling threads, one per page up to the number of cores when None.
+
+    Returns:
+    pdf_file: the written report path.
+    """
+    dpi, fmt, quality = dpi or REPORT_DPI, (fmt or REPORT_FORMAT).lower(), quality or REPORT_QUALITY
+    workers = workers or min(len(pages), os.cpu_count() or 1)
+
+    # Decoding, resampling and encoding run in PIL without the GIL: every page at once
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(lambda page: _page_images(products[page['product']], page, dpi, fmt, quality), pages))
+        if logo is not None:
+            _, size = _source(logo)
+            logo = resample(logo, size, (100, 90), dpi, 'png')
+
+    # Binary image streams: reportlab's default ASCII85 text encoding runs in pure Python and adds 25% to every
+    # image. The setting is global, so it is only changed while this report is written.
+    use_a85, rl_config.useA85 = rl_config.useA85, 0
+    try:
+        can = canvas.Canvas(pdf_file)
+        for page, placed in zip(pages, images):
+            for reader, rect in placed:
+                can.drawImage(reader, *rect)
+            if page.get('cover'):
+                _cover(can, name, bbox, image_date, zone, logo)
+            else:
+                _text(can, page)
+            can.showPage()
+        can.save()
+    finally:
+        rl_config.useA85 = use_a85
+
+    return pdf_file
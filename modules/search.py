@@ -0,0 +1,117 @@
+"""
+This Module has the functions related to searching EMIT granules in the Earthdata catalogue. Instead of walking
+backwards one month (and one round trip) at a time, the search issues one wide temporal query, or a few bounded
+ones going back in time, and picks the granule closest to the requested date locally.
+
+Results are memoized in a TTL cache keyed by product, bounding box and date window (EMIT_SEARCH_TTL seconds,
+15 minutes by default), so repeated and concurrent orders for the same area do not repeat the query.
+"""
+
+# Packages used
+import os
+import time
+import calendar
+import datetime
+import threading
+import earthaccess
+
+# EMIT data: 2022 - ongoing
+EMIT_START = datetime.date(2022, 8, 1)
+WINDOW_DAYS = 183
+SEARCH_TTL = int(os.environ.get('EMIT_SEARCH_TTL', 900))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def parse_date(value):
+    """
+    This function parses 'YYYY-M-D' dates as sent by the app, clamping the day to the month ('2023-02-30').
+    """
+    y, m, d = (int(x) for x in value.split('T')[0].split('-'))
+    return datetime.date(y, m, min(d, calendar.monthrange(y, m)[1]))
+
+
+def granule_time(granule):
+    """
+    This function returns the acquisition date of a granule from its UMM temporal extent.
+    """
+    extent = granule['umm']['TemporalExtent']
+    value = extent.get('RangeDateTime', {}).get('BeginningDateTime') or extent.get('SingleDateTime')
+    return parse_date(value)
+
+
+def search_window(short_nm, bx, start, end, count=500):
+    """
+    This function runs (or returns from the TTL cache) one catalogue query for a product, bbox and date window.
+
+    Returns:
+    results: the list of granules returned by earthaccess.
+    """
+    key = (short_nm, tuple(str(x) for x in bx), start.isoformat(), end.isoformat())
+    now = time.monotonic()
+
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and now - hit[0] < SEARCH_TTL:
+            return hit[1]
+
+    print('Search Image Date: ', start.isoformat(), '-', end.isoformat())
+    results = earthaccess.search_data(
+        short_name=short_nm,            # 'EMITL2ARFL' 'EMITL2BMIN'
+        cloud_hosted=True,
+        bounding_box=tuple(float(x) for x in bx),
+        temporal=(start.isoformat(), end.isoformat() + 'T23:59:59'),
+        count=count
+    )
+
+    with _cache_lock:
+        _cache[key] = (now, results)
+        for k in [k for k, v in _cache.items() if now - v[0] >= SEARCH_TTL]:
+            del _cache[k]
+
+    return results
+
+
+def closest(results, start, end):
+    """
+    This function picks the granule closest to the requested date, preferring those inside [start, end].
+    """
+    def rank(granule):
+        t = granule_time(granule)
+        return (not start <= t <= end, abs((t - start).days))
+
+    return min(results, key=rank) if results else None
+
+
+def closest_granule(short_nm, bx, date, window_days=WINDOW_DAYS):
+    """
+    This function finds the granule closest to a requested date range with as few catalogue queries as possible.
+
+    Parameters:
+    short_nm: the product short name ('EMITL2ARFL', 'EMITL2BMIN').
+    bx: the bounding box (lon_min, lat_min, lon_max, lat_max).
+    date: the requested (start, end) dates as strings.
+    window_days: length of each bounded query going back in time from the requested range.
+
+    Returns:
+    granule: the selected granule, None if EMIT has no data for the bbox up to the requested date.
+    acquired: its acquisition date ('YYYY-MM-DD').
+    """
+    start, end = parse_date(date[0]), parse_date(date[1])
+    if end < EMIT_START:
+        return None, None
+
+    # The first query covers the requested range plus one window before it; later ones step further back
+    window_end = end
+    window_start = max(start - datetime.timedelta(days=window_days), EMIT_START)
+
+    while True:
+        results = search_window(short_nm, bx, window_start, window_end)
+        if results:
+            granule = closest(results, start, end)
+            return granule, granule_time(granule).isoformat()
+        if window_start <= EMIT_START:
+            return None, None
+        window_end = window_start - datetime.timedelta(days=1)
+        window_start = max(window_end - datetime.timedelta(days=window_days), EMIT_START)
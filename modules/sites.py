@@ -0,0 +1,169 @@
+"""
+This Module has the functions related to batches of sites. Sites are read from a CSV or GeoJSON file and grouped by
+the EMIT granule covering them: the ground footprint of a selected granule (UMM GPolygons, or its bounding
+rectangle) is tested against every other site with a point-in-polygon check, so a granule is searched, downloaded
+and analysed once however many sites it covers. Per-site crops are then cut from the granule products through its
+spatial index (`emit_tools.spatial_index`).
+
+CSV columns: 'id' (or 'name'), 'lon' (or 'longitude'), 'lat' (or 'latitude'), optional 'start' and 'end' dates.
+GeoJSON: Point features, with the same optional properties.
+"""
+
+# Packages used
+import os
+import csv
+import json
+import numpy as np
+from modules import emit_tools
+
+# EMIT pixel size (degrees), to turn a crop half size in pixels into a search bounding box
+PIXEL = 0.000542
+
+
+def _field(row, *names):
+    for name in names:
+        if row.get(name) not in (None, ''):
+            return row[name]
+    return None
+
+
+def _site(i, ident, lon, lat, start, end, date, window):
+    if lon is None or lat is None:
+        raise ValueError(f'Site {ident or i} has no coordinates')
+    start, end = start or (date and date[0]), end or (date and date[1])
+    if not start or not end:
+        raise ValueError(f'Site {ident or i} has no date range and no default was given')
+
+    lon, lat = float(lon), float(lat)
+    d = window * PIXEL
+    return {'id': str(ident if ident not in (None, '') else i), 'lon': lon, 'lat': lat, 'date': (start, end),
+            'bbox': tuple(str(round(x, 6)) for x in (lon - d, lat - d, lon + d, lat + d))}
+
+
+def read_sites(path, date=None, window=100):
+    """
+    This function reads a list of sites from a CSV or GeoJSON file.
+
+    Parameters:
+    path: a .csv, .geojson or .json file.
+    date: default (start, end) dates for sites without their own.
+    window: half size of each site crop in ortho pixels (~60 m), used for the search bounding box.
+
+    Returns:
+    sites: a list of {'id', 'lon', 'lat', 'date': (start, end), 'bbox': (lon_min, lat_min, lon_max, lat_max)}.
+    """
+    sites = []
+
+    if os.path.splitext(path)[-1].lower() in ('.geojson', '.json'):
+        with open(path) as f:
+            data = json.load(f)
+        features = data['features'] if data.get('type') == 'FeatureCollection' else [data]
+        for i, feature in enumerate(features):
+            geometry, props = feature.get('geometry') or {}, feature.get('properties') or {}
+            if geometry.get('type') != 'Point':
+                raise ValueError(f"Site {i}: only Point geometries are supported, got {geometry.get('type')}")
+            lon, lat = geometry['coordinates'][:2]
+            ident = feature.get('id', _field(props, 'id', 'name'))
+            sites.append(_site(i, ident, lon, lat, _field(props, 'start'), _field(props, 'end'), date, window))
+    else:
+        with open(path, newline='') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                row = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
+                sites.append(_site(i, _field(row, 'id', 'name', 'site'), _field(row, 'lon', 'longitude', 'lng', 'x'),
+                                   _field(row, 'lat', 'latitude', 'y'), _field(row, 'start'), _field(row, 'end'),
+                                   date, window))
+
+    ids = [site['id'] for site in sites]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Site IDs must be unique')
+    return sites
+
+
+def footprint(granule):
+    """
+    This function returns the ground footprint of a granule from its UMM spatial extent.
+
+    Returns:
+    rings: a list of (N, 2) arrays of (lon, lat) polygon boundaries, empty when the granule has none.
+    """
+    geometry = granule['umm'].get('SpatialExtent', {}).get('HorizontalSpatialDomain', {}).get('Geometry', {})
+    rings = [np.array([(p['Longitude'], p['Latitude']) for p in polygon['Boundary']['Points']], dtype=float)
+             for polygon in geometry.get('GPolygons', [])]
+    for rect in geometry.get('BoundingRectangles', []):
+        w, s, e, n = (rect[k] for k in ('WestBoundingCoordinate', 'SouthBoundingCoordinate',
+                                        'EastBoundingCoordinate', 'NorthBoundingCoordinate'))
+        rings.append(np.array([(w, s), (e, s), (e, n), (w, n)], dtype=float))
+    return rings
+
+
+def contains(rings, lon, lat):
+    """
+    This function tests whether a point falls inside any of the footprint rings (even-odd rule).
+    """
+    for ring in rings:
+        inside = False
+        points = ring.tolist() if hasattr(ring, 'tolist') else ring
+        x0, y0 = points[-1]
+        for x1, y1 in points:
+            if (y0 > lat) != (y1 > lat) and lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+            x0, y0 = x1, y1
+        if inside:
+            return True
+    return False
+
+
+def group_sites(sites, find_granule):
+    """
+    This function groups sites by the granule covering them, searching only for sites no selected granule covers.
+
+    Parameters:
+    sites: the list from `read_sites`.
+    find_granule: a function(site) -> (granule, acquired date), (None, None) when there is none
+                  (e.g. search.closest_granule for the site bbox and dates).
+
+    Returns:
+    groups: a list of {'granule', 'acquired', 'sites'}, in search order.
+    missing: the sites with no granule.
+    """
+    groups, missing = [], []
+
+    for site in sites:
+        # A granule already selected for the same date range that covers the site is reused
+        group = next((g for g in groups if g['date'] == site['date'] and contains(g['footprint'], site['lon'], site['lat'])), None)
+        if group is None:
+            granule, acquired = find_granule(site)
+            if granule is None:
+                missing.append(site)
+                continue
+            granule_id = granule['umm'].get('GranuleUR')
+            group = next((g for g in groups if granule_id and g['granule']['umm'].get('GranuleUR') == granule_id), None)
+            if group is None:
+                group = {'granule': granule, 'acquired': acquired, 'date': site['date'], 'footprint': footprint(granule), 'sites': []}
+                groups.append(group)
+        group['sites'].append(site)
+
+    return groups, missing
+
+
+def crop(products, index, lon, lat, window=100):
+    """
+    This function cuts the raw window covering a square of ortho pixels around a site out of every product.
+
+    Parameters:
+    products: a dictionary of arrays (downtrack, crosstrack[, channels]), e.g. from `service.compute_indices`.
+    index: the granule spatial index from `emit_tools.spatial_index`.
+    lon, lat: the site (degrees).
+    window: half size of the square in ortho pixels.
+
+    Returns:
+    crops: a dictionary with the same keys, views of the products.
+    """
+    rows, cols = emit_tools.lookup_pixels(index, [(lon, lat)], window)
+    valid = rows >= 0
+    if not valid.any():
+        raise ValueError(f'Site ({lon}, {lat}) has no valid pixels in the granule')
+
+    r0, r1 = rows[valid].min(), rows[valid].max() + 1
+    c0, c1 = cols[valid].min(), cols[valid].max() + 1
+    return {name: array[r0:r1, c0:c1] for name, array in products.items()}
@@ -0,0 +1,271 @@
+"""
+This Module has the functions related to instrumenting the processing pipeline. A job opens a Trace; every stage
+runs in a span that records its wall time, bytes read from storage, bytes downloaded and peak memory, together with
+the job attributes (bbox, dates) and the granule it works on. Spans are written as JSON lines, one file per job
+('<EMIT_TRACE_DIR>/<job_id>.jsonl', './data/traces' by default); only the most recent EMIT_TRACE_KEEP files (1000 by
+default) are kept. Stage timings add up the spans of the same name (e.g. one 'search' per site of a batch).
+
+Code deeper in the pipeline (service.py) opens spans and annotates them through the module functions `span` and
+`annotate`, which find the trace active in the current thread and do nothing when there is none.
+
+`Metrics` aggregates finished jobs on the server side (throughput, stage latency histograms) for the metrics endpoint.
+
+Notes: bytes read ('/proc/self/io') and memory ('/proc/self/statm', sampled every 50 ms) are per process, so spans
+running at the same time (the L2B download during the analysis) share them, and render worker processes are not
+included.
+"""
+
+# Packages used
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+TRACE_DIR = os.environ.get('EMIT_TRACE_DIR', './data/traces')
+TRACE_KEEP = int(os.environ.get('EMIT_TRACE_KEEP', 1000))
+SAMPLE_SECONDS = 0.05
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf'))
+
+_local = threading.local()
+
+
+def _rss_mb():
+    # Current resident memory of this process
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _read_bytes():
+    # Bytes this process has read from storage, None where not available
+    try:
+        with open('/proc/self/io') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('read_bytes'))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+def prune(trace_dir=TRACE_DIR, keep=TRACE_KEEP):
+    """
+    This function removes the oldest trace files of a directory, keeping the `keep` most recent.
+    """
+    try:
+        entries = [e for e in os.scandir(trace_dir) if e.name.endswith('.jsonl') and e.is_file()]
+    except OSError:
+        return
+    if len(entries) <= keep:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - keep]:
+        try:
+            os.remove(entry.path)
+        except OSError:  # removed by another job
+            pass
+
+
+class Trace:
+    """
+    The spans of one job, appended as JSON lines to '<trace_dir>/<job_id>.jsonl'.
+
+    Parameters:
+    job_id: the job ID (the JobQueue ID), a new one when None.
+    trace_dir: the directory of the JSON lines files, None to keep spans in memory only.
+    attrs: attributes written on every span (bbox, date, ...).
+    """
+
+    def __init__(self, job_id=None, trace_dir=TRACE_DIR, **attrs):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.attrs = attrs
+        self.spans = []
+        self.timings = {}
+        self.path = None
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+            prune(trace_dir)
+            self.path = os.path.join(trace_dir, self.job_id + '.jsonl')
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _sample(self):
+        # Peak memory of every open span
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                rss = _rss_mb()
+                for record in self._open:
+                    record['peak_rss_mb'] = max(record['peak_rss_mb'], rss)
+            time.sleep(SAMPLE_SECONDS)
+
+    def _write(self, record):
+        with self._lock:
+            self.spans.append(record)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def activate(self):
+        """
+        This function makes this trace the one `span`/`annotate` use in the current thread.
+        """
+        previous = getattr(_local, 'trace', None), getattr(_local, 'stack', None)
+        _local.trace, _local.stack = self, []
+        try:
+            yield self
+        finally:
+            _local.trace, _local.stack = previous
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        This function times a stage. The yielded record can be annotated (e.g. record['bytes_downloaded'] = n).
+        """
+        stack = getattr(_local, 'stack', None) if getattr(_local, 'trace', None) is self else None
+        record = {'job_id': self.job_id, 'span': name, 'parent': stack[-1]['span'] if stack else None,
+                  'start': time.time(), **self.attrs, **attrs, 'peak_rss_mb': _rss_mb()}
+        read0, start = _read_bytes(), time.perf_counter()
+
+        with self._lock:
+            self._open.append(record)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+        if stack is not None:
+            stack.append(record)
+
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'], record['error'] = 'error', f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            read1 = _read_bytes()
+            record['bytes_read'] = read1 - read0 if read0 is not None and read1 is not None else None
+            with self._lock:
+                self._open.remove(record)
+                record['peak_rss_mb'] = round(max(record['peak_rss_mb'], _rss_mb()), 1)
+                self.timings[name] = self.timings.get(name, 0) + record['seconds']
+            if stack is not None:
+                stack.remove(record)
+            self._write(record)
+
+    def traced(self, name, func, *args, **kwargs):
+        """
+        This function runs func(*args, **kwargs) in a span, with this trace active in the calling thread (pool
+        threads included).
+        """
+        with self.activate(), self.span(name):
+            return func(*args, **kwargs)
+
+
+def current():
+    """
+    This function returns the trace active in the current thread, None if there is none.
+    """
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    This function opens a span in the trace active in the current thread (a detached record when there is none).
+    """
+    trace = current()
+    if trace is None:
+        yield {'span': name, **attrs}
+        return
+    with trace.span(name, **attrs) as record:
+        yield record
+
+
+def annotate(**attrs):
+    """
+    This function adds attributes (granule_id, bytes_downloaded, ...) to the innermost open span of the current
+    thread. Numeric values are added up when the attribute is already set.
+    """
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    record = stack[-1]
+    for key, value in attrs.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(record.get(key), (int, float)):
+            record[key] += value
+        else:
+            record[key] = value
+
+
+class Metrics:
+    """
+    Server side aggregate of finished jobs: counts, throughput over a sliding window and latency histograms per stage.
+
+    Parameters:
+    window: seconds of history used for the throughput.
+    """
+
+    def __init__(self, window=3600):
+        self.window = window
+        self.started = time.time()
+        self._finished = deque()
+        self._counts = {}
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """
+        This function adds one latency sample to the histogram of a stage.
+        """
+        with self._lock:
+            hist = self._stages.setdefault(stage, {'count': 0, 'sum': 0.0, 'buckets': [0] * len(BUCKETS)})
+            hist['count'] += 1
+            hist['sum'] += seconds
+            hist['buckets'][next(i for i, le in enumerate(BUCKETS) if seconds <= le)] += 1
+
+    def job(self, status, finished, stages=()):
+        """
+        This function records a finished job and the latency of its stages, a list of (stage, seconds).
+        """
+        with self._lock:
+            self._counts[status] = self._counts.get(status, 0) + 1
+            self._finished.append((finished, status))
+        for stage, seconds in stages:
+            self.observe(stage, seconds)
+
+    def snapshot(self, **gauges):
+        """
+        This function returns the metrics as a JSON-able dictionary, plus any current gauges (queue depth, ...).
+        Histogram buckets are cumulative, keyed by their upper bound in seconds.
+        """
+        now = time.time()
+        with self._lock:
+            while self._finished and now - self._finished[0][0] > self.window:
+                self._finished.popleft()
+            recent = sum(status == 'done' for _, status in self._finished)
+            minutes = max(min(self.window, now - self.started), 60) / 60
+
+            stages = {}
+            for stage, hist in self._stages.items():
+                cumulative, buckets = 0, {}
+                for le, n in zip(BUCKETS, hist['buckets']):
+                    cumulative += n
+                    buckets['+Inf' if le == float('inf') else str(le)] = cumulative
+                stages[stage] = {'count': hist['count'], 'sum': round(hist['sum'], 3),
+                                 'mean': round(hist['sum'] / hist['count'], 3), 'buckets': buckets}
+
+            return {'uptime_s': round(now - self.started, 1),
+                    'jobs': dict(self._counts),
+                    'throughput_per_min': round(recent / minutes, 3),
+                    **gauges,
+                    'stages': stages}
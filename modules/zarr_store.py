@@ -0,0 +1,169 @@
+"""
+This Module has the functions related to the optional Zarr ingest of downloaded EMIT granules. The NetCDF layout
+makes reading one band across the scene, or a few pixels across all bands, expensive; a granule can be converted
+once into a local chunked, compressed (Blosc zstd) Zarr store next to the file:
+
+    '<file>.bands.zarr'  band-major chunks (128 rows x full width x 1 band), for index computation.
+    '<file>.tiles.zarr'  spatial tiles (64 x 64 pixels x all bands), for windows and spectrum extraction.
+
+Readers (`emit_tools.emit_xarray`, `emit_tools.ortho_window`, `emit_tools.extract_spectra`, `bands.read_bands`)
+use a store transparently when it exists and is newer than the NetCDF file. Groups, attributes, fill values and
+encodings are copied as is, so the store decodes like the original file.
+
+Configuration: EMIT_ZARR, a comma separated list of layouts to build after each download (e.g. 'bands,tiles',
+empty by default). The 'zarr' package is only needed when stores are built or read.
+"""
+
+# Packages used
+import os
+import shutil
+import threading
+import numpy as np
+import netCDF4 as nc
+import xarray as xr
+
+LAYOUTS = [x for x in os.environ.get('EMIT_ZARR', '').replace(' ', '').split(',') if x]
+
+# Chunk rows and columns of 2D/3D variables for each layout (None = full extent)
+CHUNKS = {'bands': (128, None, 1), 'tiles': (64, 64, None)}
+
+
+def store_path(filepath, layout='bands'):
+    """
+    This function returns where the Zarr store of a granule file lives.
+    """
+    if layout not in CHUNKS:
+        raise ValueError(f'Unknown Zarr layout {layout!r}, expected one of {list(CHUNKS)}')
+    return f'{filepath}.{layout}.zarr'
+
+
+def find(filepath, prefer=('bands', 'tiles')):
+    """
+    This function returns the first existing, up to date store of a granule file in order of preference.
+
+    Returns:
+    path: the store path, None if there is none (or filepath is not a local file).
+    """
+    if not isinstance(filepath, str) or not os.path.isfile(filepath):
+        return None
+    for layout in prefer:
+        path = store_path(filepath, layout)
+        if os.path.isdir(path) and os.path.getmtime(path) >= os.path.getmtime(filepath):
+            return path
+    return None
+
+
+def open_dataset(filepath, group=None, prefer=('bands', 'tiles'), engine='netcdf4'):
+    """
+    This function opens a granule group with xarray, from its Zarr store if there is one, from the file otherwise.
+    """
+    store = find(filepath, prefer)
+    if store:
+        return xr.open_dataset(store, engine='zarr', group=group, consolidated=True)
+    return xr.open_dataset(filepath, engine=engine, group=group)
+
+
+def _attr(value):
+    # netCDF attributes as JSON values
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _chunks(shape, layout):
+    if len(shape) < 2:
+        return shape or None
+    chunks = [c or n for c, n in zip(CHUNKS[layout], shape)] + list(shape[3:])
+    return tuple(min(c, n) for c, n in zip(chunks, shape))
+
+
+def _copy_group(src, dst, layout, compressor, codec):
+    dst.attrs.update({k: _attr(src.getncattr(k)) for k in src.ncattrs()})
+
+    for name, var in src.variables.items():
+        var.set_auto_maskandscale(False)
+        attrs = {k: _attr(var.getncattr(k)) for k in var.ncattrs() if k != '_FillValue'}
+        fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+        strings = var.dtype is str
+        chunks = _chunks(var.shape, layout)
+
+        arr = dst.create_dataset(name, shape=var.shape, chunks=chunks, dtype=object if strings else var.dtype,
+                                 compressor=compressor, object_codec=codec if strings else None,
+                                 fill_value=None if strings else _attr(fill), overwrite=True)
+        arr.attrs.update({'_ARRAY_DIMENSIONS': list(var.dimensions), **attrs})
+
+        # Whole chunk rows at a time: every write fills complete chunks, memory stays at one block
+        if var.ndim >= 2:
+            for r0 in range(0, var.shape[0], chunks[0]):
+                arr[r0:r0 + chunks[0]] = var[r0:r0 + chunks[0]]
+        elif var.ndim == 1:
+            arr[:] = var[:]
+        else:
+            arr[...] = var.getValue()
+
+    for name, group in src.groups.items():
+        _copy_group(group, dst.create_group(name), layout, compressor, codec)
+
+
+def to_zarr(filepath, layout='bands', clevel=3, overwrite=False):
+    """
+    This function converts an EMIT netCDF granule (every group) into a chunked, compressed Zarr store, once.
+
+    Parameters:
+    filepath: a filepath to an EMIT netCDF file.
+    layout: 'bands' (band-major chunks) or 'tiles' (spatial tiles with all bands).
+    clevel: zstd compression level.
+    overwrite: rebuild the store even if it is up to date.
+
+    Returns:
+    path: the store path.
+    """
+    import zarr
+    from numcodecs import Blosc, VLenUTF8
+
+    path = store_path(filepath, layout)
+    if not overwrite and find(filepath, (layout,)):
+        return path
+
+    # Built aside and renamed into place, so readers never see a partial store
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    compressor = Blosc(cname='zstd', clevel=clevel, shuffle=Blosc.SHUFFLE)
+
+    with nc.Dataset(filepath) as src:
+        root = zarr.open_group(tmp, mode='w')
+        _copy_group(src, root, layout, compressor, VLenUTF8())
+    zarr.consolidate_metadata(tmp)
+
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:  # another process renamed its copy first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def ingest(filepath, layouts=None):
+    """
+    This function builds the configured stores (EMIT_ZARR) of a granule file, returns their paths.
+    """
+    return [to_zarr(filepath, layout) for layout in (LAYOUTS if layouts is None else layouts)]
+
+
+def link(filepath, dest):
+    """
+    This function makes the stores of a cached granule file visible next to `dest` (symbolic links).
+    """
+    for layout in CHUNKS:
+        store = store_path(filepath, layout)
+        target = store_path(dest, layout)
+        if os.path.abspath(store) == os.path.abspath(target) or not os.path.isdir(store):
+            continue
+        if os.path.lexists(target):
+            if os.path.islink(target):
+                os.remove(target)
+            else:
+                shutil.rmtree(target)
+        os.symlink(os.path.abspath(store), target)
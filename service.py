@@ -3,15 +3,9 @@ import netCDF4 as nc
 import os
 import numpy as np
 import xarray as xr
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
-from skimage import exposure
-import time
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-import reverse_geocoder as rg
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+import threading
+import requests
+from modules import bands, download, footprints, geocode, granule_cache, indices, render, report, search, tracing, zarr_store
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -19,305 +13,231 @@ warnings.filterwarnings("ignore")
 
 
 
-def download_data_EMIT(user, password, bx, date, short_nm):
+# Earthdata logins and HTTP sessions, one per set of credentials, shared by concurrent downloads
+_auth = {}
+_sessions = {}
+_auth_lock = threading.Lock()
 
-    # Set User and Pass
-    os.environ['EARTHDATA_USERNAME'] = user
-    os.environ['EARTHDATA_PASSWORD'] = password
+def login(user, password):
 
-    auth = earthaccess.login()
+    # Credentials checked once against Earthdata login; only successful logins are kept. Every login is its own
+    # earthaccess.Auth, the process-wide earthaccess login is left alone (the catalogue search is public), so
+    # concurrent orders never act with each other's credentials.
+    key = (user, password)
+    with _auth_lock:
+        if key not in _auth:
+            # Set User and Pass (only for this login)
+            previous = {k: os.environ.get(k) for k in ('EARTHDATA_USERNAME', 'EARTHDATA_PASSWORD')}
+            os.environ['EARTHDATA_USERNAME'] = user
+            os.environ['EARTHDATA_PASSWORD'] = password
+            try:
+                auth = earthaccess.Auth().login(strategy='environment')
+            except Exception as e:
+                raise PermissionError(f'Earthdata login failed for user {user}: {e}') from e
+            finally:
+                for k, v in previous.items():
+                    if v is None:
+                        os.environ.pop(k, None)
+                    else:
+                        os.environ[k] = v
 
-    print('====================')
-    print('Searching Image EMIT')
-    print('====================')
+            if not auth.authenticated:
+                raise PermissionError(f'Earthdata login failed for user {user}: check the user name and password')
+            _auth[key] = auth
 
-    results = earthaccess.search_data(
-        short_name=short_nm,            # 'EMITL2ARFL' 'EMITL2BMIN'
-        cloud_hosted=True,
-        bounding_box=bx,
-        temporal=date,
-        count=10
-    )
+        return _auth[key]
 
-    y, m, d = date[0].split('-')
-    
-
-    if len(results) == 0:
-        while len(results) == 0 and int(y) != 2021: # EMIT dates: 2022 - ongoing
-
-            if int(m) == 1:
-                y = int(y) - 1
-                m = 12
-            else:
-                m = int(m) - 1
-            date = (str(y) + '-' + str(m) + '-' + d, date[1])
-            print('Search Image Date: ',date[0])
-
-
-            results = earthaccess.search_data(
-                short_name=short_nm,
-                cloud_hosted=True,
-                bounding_box=bx,
-                temporal=date,
-                count=10
-            )
-    
-    a,b,c,d = bx
-    folder = 'LAT'+str(a)+'_LON'+str(b)
-    folder = folder.replace('.','')
-    os.makedirs('./data/'+folder, exist_ok=True)
-            
-    # Downloading...
-    url = (results[0]['umm']['RelatedUrls'][1]['URL'])
-    name_file = url[url.rfind("/")+1:] if "/" in url else url
-    print('=================================================================')
-    print(f"EMIT Downloading: {name_file}")
-    print('=================================================================')
-    os.system(f'curl --user {user}:{password} -o ./data/{folder}/{name_file} -O -b ~/.urs_cookies -c ~/.urs_cookies -L -n {url}')
 
-    return folder, name_file, date[0]
 
+def download_session(user, password):
 
+    # Pooled HTTP session, one per set of credentials, reused by every download
+    key = (user, password)
+    with _auth_lock:
+        if key not in _sessions:
+            _sessions[key] = download.session(user, password)
+        return _sessions[key]
 
 
-def analysis(path, save_path):
 
-    print('\nProccesing...\n')
+def drop_session(user, password):
 
-    refl = xr.open_dataset(path)
+    # Rejected credentials: the next download builds (and authenticates) a new session
+    with _auth_lock:
+        sess = _sessions.pop((user, password), None)
+    if sess is not None:
+        sess.close()
 
-    wvl = xr.open_dataset(path,group='sensor_band_parameters')
 
-    # This will utilize the wvl dataset dictionary as the ds coordinates dictionary
-    ds = refl.assign_coords({'downtrack':(['downtrack'], refl.downtrack.data),'crosstrack':(['crosstrack'],refl.crosstrack.data), **wvl.variables})
 
-    # ====================== RGB =========================
-    print('RGB Image...')
-    r = np.nanargmin(abs(ds['wavelengths'].values-620)) # 620
-    g = np.nanargmin(abs(ds['wavelengths'].values-550)) # 590
-    b = np.nanargmin(abs(ds['wavelengths'].values-450)) # 450
+def granule_file_info(granule, name_file):
 
-    r = ds.sel(bands=r)['reflectance'].values
-    g = ds.sel(bands=g)['reflectance'].values
-    b = ds.sel(bands=b)['reflectance'].values
+    # Expected size and checksum of a granule file, from its UMM metadata
+    files = granule['umm'].get('DataGranule', {}).get('ArchiveAndDistributionInformation', [])
+    info = next((f for f in files if f.get('Name') == name_file), {})
+    checksum = info.get('Checksum', {})
+    return info.get('SizeInBytes'), checksum.get('Value'), checksum.get('Algorithm', 'SHA-512')
 
-    # Scale the matrices to the range of 0-255
-    red_scaled = (r * 255 / np.max(r)).astype(np.uint8)
-    green_scaled = (g * 255 / np.max(g)).astype(np.uint8)
-    blue_scaled = (b * 255 / np.max(b)).astype(np.uint8)
 
-    # Merge the matrices into a single 3-band matrix
-    rgb = np.dstack((red_scaled, green_scaled, blue_scaled))
 
-    # Contrast
-    clip_limit = 0.02 
-    rgb = exposure.equalize_adapthist(rgb, clip_limit=clip_limit)
+def granule_file(granule):
 
-    save = os.path.join(save_path, 'rgb.png')
+    # Data URL, file name and cache key (granule ID) of a granule from the catalogue
+    url = (granule['umm']['RelatedUrls'][1]['URL'])
+    name_file = url[url.rfind("/")+1:] if "/" in url else url
+    return url, name_file, granule['umm'].get('GranuleUR', os.path.splitext(name_file)[0])
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(rgb)
-    plt.axis('off')
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
 
-    # ================== NDVI ======================
-    print('NDVI Image...')
-    b650 = np.nanargmin(abs(ds['wavelengths'].values-650)) 
-    b850 = np.nanargmin(abs(ds['wavelengths'].values-850)) 
 
-    data650 = ds.sel(bands=b650)['reflectance'].values
-    data850 = ds.sel(bands=b850)['reflectance'].values
+def download_granule(user, password, granule, folder, acquired=None):
 
-    # Calculate
-    ndvi = (data850 - data650) / (data850 + data650)
-    ndvi = np.clip(ndvi, 0, np.inf)
+    # Granule file through the shared cache, linked into ./data/<folder>
+    os.makedirs('./data/'+folder, exist_ok=True)
+            
+    # Downloading...
+    url, name_file, granule_id = granule_file(granule)
+    size, checksum, algorithm = granule_file_info(granule, name_file)
+    tracing.annotate(granule_id=granule_id)
+
+    def fetch(path):
+        print('=================================================================')
+        print(f"EMIT Downloading: {name_file}")
+        print('=================================================================')
+        with tracing.span('download', granule_id=granule_id):
+            try:
+                tracing.annotate(bytes_downloaded=download.download(url, path, sess=download_session(user, password),
+                                                                    size=size, checksum=checksum, algorithm=algorithm))
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in (401, 403):
+                    drop_session(user, password)
+                raise
+
+    # Shared granule cache first: no network I/O if any job already fetched this granule
+    cached, hit = granule_cache.fetch(granule_id, name_file, fetch)
+    tracing.annotate(cache_hit=hit)
+    if hit:
+        print(f"EMIT Cached: {name_file}")
+    # Footprint and date in the local index, so later requests for this area skip the catalogue
+    footprints.record(cached, granule, granule_id, name_file, acquired)
+    # Optional Zarr ingest (EMIT_ZARR), once per cached granule
+    zarr_store.ingest(cached)
+    granule_cache.link(cached, f'./data/{folder}/{name_file}')
+    zarr_store.link(cached, f'./data/{folder}/{name_file}')
+
+    return name_file
+
+
+
+def find_granule(user, password, bx, date, short_nm):
+
+    # A cached granule covering the area in the date range answers without the catalogue (nor the login)
+    with tracing.span('footprints', product=short_nm):
+        granule, date_image = footprints.covering(short_nm, bx, date)
+        tracing.annotate(footprint_hit=granule is not None)
+    if granule is not None:
+        print(f"EMIT Footprint cached: {granule['umm'].get('GranuleUR')}")
+        return granule, date_image
+
+    with tracing.span('login'):
+        auth = login(user, password)
 
-    save = os.path.join(save_path, 'ndvi.png')
+    print('====================')
+    print('Searching Image EMIT')
+    print('====================')
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(ndvi, cmap=plt.cm.brg)
-    plt.title('NDVI: Normalized Difference Vegetation Index')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
+    # One bounded temporal query (a few at most), granule closest to the requested date picked locally
+    with tracing.span('search', product=short_nm):
+        granule, date_image = search.closest_granule(short_nm, bx, date)
 
-    # ================== Iron Oxide Index ======================
-    print('Iron Oxide Image...')
-    r85 = np.nanargmin(abs(ds['wavelengths'].values-850)) 
-    r65 = np.nanargmin(abs(ds['wavelengths'].values-650))
+    # The same request is answered from the cache next time, once the granule is downloaded
+    if granule is not None:
+        _, name_file, granule_id = granule_file(granule)
+        footprints.remember(short_nm, bx, date, granule_id, name_file, date_image)
+    return granule, date_image
 
-    r85 = ds.sel(bands=r85)['reflectance'].values
-    r65 = ds.sel(bands=r65)['reflectance'].values
 
-    # Calculate
-    FeO = (r85 / r65)
-    FeO = np.clip(FeO, 0, np.inf)
 
-    save = os.path.join(save_path, 'iron_oxide.png')
+def download_data_EMIT(user, password, bx, date, short_nm):
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(FeO, cmap='rainbow')
-    plt.title('Iron Oxide Index')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
+    granule, date_image = find_granule(user, password, bx, date, short_nm)
+    if granule is None:
+        raise LookupError(f'No {short_nm} granule found for {bx} up to {date[1]}')
+    
+    a,b,c,d = bx
+    folder = 'LAT'+str(a)+'_LON'+str(b)
+    folder = folder.replace('.','')
+    tracing.annotate(acquired=date_image)
 
-    # ===================== AlOH ========================
-    print('AlOH Image...')
-    r22 = np.nanargmin(abs(ds['wavelengths'].values-2200))
-    r17 = np.nanargmin(abs(ds['wavelengths'].values-1700))
+    name_file = download_granule(user, password, granule, folder, date_image)
 
-    r22 = ds.sel(bands=r22)['reflectance'].values
-    r17 = ds.sel(bands=r17)['reflectance'].values
+    return folder, name_file, date_image
 
-    # Calculate
-    AlOH = (r22 / r17)
-    AlOH = np.clip(AlOH, 0, np.inf)
 
-    save = os.path.join(save_path, 'alunite.png')
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(AlOH, cmap='rainbow')
-    plt.title('AlOH Index')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
 
-    # ===================== FEOOH =======================
-    print('FEOOH Image...')
-    r97 = np.nanargmin(abs(ds['wavelengths'].values-970))
-    r90 = np.nanargmin(abs(ds['wavelengths'].values-900))
+def compute_indices(path, band_mask=None):
+    # Every registered index ({name: array (downtrack, crosstrack)}) from a single read of the bands they need
 
-    r97 = ds.sel(bands=r97)['reflectance'].values
-    r90 = ds.sel(bands=r90)['reflectance'].values
+    # Band plan: every wavelength used by the registered indices, resolved and read once
+    stack, lookup = bands.read_bands(path, indices.required_wavelengths(), band_mask=band_mask)
 
-    # Calculate
-    FeOOH = (r97 / r90)
-    FeOOH = np.clip(FeOOH, 0, np.inf)
+    # All indices in one fused pass over the band stack
+    return indices.evaluate(stack, lookup)
 
-    save = os.path.join(save_path, 'FEOOH.png')
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(FeOOH, cmap='rainbow')
-    plt.title('Ferric Oxide-Oxyhydroxide Clay Index (FEOOH)')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
 
-    # ===================== AAI =======================
-    print('AAI Image...')
-    r22 = np.nanargmin(abs(ds['wavelengths'].values-2200))
-    r21 = np.nanargmin(abs(ds['wavelengths'].values-2100))
+def product_jobs(products, save_path=None, fast=False):
+    # Render jobs of the products, returned in memory; also written to save_path when given
 
-    r22 = ds.sel(bands=r22)['reflectance'].values
-    r21 = ds.sel(bands=r21)['reflectance'].values
+    jobs = []
+    for spec in indices.INDICES:
+        print(spec['label'] + ' Image...')
 
-    # Calculate
-    AI = (r22 / r21)
-    AI = np.clip(AI, 0, np.inf)
+        jobs.append({'array': products[spec['name']],
+                     'save': os.path.join(save_path, spec['file']) if save_path else None,
+                     'memory': True,
+                     'title': spec['title'],
+                     'cmap': spec['cmap'],
+                     'axis': spec['axis'],
+                     'colorbar': spec['colorbar'],
+                     'fast': fast})
+    return jobs
 
-    save = os.path.join(save_path, 'AAI.png')
 
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(AI, cmap='rainbow')
-    plt.title('Argillic Alteration Index')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
 
-    # ===================== AIS ======================
-    print('AIS Image...')
-    r22 = np.nanargmin(abs(ds['wavelengths'].values-2200)) 
-    r23 = np.nanargmin(abs(ds['wavelengths'].values-2300))
+def analysis(path, save_path, workers=None, dpi=None, figsize=(35,35), fast=False, band_mask=None, persist=True):
+    # Returns the rendered products in memory ({name: PNG bytes, size, sidecars}), ready for create_pdf.
+    # persist=False keeps them off the disk.
 
-    r22 = ds.sel(bands=r22)['reflectance'].values
-    r23 = ds.sel(bands=r23)['reflectance'].values
+    print('\nProccesing...\n')
 
-    # Calculate
-    AIS = (r22 / r23)
-    AIS = np.clip(AIS, 0, np.inf)
+    products = compute_indices(path, band_mask=band_mask)
 
-    save = os.path.join(save_path, 'AIS.png')
+    jobs = product_jobs(products, save_path if persist else None, fast=fast)
 
     # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(AIS, cmap='rainbow')
-    plt.title('Argillic and Sericitic Alteration Index')
-    plt.axis('off')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
-
-    # =================== DOS-2 ====================
-    print('DOS-2 Image...')
-    r79 = np.nanargmin(abs(ds['wavelengths'].values-790)) 
-    r72 = np.nanargmin(abs(ds['wavelengths'].values-720)) 
-
-    r79 = ds.sel(bands=r79)['reflectance'].values
-    r72 = ds.sel(bands=r72)['reflectance'].values
+    rendered = render.render(jobs, workers=workers, figsize=figsize, dpi=dpi)
 
-    # Calculate
-    DOS2 = (r79 - r72)/(r79 + r72)
-    DOS2 = np.clip(DOS2, 0, np.inf)
-
-    save = os.path.join(save_path, 'DOS.png')
-
-    # Plot
-    plt.subplots(figsize=(35,35))
-    plt.imshow(DOS2, cmap='rainbow')
-    plt.title('Red Edge Position 3')
-    plt.axis('on')
-    plt.colorbar(fraction=0.046, pad=0.01)
-    plt.savefig(save, bbox_inches='tight')
-    plt.close()
+    return {spec['name']: product for spec, product in zip(indices.INDICES, rendered)}
 
 
 
 
 
 def region2(latitud, longitud):
-    coordenadas = (latitud, longitud)
-    resultados = rg.search(coordenadas)
-    
-    if resultados:
-        lugar = resultados[0]
-        return f"{lugar['name']} {lugar['admin1']} {lugar['cc']}"
-    else:
-        return "No se encontró información de ubicación para estas coordenadas."
+    # Offline nearest place, from the preloaded KD-tree
+    return geocode.lookup(latitud, longitud)
 
 def region(latitud, longitud):
-    geolocalizador = Nominatim(user_agent="mi_app2") 
-
-    try:
-        ubicacion = geolocalizador.reverse((latitud, longitud), language="es") 
-        if ubicacion:
-            return ubicacion.address
-        else:
-            return "No se encontró información de ubicación para estas coordenadas."
-    except GeocoderTimedOut:
-        print("Tiempo de espera agotado. Reintentando en 5 segundos...")
-        time.sleep(5)
-        return region(latitud, longitud)
-    except GeocoderServiceError as e:
-        print(f"Error en el servicio de geocodificación: {str(e)}")
-        ubicacion_2 = region2(latitud, longitud)
-        return ubicacion_2
+    # Nominatim address if it answers in time, offline nearest place otherwise
+    with tracing.span('geocode'):
+        return geocode.describe(latitud, longitud)
     
 
 
-def create_pdf(rgb, ndvi, ironO, alunite, FEOOH, AAI, AIS, DOS, name, folder, bbox, image_date):
+def create_pdf(rgb, ndvi, ironO, alunite, FEOOH, AAI, AIS, DOS, name, folder, bbox, image_date, dpi=None, fmt=None):
+    # Products are the in-memory images returned by analysis, or PNG paths (deleted once the report is written).
+    # Pages are described in modules/report.py; images are resampled to the page resolution (dpi) as JPEG or PNG (fmt).
 
     print('Generating Report...')
 
@@ -325,190 +245,17 @@ def create_pdf(rgb, ndvi, ironO, alunite, FEOOH, AAI, AIS, DOS, name, folder, bb
 
     pdf_file = './data/' + folder + '/' + name
 
-    can = canvas.Canvas(pdf_file)
-
-    # ==== IMAGEN ====
-    width, height = letter
-    imgr = plt.imread(rgb)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.21))//2)
-    y = ((height-(h*0.21))//2)
-    can.drawImage(rgb, x, y, w*0.21, h*0.21)
-    # ================
-
-    # Dibujar el rectángulo rojo
-    can.setStrokeColorRGB(1, 1, 1)  # Establecer color de contorno rojo (1, 0, 0)
-    can.setFillColorRGB(1, 1, 1)  # Establecer color de relleno rojo (1, 0, 0)
-    can.rect(-1, 720, 700, 150, fill=True, stroke=True)  # Rectángulo rojo
-    
-    can.setStrokeColorRGB(0, 0, 0)  # Establecer color de contorno
-    can.setFillColorRGB(0, 0, 0)    # Establecer color de relleno
-    can.line(0, 720, 600, 720)      # Horizontal
-    can.line(140, 790, 600, 790)    # Horizontal
-    can.line(140, 720, 140, 850)    # Vertical
-
-    # Para titulos asignamos una fuente y el tamaño = 20
-    can.setFont('Helvetica', 20)
-
-    # Dibujamos texto: (X,Y,Texto)
-    can.drawString(150,810,"NASA SpaceApp Geology 2023")
+    products = dict(zip(['rgb', 'ndvi', 'iron_oxide', 'alunite', 'FEOOH', 'AAI', 'AIS', 'DOS'],
+                        [rgb, ndvi, ironO, alunite, FEOOH, AAI, AIS, DOS]))
 
-    # Para parrafos normales cambiamos el tamaño a 12
-    can.setFont('Helvetica', 12)
-
-    # Dibujamos texto: (X,Y,Texto)
     p1,p2,p3,p4 = bbox
-    can.drawString(145,775,"Image Name:    " + name)
-    can.drawString(145,760,"Image Date Set: " + image_date)
-    can.drawString(145,745,f"Lat | Lon:  {p1} | {p2}")
     ubicacion = region(p2, p1)
-    can.setFont('Helvetica', 10)
-    can.drawString(145,730,"Zone: " + ubicacion)
-    can.setFont('Helvetica', 12)
 
-    # Dibujamos una imagen (IMAGEN, X,Y, WIDTH, HEIGH)
-    can.drawImage('./Logo.png', 20, 735, 100, 90)
-    can.showPage()
-    
-    # --- Page 2 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"NDVI:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine('NDVI, or Normalized Difference Vegetation Index, is an indicator used to assess the health and density')
-    text.textLine('of vegetation in terrestrial areas from satellite and remote sensing data.')
-    text.textLine('is commonly used in agriculture, ecology and environmental studies to monitor crop growth, forest health') 
-    text.textLine('and vegetation in general. It is especially useful in the early detection of drought, water stress and') 
-    text.textLine('changes in vegetation cover.')
-    can.drawText(text)
-
-    imgr = plt.imread(ndvi)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(ndvi, x, y, w*0.20, h*0.20)
-    can.showPage()
-    
-    # --- Page 3 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"Iron Oxide Index:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("Is a hyperspectral index used in the analysis of satellite or aerial imagery to identify the presence and") 
-    text.textLine("concentration of iron minerals on the earth's surface. These minerals include iron oxides such as hematite") 
-    text.textLine("(Fe2O3) and goethite (FeO(OH)), which are important in the mining industry because of their economic value.")
-    can.drawText(text)
-
-    imgr = plt.imread(ironO)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(ironO, x, y, w*0.20, h*0.20)
-    can.showPage()
-
-    # --- Page 4 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"AlOH:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("The aluminum hydroxylated (AlOH) absorption index is a hyperspectral index used in satellite or aerial image") 
-    text.textLine("analysis to detect the presence and concentration of minerals containing hydroxylated aluminum, such as ")
-    text.textLine("kaolinite (a clay mineral) and alunite. These minerals are important in the mining industry and in geological") 
-    text.textLine("studies because of their relationship to geological processes and the formation of mineral deposits.") 
-    can.drawText(text)
-
-    imgr = plt.imread(alunite)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(alunite, x, y, w*0.20, h*0.20)
-    can.showPage()
-
-    # --- Page 5 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"FEOOH:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("The Ferric Oxide-Oxyhydroxide Clay Index (FEOOH) is a hyperspectral index used in satellite or airborne image ")
-    text.textLine("analysis to detect the presence and concentration of clay minerals containing ferric oxides and oxyhydroxides.") 
-    text.textLine("This index is particularly useful for identifying the presence of minerals such as goethite and hematite, which")
-    text.textLine("are common iron minerals present in geological formations.") 
-    can.drawText(text)
-
-    imgr = plt.imread(FEOOH)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(FEOOH, x, y, w*0.20, h*0.20)
-    can.showPage()
-
-    # --- Page 6 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"Clay Alteration Index:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("The Clay Alteration Index is a hyperspectral index used in satellite or airborne image analysis to identify") 
-    text.textLine("the presence and concentration of clay minerals in geological formations. Clay minerals are important indicators") 
-    text.textLine("of hydrothermal alteration and are often associated with mineral deposits and reservoirs.")
-    can.drawText(text)
-
-    imgr = plt.imread(AAI)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(AAI, x, y, w*0.20, h*0.20)
-    can.showPage()
-
-    # --- Page 7 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"Argillic and Sericitic Alteration Index:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("The Argillic and Sericite Alteration Index is a hyperspectral index used in satellite or aerial image analysis") 
-    text.textLine("to identify the presence and concentration of clay minerals and sericite in geological formations. Both clay") 
-    text.textLine("minerals and sericite are indicators of hydrothermal alteration processes and are often associated with mineral") 
-    text.textLine("deposits and reservoirs.") 
-    can.drawText(text)
-
-    imgr = plt.imread(AIS)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(AIS, x, y, w*0.20, h*0.20)
-    can.showPage()
-
-    # --- Page 8 ---
-    can.setFont('Helvetica', 16)
-    can.drawString(40,770,"Deep Contour Iron Oxide Index:")
-
-    can.setFont('Helvetica', 10)
-    text = can.beginText(40, 750)
-
-    text.textLine("The Deep Contour Iron Oxide Index, is a hyperspectral index used in satellite or airborne image analysis to identify") 
-    text.textLine("the presence and concentration of iron oxides in geological formations. Iron oxides, such as hematite and goethite,") 
-    text.textLine("are important minerals for industry and can also be indicators of specific geological processes.") 
-    can.drawText(text)
-
-    imgr = plt.imread(DOS)
-    h, w, _ = imgr.shape
-    x = ((width-(w*0.20))//2)
-    y = ((height-(h*0.20))//2)
-    can.drawImage(DOS, x, y, w*0.20, h*0.20)
-    can.showPage()
- 
-    can.save()
+    report.build(products, pdf_file, name, bbox, image_date, ubicacion, dpi=dpi, fmt=fmt)
+
+    # In-memory products: nothing was written for the report, persisted images are kept
+    if all(isinstance(p, dict) for p in products.values()):
+        return
 
     # Delete files
     ruta = './data/' + folder
@@ -523,51 +270,36 @@ def create_pdf(rgb, ndvi, ironO, alunite, FEOOH, AAI, AIS, DOS, name, folder, bb
  
 
 
-def mineral_data(group_band_1, group_id_1, group_band_2, group_id_2, folder, name_img_mineral):
+def mineral_data(group_band_1, group_id_1, group_band_2, group_id_2, folder, name_img_mineral, workers=None, dpi=None, figsize=(30,30), fast=False):
 
     print('Masking Data Image...')
 
     folder = os.path.join('./data',folder)
 
-    for i in range(2):
-        if i == 0:
-            group_id_1 = group_id_1
-            group_band_1 = group_band_1
-            name_band = folder + '/' + name_img_mineral + '_group_1_band_depth.png'
-            name_id = folder + '/' + name_img_mineral + '_group_1_mineral_id.png'
-        else:
-            group_id_1 = group_id_2
-            group_band_1 = group_band_2
-            name_band = folder + '/' + name_img_mineral + '_group_2_band_depth.png'
-            name_id = folder + '/' + name_img_mineral + '_group_2_mineral_id.png'
+    jobs, layers = [], []
+    for i, (group_band, group_id) in enumerate([(group_band_1, group_id_1), (group_band_2, group_id_2)], start=1):
+        name_band = folder + '/' + name_img_mineral + f'_group_{i}_band_depth.png'
+        name_id = folder + '/' + name_img_mineral + f'_group_{i}_mineral_id.png'
 
         # ====== ID ======
         # Obtiene los valores únicos de la matriz y sus colores correspondientes
-        valores_unicos = np.unique(group_id_1)
-        colores = plt.cm.get_cmap('tab20', len(valores_unicos))
-
-        # Crea una lista de parches y etiquetas para la leyenda
-        patches = []
-        labels = []
+        valores_unicos = np.unique(group_id)
+        colores = render.colormap_colors('tab20', len(valores_unicos))
 
-        for valor, color in zip(valores_unicos, colores(np.arange(len(valores_unicos)))):
-            # Crea un parche cuadrado con el color correspondiente
-            square = Patch(color=color, label=str(valor))
-            patches.append(square)
-            labels.append(str(valor))
+        # Crea una lista de etiquetas y colores para la leyenda
+        legend = [(str(valor), color) for valor, color in zip(valores_unicos, colores)]
 
         # Plotea la matriz como una imagen y ajusta el aspecto para que los cuadrados sean cuadrados
-        plt.subplots(figsize=(30,30))
-        plt.imshow(group_id_1, cmap='tab20', aspect='equal')
-        plt.legend(handles=patches, labels=labels, loc='upper left', bbox_to_anchor=(1, 1))
-        plt.axis('off')
-        plt.savefig(name_id, bbox_inches='tight')
-        plt.close()
+        # Drawn by class with the same colors as the legend
+        jobs.append({'array': group_id, 'save': name_id, 'cmap': 'tab20', 'levels': valores_unicos, 'aspect': 'equal', 'legend': legend, 'fast': fast})
+        layers.append(f'group_{i}_mineral_id')
 
         # ====== BAND ======
-        # Plot
-        plt.subplots(figsize=(30,30))
-        plt.imshow(group_band_1, cmap='inferno')
-        plt.axis('off')
-        plt.savefig(name_band, bbox_inches='tight')
-        plt.close()
\ No newline at end of file
+        jobs.append({'array': group_band, 'save': name_band, 'cmap': 'inferno', 'fast': fast})
+        layers.append(f'group_{i}_band_depth')
+
+    # Plot
+    rendered = render.render(jobs, workers=workers, figsize=figsize, dpi=dpi)
+
+    # Written PNG paths, by layer
+    return dict(zip(layers, rendered))
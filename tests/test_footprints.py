@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+from modules import footprints
+from modules.granule_cache import cache_path
+
+NAME = 'EMIT_L2A_RFL_001_20230605T150000_2315610_003.nc'
+
+
+@pytest.fixture(params=['numpy', 'rtree'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        monkeypatch.setattr(footprints, 'rtree_index', None)
+    else:
+        monkeypatch.setattr(footprints, 'rtree_index', pytest.importorskip('rtree').index)
+    return request.param
+
+
+def granule(ur, ring, acquired):
+    return {'umm': {'GranuleUR': ur, 'TemporalExtent': {'RangeDateTime': {'BeginningDateTime': acquired + 'T15:00:00Z'}},
+                    'SpatialExtent': {'HorizontalSpatialDomain': {'Geometry': {
+                        'GPolygons': [{'Boundary': {'Points': [{'Longitude': x, 'Latitude': y} for x, y in ring]}}]}}}}}
+
+
+def cached(cache_dir, ur, ring, acquired, name=NAME):
+    # A granule file in the cache, with its footprint recorded
+    path = cache_path(ur, name, str(cache_dir))
+    (cache_dir / ur).mkdir(exist_ok=True)
+    open(path, 'wb').close()
+    return footprints.record(path, granule(ur, ring, acquired), ur, name, cache_dir=str(cache_dir))
+
+
+def record(i, bounds, acquired='2023-06-05', product='EMITL2ARFL'):
+    w, s, e, n = bounds
+    return {'granule_id': f'G{i}', 'name': NAME, 'product': product, 'acquired': acquired, 'bounds': list(bounds),
+            'rings': [[(w, s), (e, s), (e, n), (w, n)]]}
+
+
+def ids(records):
+    # Candidates come in R-tree order
+    return sorted(r['granule_id'] for r in records)
+
+
+def test_query(backend):
+    index = footprints.FootprintIndex([record(0, (0, 0, 1, 1)), record(1, (0.5, 0.5, 2, 2), '2023-07-01'),
+                                       record(2, (0, 0, 1, 1), product='EMITL2BMIN')])
+    day = footprints.search.parse_date
+
+    assert ids(index.query(0.75, 0.75)) == ['G0', 'G1', 'G2']
+    assert ids(index.query(0.75, 0.75, product='EMITL2ARFL')) == ['G0', 'G1']
+    assert ids(index.query(0.75, 0.75, day('2023-06-01'), day('2023-06-30'), 'EMITL2ARFL')) == ['G0']
+    assert ids(index.query(1.5, 1.5)) == ['G1']
+    assert index.query(3, 3) == []
+    assert footprints.FootprintIndex([]).query(0, 0) == []
+
+
+def test_query_confirms_the_polygon(backend):
+    # Inside the bounding box of a triangle, outside the triangle
+    triangle = record(0, (0, 0, 1, 1))
+    triangle['rings'] = [[(0, 0), (1, 0), (0, 1)]]
+    index = footprints.FootprintIndex([triangle])
+
+    assert index.query(0.2, 0.2) == [triangle]
+    assert index.query(0.8, 0.8) == []
+
+
+def test_record(tmp_path, backend):
+    entry = cached(tmp_path, 'G1', [(0, 0), (2, 0), (2, 1), (0, 1)], '2023-06-05')
+
+    assert entry['product'] == 'EMITL2ARFL' and entry['acquired'] == '2023-06-05'
+    assert entry['bounds'] == [0, 0, 2, 1]
+    assert (tmp_path / 'G1' / (NAME + '.umm.json')).is_file()
+    assert ids(footprints.load(str(tmp_path)).query(1, 0.5)) == ['G1']
+
+    # Recorded once
+    assert footprints.record(cache_path('G1', NAME, str(tmp_path)), granule('G1', [], '2023-06-05'), 'G1', NAME,
+                             cache_dir=str(tmp_path)) is None
+
+
+def test_record_drops_evicted_granules(tmp_path, backend):
+    cached(tmp_path, 'G1', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-05')
+    (tmp_path / 'G1' / NAME).unlink()
+    cached(tmp_path, 'G2', [(5, 5), (6, 5), (6, 6), (5, 6)], '2023-06-05')
+
+    assert ids(footprints.load(str(tmp_path)).records) == ['G2']
+
+
+def test_record_without_date(tmp_path):
+    path = cache_path('G1', NAME, str(tmp_path))
+    no_date = granule('G1', [(0, 0), (1, 0), (1, 1)], '2023-06-05')
+    no_date['umm']['TemporalExtent'] = {}
+
+    assert footprints.record(path, no_date, 'G1', NAME, cache_dir=str(tmp_path)) is None
+
+
+def test_covering(tmp_path, backend):
+    cached(tmp_path, 'G1', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-05')
+    cached(tmp_path, 'G2', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-09')
+    bx = ('0.4', '0.4', '0.6', '0.6')
+
+    found, acquired = footprints.covering('EMITL2ARFL', bx, ('2023-06-05', '2023-06-30'), str(tmp_path))
+    assert (found['umm']['GranuleUR'], acquired) == ('G1', '2023-06-05')
+
+    # Acquired after the start date: the catalogue may know a closer granule, exact lookups skip it
+    assert footprints.covering('EMITL2ARFL', bx, ('2023-06-04', '2023-06-30'), str(tmp_path), tolerance=0) == (None, None)
+    found, acquired = footprints.covering('EMITL2ARFL', bx, ('2023-06-04', '2023-06-30'), str(tmp_path), tolerance=7)
+    assert acquired == '2023-06-05'
+    found, acquired = footprints.covering('EMITL2ARFL', bx, ('2023-06-09', '2023-06-30'), str(tmp_path))
+    assert found['umm']['GranuleUR'] == 'G2'
+
+    # Other product, place or dates
+    assert footprints.covering('EMITL2BMIN', bx, ('2023-06-05', '2023-06-30'), str(tmp_path)) == (None, None)
+    assert footprints.covering('EMITL2ARFL', ('3', '3', '4', '4'), ('2023-06-05', '2023-06-30'), str(tmp_path)) == (None, None)
+    assert footprints.covering('EMITL2ARFL', bx, ('2023-07-01', '2023-07-31'), str(tmp_path), tolerance=30) == (None, None)
+
+
+def test_covering_month_order(tmp_path, backend):
+    # As the app asks: the whole month, a granule acquired mid-month in the cache
+    cached(tmp_path, 'G1', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-17')
+
+    found, acquired = footprints.covering('EMITL2ARFL', ('0.4', '0.4', '0.6', '0.6'), ('2023-06-01', '2023-06-30'), str(tmp_path))
+
+    assert (found['umm']['GranuleUR'], acquired) == ('G1', '2023-06-17')
+
+
+def test_covering_repeats_the_search_pick(tmp_path, backend):
+    cached(tmp_path, 'G1', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-05')
+    cached(tmp_path, 'G2', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-20')
+    bx, date = ('0.4', '0.4', '0.6', '0.6'), ('2023-06-01', '2023-06-30')
+
+    # The catalogue picked G2 for this request (e.g. G1 was not cached yet then)
+    footprints.remember('EMITL2ARFL', bx, date, 'G2', NAME, '2023-06-20', cache_dir=str(tmp_path))
+
+    found, acquired = footprints.covering('EMITL2ARFL', bx, date, str(tmp_path), tolerance=0)
+    assert (found['umm']['GranuleUR'], acquired) == ('G2', '2023-06-20')
+    # Any other request goes through the index
+    found, _ = footprints.covering('EMITL2ARFL', bx, ('2023-06-05', '2023-06-30'), str(tmp_path))
+    assert found['umm']['GranuleUR'] == 'G1'
+
+    # Evicted: back to the index, then the catalogue
+    (tmp_path / 'G2' / NAME).unlink()
+    assert footprints.covering('EMITL2ARFL', bx, date, str(tmp_path), tolerance=0) == (None, None)
+
+
+def test_covering_needs_the_cached_file(tmp_path, backend):
+    cached(tmp_path, 'G1', [(0, 0), (1, 0), (1, 1), (0, 1)], '2023-06-05')
+    (tmp_path / 'G1' / NAME).unlink()
+
+    assert footprints.covering('EMITL2ARFL', ('0.4', '0.4', '0.6', '0.6'), ('2023-06-05', '2023-06-30'), str(tmp_path)) == (None, None)
@@ -0,0 +1,65 @@
+import pytest
+import requests
+
+service = pytest.importorskip('service')
+
+
+@pytest.fixture(autouse=True)
+def no_sessions(monkeypatch):
+    monkeypatch.setattr(service, '_sessions', {})
+    monkeypatch.setattr(service, '_auth', {})
+
+
+class FakeAuth:
+    # Earthdata login accepting one password
+    attempts = []
+
+    def login(self, strategy='netrc'):
+        self.user = service.os.environ['EARTHDATA_USERNAME']
+        self.authenticated = service.os.environ['EARTHDATA_PASSWORD'] == 'secret'
+        FakeAuth.attempts.append(self.user)
+        return self
+
+
+def test_login_caches_successful_logins_only(monkeypatch):
+    monkeypatch.setattr(service.earthaccess, 'Auth', FakeAuth)
+    monkeypatch.delenv('EARTHDATA_USERNAME', raising=False)
+    FakeAuth.attempts = []
+
+    with pytest.raises(PermissionError, match='login failed'):
+        service.login('user', 'wrong')
+    with pytest.raises(PermissionError):
+        service.login('user', 'wrong')
+    auth = service.login('user', 'secret')
+
+    assert service.login('user', 'secret') is auth
+    assert FakeAuth.attempts == ['user', 'user', 'user']
+    # The credentials do not stay in the process environment
+    assert 'EARTHDATA_USERNAME' not in service.os.environ
+
+
+def test_download_session_per_credentials():
+    first = service.download_session('user', 'secret')
+
+    assert service.download_session('user', 'secret') is first
+    other = service.download_session('user', 'wrong')
+    assert other is not first
+    assert other.credentials == ('user', 'wrong')
+
+
+def test_rejected_credentials_drop_the_session(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(service.granule_cache, 'fetch', lambda granule_id, name_file, fetch: fetch(str(tmp_path / name_file)))
+
+    def denied(url, path, sess=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 401
+        raise requests.HTTPError('401 Unauthorized', response=response)
+
+    monkeypatch.setattr(service.download, 'download', denied)
+    granule = {'umm': {'GranuleUR': 'G1', 'RelatedUrls': [{}, {'URL': 'https://data/G1.nc'}]}}
+    first = service.download_session('user', 'wrong')
+
+    with pytest.raises(requests.HTTPError):
+        service.download_granule('user', 'wrong', granule, 'job')
+    assert service.download_session('user', 'wrong') is not first
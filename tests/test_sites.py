@@ -0,0 +1,110 @@
+import json
+import numpy as np
+import pytest
+from modules import sites
+
+
+def granule(ur, ring):
+    return {'umm': {'GranuleUR': ur, 'SpatialExtent': {'HorizontalSpatialDomain': {'Geometry': {
+        'GPolygons': [{'Boundary': {'Points': [{'Longitude': x, 'Latitude': y} for x, y in ring]}}]}}}}}
+
+
+SQUARE = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+
+
+def test_read_sites_csv(tmp_path):
+    path = tmp_path / 'sites.csv'
+    path.write_text('ID, Longitude, Latitude, start, end\nA,-69.1,-22.9,2023-01-01,2023-02-01\nB,-69.2,-23.0,,\n')
+
+    a, b = sites.read_sites(str(path), date=('2023-06-01', '2023-06-30'), window=10)
+
+    assert (a['id'], a['lon'], a['lat'], a['date']) == ('A', -69.1, -22.9, ('2023-01-01', '2023-02-01'))
+    assert b['date'] == ('2023-06-01', '2023-06-30')
+    assert [float(x) for x in a['bbox']] == pytest.approx([-69.1 - 10 * sites.PIXEL, -22.9 - 10 * sites.PIXEL,
+                                                           -69.1 + 10 * sites.PIXEL, -22.9 + 10 * sites.PIXEL])
+
+
+def test_read_sites_geojson(tmp_path):
+    path = tmp_path / 'sites.geojson'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': 'mine', 'geometry': {'type': 'Point', 'coordinates': [-69.1, -22.9]}, 'properties': {}},
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-69.2, -23.0, 3000]},
+         'properties': {'name': 'camp', 'start': '2023-03-01', 'end': '2023-03-31'}}]}))
+
+    mine, camp = sites.read_sites(str(path), date=('2023-06-01', '2023-06-30'))
+
+    assert (mine['id'], mine['date']) == ('mine', ('2023-06-01', '2023-06-30'))
+    assert (camp['id'], camp['lon'], camp['lat'], camp['date']) == ('camp', -69.2, -23.0, ('2023-03-01', '2023-03-31'))
+
+
+def test_read_sites_rejects_duplicates_and_missing_dates(tmp_path):
+    path = tmp_path / 'sites.csv'
+    path.write_text('id,lon,lat\nA,1,1\nA,2,2\n')
+    with pytest.raises(ValueError, match='unique'):
+        sites.read_sites(str(path), date=('2023-06-01', '2023-06-30'))
+
+    path.write_text('id,lon,lat\nA,1,1\n')
+    with pytest.raises(ValueError, match='date'):
+        sites.read_sites(str(path))
+
+
+def test_contains():
+    rings = [np.array(SQUARE, dtype=float)]
+    assert sites.contains(rings, 0.5, 0.5)
+    assert not sites.contains(rings, 1.5, 0.5)
+    assert not sites.contains([], 0.5, 0.5)
+
+    # Concave ring: the notch is outside
+    notched = [[(0, 0), (3, 0), (3, 3), (2, 3), (2, 1), (1, 1), (1, 3), (0, 3)]]
+    assert sites.contains(notched, 0.5, 2)
+    assert not sites.contains(notched, 1.5, 2)
+
+
+def test_group_sites_searches_once_per_granule():
+    site_list = [{'id': str(i), 'lon': lon, 'lat': lat, 'date': ('2023-06-01', '2023-06-30')}
+                 for i, (lon, lat) in enumerate([(0.2, 0.2), (0.8, 0.8), (5.5, 5.5), (0.5, 0.5), (9, 9)])]
+    searched = []
+
+    def find(site):
+        searched.append(site['id'])
+        if site['lon'] < 1:
+            return granule('G1', SQUARE), '2023-06-02'
+        if site['lon'] < 6:
+            return granule('G2', [(x + 5, y + 5) for x, y in SQUARE]), '2023-06-03'
+        return None, None
+
+    groups, missing = sites.group_sites(site_list, find)
+
+    assert searched == ['0', '2', '4']
+    assert [[s['id'] for s in g['sites']] for g in groups] == [['0', '1', '3'], ['2']]
+    assert [g['acquired'] for g in groups] == ['2023-06-02', '2023-06-03']
+    assert [s['id'] for s in missing] == ['4']
+
+
+def test_group_sites_dedups_granules_by_id():
+    # Same granule returned for a site its footprint does not list (e.g. a different date range)
+    site_list = [{'id': 'a', 'lon': 0.5, 'lat': 0.5, 'date': ('2023-06-01', '2023-06-30')},
+                 {'id': 'b', 'lon': 0.5, 'lat': 0.5, 'date': ('2023-06-01', '2023-07-31')}]
+
+    groups, missing = sites.group_sites(site_list, lambda site: (granule('G1', SQUARE), '2023-06-02'))
+
+    assert len(groups) == 1 and not missing
+    assert [s['id'] for s in groups[0]['sites']] == ['a', 'b']
+
+
+def test_crop():
+    # Ortho grid of 10x10 cells of 0.1 degree from (0, 1), mapped one to one on the raw pixels
+    rows, cols = np.meshgrid(np.arange(10), np.arange(10), indexing='ij')
+    index = {'geotransform': np.array([0, 0.1, 0, 1, 0, -0.1]), 'rows': rows, 'cols': cols}
+    products = {'ndvi': np.arange(100.0).reshape(10, 10), 'rgb': np.zeros((10, 10, 3))}
+
+    crops = sites.crop(products, index, 0.45, 0.55, window=1)
+
+    assert crops['ndvi'].tolist() == [[33, 34, 35], [43, 44, 45], [53, 54, 55]]
+    assert crops['rgb'].shape == (3, 3, 3)
+
+    # Clipped at the edge of the granule
+    assert sites.crop(products, index, 0.05, 0.95, window=2)['ndvi'].shape == (3, 3)
+
+    with pytest.raises(ValueError):
+        sites.crop(products, index, 5, 5, window=1)